@@ -1,5 +1,7 @@
 import requests
 import json
+import os
+from concurrent.futures import ThreadPoolExecutor
 import pandas as pd
 from tqdm import tqdm
 import numpy as np
@@ -8,7 +10,9 @@ from typing import List
 from pandas import DataFrame
 
 ######Global Params#######
-graph_url = 'https://api.thegraph.com/subgraphs/name/uniswap/uniswap-v2'
+hosted_graph_url = 'https://api.thegraph.com/subgraphs/name/uniswap/uniswap-v2'
+#Can be pointed to a local stub server (see stub_server.py)
+graph_url = os.environ.get('UNISWAP_SUBGRAPH_URL', hosted_graph_url)
 
 col_data_types = {'amount0': float, 'amount1': float, 'logIndex': int, 'liquidity': float,
                   'amount0In': float, 'amount0Out': float, 'amount1In': float, 'amount1Out': float}
@@ -127,7 +131,7 @@ def query_builder(main: str, fields: List[str], first: int = 100,
     
     return query
 
-def pull_data(query_function: PaginatedQuery) -> DataFrame:
+def pull_data(query_function: "PaginatedQuery") -> DataFrame:
     """
     Function to pull query data then process
 
@@ -145,7 +149,7 @@ def pull_data(query_function: PaginatedQuery) -> DataFrame:
     
     #Pull the data
     data = query_function.run_queries()
-    data['timestamp'] = pd.to_datetime(data['timestamp'], unit = 's')
+    data['timestamp'] = pd.to_datetime(data['timestamp'].astype(int), unit = 's')
     data['event'] = query_function.data_field
     
     #Create mapping of column data types
@@ -498,7 +502,8 @@ class PaginatedQuery:
             output.append(data)
 
 def create_data(start_date: datetime,
-                      end_date: datetime) -> DataFrame:
+                      end_date: datetime,
+                      max_workers: int = 1) -> DataFrame:
     """
     A function for pulling and processing the uniswap data
 
@@ -508,6 +513,8 @@ def create_data(start_date: datetime,
         The start date of the data
     end_date : datetime, optional
         The end date of the data
+    max_workers : int, optional
+        Number of event queries to run concurrently
 
     Returns
     -------
@@ -536,7 +543,8 @@ def create_data(start_date: datetime,
         
     #Pull the data
     queries = [mint_query, burns_query, swaps_query]
-    data = [pull_data(q) for q in queries]
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        data = list(executor.map(pull_data, queries))
     data = process_data(data)
     
     #Add in starting state
@@ -1,9 +1,10 @@
 from uniswap_digital_twin.extrapolation_cycle import extrapolation_cycle
+from uniswap_digital_twin.service import serve as serve_forecasts
 import click
 import os
 
 
-@click.command()
+@click.group(invoke_without_command=True)
 @click.option('-p', '--past-days', 'past_days',
               default=14,
               help="Number of past days to download")
@@ -13,13 +14,62 @@ import os
 @click.option('-l', '--use-last-data', 'use_last_data',
               is_flag=True,
               help="Use last retrieved data rather than downloading it")
-def main(use_last_data, past_days, extrapolation_timesteps) -> None:
+@click.option('--no-cache', 'no_cache',
+              is_flag=True,
+              help="Bypass the backtest and extrapolation result cache")
+@click.option('--engine', 'engine',
+              type=click.Choice(['cadCAD', 'batched', 'event_driven', 'population', 'distributed']),
+              default='cadCAD',
+              help="Simulation engine for the extrapolation")
+@click.option('--rpc-url', 'rpc_url',
+              default=None,
+              help="Retrieve the pair logs from this JSON-RPC node rather than the subgraph")
+@click.option('--resume', 'resume',
+              default=None,
+              help="Runtime of a previous cycle whose up-to-date artifacts are reused")
+@click.option('--adaptive-rtol', 'adaptive_rtol',
+              default=None, type=float,
+              help="Sample until the forecast intervals are within this relative tolerance")
+@click.option('--time-budget', 'time_budget',
+              default=None, type=float,
+              help="Seconds of adaptive sampling")
+@click.option('--cluster', 'cluster',
+              default=None,
+              help="Serve the distributed engine tasks on this host:port rather than on a local cluster")
+@click.pass_context
+def main(ctx, use_last_data, past_days, extrapolation_timesteps, no_cache, engine, rpc_url, resume,
+         adaptive_rtol, time_budget, cluster) -> None:
+    """
+    Run an extrapolation cycle, or one of the commands below.
+    """
+    if ctx.invoked_subcommand is not None:
+        return
     extrapolation_cycle(use_last_data=use_last_data,
                         historical_interval=past_days,
-                        extrapolation_timesteps=extrapolation_timesteps)
+                        extrapolation_timesteps=extrapolation_timesteps,
+                        simulation_engine=engine,
+                        use_cache=not no_cache,
+                        rpc_url=rpc_url,
+                        resume=resume,
+                        adaptive_rtol=adaptive_rtol,
+                        adaptive_time_budget=time_budget,
+                        cluster_address=cluster)
 
     # %%
 
 
+@main.command()
+@click.option('--data-path', 'data_path', default='data/runs', help="Runs folder")
+@click.option('--host', 'host', default='127.0.0.1', help="Interface to listen on")
+@click.option('--port', 'port', default=8050, help="Port to listen on")
+@click.option('--refresh-interval', 'refresh_interval', default=30.0,
+              help="Seconds between checks for a newly finished cycle")
+def serve(data_path, host, port, refresh_interval) -> None:
+    """
+    Serve the latest forecasts over HTTP/JSON.
+    """
+    serve_forecasts(data_path, host, port, refresh_interval)
+
+
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,256 @@
+from dataclasses import dataclass, field
+from time import perf_counter
+from typing import Dict, List, Sequence
+import numpy as np
+import pandas as pd
+from estimators import Estimate, mean_estimate, quantile_estimate
+from stochastic import SignalFit, generate_samples
+
+# Adaptive Monte Carlo extrapolation: signal samples are drawn and
+# extrapolated in batches until the confidence intervals of the target
+# metrics of every agent type are narrow enough, or the sample or time
+# budget is spent. The next batch is sized from the current variance.
+
+TARGET_METRICS = ('final_RAI_balance', 'final_ETH_balance', 'tracking_error')
+# Order of the agent type sweep of `extrapolation_cycle.extrapolate_data`,
+# for engines which do not label their subsets on `attrs['agent_types']`
+AGENT_TYPES = ('Arb1', 'Arb2')
+
+
+@dataclass
+class AdaptiveResult():
+    extrapolation: pd.DataFrame
+    # Signal of each run, as (samples, timesteps)
+    signals: np.ndarray
+    # Estimate of each target metric, per agent type
+    estimates: Dict[str, Dict[str, Estimate]]
+    samples: int
+    batches: int
+    stop_reason: str
+    elapsed: float
+    rtol: float
+    history: List[dict] = field(default_factory=list)
+
+    @property
+    def converged(self) -> bool:
+        return self.stop_reason == 'tolerance'
+
+    def precision(self) -> Dict[str, Dict[str, dict]]:
+        return {agent: {metric: {'value': e.value,
+                                 'half_width': e.half_width,
+                                 'relative_half_width': relative_half_width(e)}
+                        for (metric, e) in estimates.items()}
+                for (agent, estimates) in self.estimates.items()}
+
+    def metadata(self) -> dict:
+        """
+        Achieved precision and sample count, for the run metadata.
+        """
+        return {'samples': self.samples,
+                'batches': self.batches,
+                'converged': self.converged,
+                'stop_reason': self.stop_reason,
+                'elapsed': self.elapsed,
+                'rtol': self.rtol,
+                'precision': self.precision()}
+
+
+def relative_half_width(estimate: Estimate) -> float:
+    if estimate.value == 0:
+        return 0.0 if estimate.half_width == 0 else np.inf
+    return abs(estimate.half_width / estimate.value)
+
+
+def path_metrics(extrapolation: pd.DataFrame, signals: np.ndarray) -> pd.DataFrame:
+    """
+    Target metrics of every (subset, run) path: the final reserves, and
+    the root mean square log deviation of the pool ratio from the signal.
+    Runs are numbered from 1 on the rows of `signals`. Event-driven
+    results are matched to the signal of their hour.
+    """
+    df = extrapolation[extrapolation['timestep'] > 0]
+    run = df['run'].to_numpy(dtype=np.int64) - 1
+    if 'time' in df.columns:
+        hour = np.floor(df['time'].to_numpy()).astype(np.int64)
+    else:
+        hour = df['timestep'].to_numpy(dtype=np.int64) - 1
+    hour = np.minimum(hour, signals.shape[1] - 1)
+    ratio = df['RAI_balance'].to_numpy() / df['ETH_balance'].to_numpy()
+    squared_error = np.log(ratio / signals[run, hour]) ** 2
+
+    keys = [df['subset'].to_numpy(), df['run'].to_numpy()]
+    grouped = pd.DataFrame({'subset': keys[0], 'run': keys[1],
+                            'RAI_balance': df['RAI_balance'].to_numpy(),
+                            'ETH_balance': df['ETH_balance'].to_numpy(),
+                            'squared_error': squared_error}).groupby(['subset', 'run'], sort=True)
+    last = grouped[['RAI_balance', 'ETH_balance']].last()
+    metrics = pd.DataFrame({'final_RAI_balance': last['RAI_balance'],
+                            'final_ETH_balance': last['ETH_balance'],
+                            'tracking_error': np.sqrt(grouped['squared_error'].mean())})
+    return metrics.reset_index()
+
+
+def estimate_metrics(metrics: pd.DataFrame,
+                     confidence: float = 0.95,
+                     quantile: float = None,
+                     antithetic_batches: List[np.ndarray] = None,
+                     agent_types: Sequence[str] = AGENT_TYPES) -> Dict[str, Dict[str, Estimate]]:
+    """
+    Estimate of the mean (or of `quantile`) of every target metric per
+    agent type. With `antithetic_batches`, the mean of each batch is
+    estimated on its mirrored pairs of runs, and the batches are pooled
+    weighted by their number of pairs.
+    """
+    estimates = {}
+    for (subset, paths) in metrics.groupby('subset'):
+        agent = agent_types[subset] if subset < len(agent_types) else str(subset)
+        paths = paths.set_index('run')
+        estimates[agent] = {}
+        for metric in TARGET_METRICS:
+            if quantile is not None:
+                estimates[agent][metric] = quantile_estimate(paths[metric].to_numpy(), quantile, confidence)
+                continue
+            if antithetic_batches is not None:
+                batches = [mean_estimate(paths[metric].reindex(runs).to_numpy(), confidence, antithetic=True)
+                           for runs in antithetic_batches]
+                pairs = np.array([e.samples // 2 for e in batches])
+                value = np.dot(pairs, [e.value for e in batches]) / pairs.sum()
+                # Pooled within-batch variance, a single pair having none
+                variances = np.array([(p - 1) * p * e.half_width ** 2 if p > 1 else 0.0
+                                      for (p, e) in zip(pairs, batches)])
+                half_width = np.sqrt(variances.sum() / max((pairs - 1).sum(), 1) / pairs.sum())
+                estimate = Estimate(float(value), float(half_width), len(paths))
+            else:
+                estimate = mean_estimate(paths[metric].to_numpy(), confidence)
+            estimates[agent][metric] = Estimate(estimate.value, estimate.half_width, len(paths))
+    return estimates
+
+
+def next_batch_size(estimates: Dict[str, Dict[str, Estimate]],
+                    samples: int,
+                    rtol: float,
+                    batch_size: int,
+                    max_samples: int) -> int:
+    """
+    Samples expected to bring the widest interval to `rtol`, as the half
+    width shrinks with the square root of the sample count. Bounded by
+    `batch_size` below and by doubling the sample count above.
+    """
+    widest = max(relative_half_width(e) for metrics in estimates.values() for e in metrics.values())
+    needed = samples * (widest / rtol) ** 2 - samples if np.isfinite(widest) else samples
+    size = int(np.clip(np.ceil(needed), batch_size, max(samples, batch_size)))
+    size += size % 2
+    return min(size, max_samples - samples)
+
+
+def adaptive_extrapolation(backtesting_data: pd.DataFrame,
+                           bt: pd.DataFrame,
+                           signal_params: SignalFit,
+                           timesteps: int,
+                           engine: str = 'batched',
+                           rtol: float = 0.001,
+                           time_budget: float = None,
+                           batch_size: int = 32,
+                           min_samples: int = 64,
+                           max_samples: int = 10_000,
+                           confidence: float = 0.95,
+                           quantile: float = None,
+                           process: str = 'random_walk',
+                           sampling: str = 'pseudo',
+                           seed: int = 0,
+                           cluster: str = None,
+                           log=print,
+                           **process_kwargs) -> AdaptiveResult:
+    """
+    Extrapolate batches of signal samples until every target metric of
+    every agent type has a relative confidence interval half width below
+    `rtol`, `time_budget` seconds have passed or `max_samples` are drawn.
+
+    Parameters
+    ----------
+    backtesting_data, bt : pd.DataFrame
+        Prepared events and backtest results, as for `extrapolate_data`
+    signal_params : SignalFit
+        Fitted signal parameters, with the log ratio process on `ratio`
+    engine : str
+        Simulation engine of `extrapolate_data`. The cadCAD engine runs
+        one call per signal sample.
+    quantile : float, optional
+        Estimate this quantile of the metrics rather than their mean
+    seed : int
+        Seed of the first batch, the following ones taking the next seeds
+    cluster : str, optional
+        Coordinator address of the distributed engine
+
+    Returns
+    -------
+    AdaptiveResult
+        With the results of all batches, runs being numbered across them
+
+    """
+    # HACK
+    from extrapolation_cycle import extrapolate_data
+
+    t1 = perf_counter()
+    signal_length = timesteps + 10
+    initial_ratio = np.expm1(signal_params.initial_ratio)
+    batch_size += batch_size % 2
+    if sampling == 'antithetic':
+        # Each batch is mirrored on itself, so that its size must stay even
+        min_samples += min_samples % 2
+        max_samples -= max_samples % 2
+    (frames, signal_batches, metric_batches, antithetic_batches, history) = ([], [], [], [], [])
+    fee_band_skip = {}
+    (samples, batch, size) = (0, 0, max(batch_size, min(min_samples, max_samples)))
+    while True:
+        signals = generate_samples(process, signal_params.ratio, signal_length, size,
+                                   signal_params.initial_ratio, seed=seed + batch,
+                                   sampling=sampling, **process_kwargs)
+        if engine == 'cadCAD':
+            results = [extrapolate_data(backtesting_data, tuple({'ratio': el} for el in signal),
+                                        timesteps, initial_ratio, bt, engine).assign(run=i + 1)
+                       for (i, signal) in enumerate(signals)]
+            result = pd.concat(results, ignore_index=True)
+        else:
+            result = extrapolate_data(backtesting_data,
+                                      tuple(tuple({'ratio': el} for el in signal) for signal in signals),
+                                      timesteps, initial_ratio, bt, engine, cluster)
+            for (k, v) in result.attrs.get('fee_band_skip', {}).items():
+                fee_band_skip[k] = fee_band_skip.get(k, 0) + v
+        result['run'] += samples
+        frames.append(result)
+        signal_batches.append(signals)
+        antithetic_batches.append(np.arange(samples + 1, samples + size + 1))
+        (samples, batch) = (samples + size, batch + 1)
+
+        all_signals = np.concatenate(signal_batches)
+        metric_batches.append(path_metrics(result, all_signals))
+        estimates = estimate_metrics(pd.concat(metric_batches, ignore_index=True), confidence, quantile,
+                                     antithetic_batches if sampling == 'antithetic' else None,
+                                     result.attrs.get('agent_types', AGENT_TYPES))
+        widest = max(relative_half_width(e) for m in estimates.values() for e in m.values())
+        elapsed = perf_counter() - t1
+        history.append({'samples': samples, 'widest': widest, 'elapsed': elapsed})
+        log(f"Batch {batch}: {samples} samples, widest relative half width {widest:.2e}")
+
+        size = next_batch_size(estimates, samples, rtol, batch_size, max_samples)
+        if samples >= min_samples and widest <= rtol:
+            stop_reason = 'tolerance'
+        elif samples >= max_samples:
+            stop_reason = 'max_samples'
+        elif time_budget is not None and elapsed * (samples + size) / samples > time_budget:
+            # The next batch would not fit in the budget
+            stop_reason = 'time_budget'
+        else:
+            continue
+        break
+
+    extrapolation = pd.concat(frames, ignore_index=True)
+    if fee_band_skip:
+        extrapolation.attrs['fee_band_skip'] = fee_band_skip
+    if 'agent_types' in frames[0].attrs:
+        extrapolation.attrs['agent_types'] = frames[0].attrs['agent_types']
+    result = AdaptiveResult(extrapolation, all_signals, estimates, samples, batch,
+                            stop_reason, perf_counter() - t1, rtol, history)
+    extrapolation.attrs['adaptive'] = result.metadata()
+    return result
@@ -0,0 +1,160 @@
+import numpy as np
+import pandas as pd
+from Types import BacktestingData
+
+SWAP_EVENTS = ('tokenPurchase', 'ethPurchase')
+LIQUIDITY_EVENTS = ('mint', 'burn')
+DELTA_COLUMNS = ['token_delta', 'eth_delta', 'UNI_delta']
+STATE_COLUMNS = ['token_balance', 'eth_balance', 'UNI_supply']
+
+
+def aggregate_events(events: BacktestingData, bucket: str = '1h') -> BacktestingData:
+    """
+    Net the Uniswap events into time buckets.
+
+    Every bucket yields at most two events: the netted liquidity flow
+    (a `mint` or a `burn`, depending on the sign of the UNI delta) followed
+    by the netted swap flow (an `ethPurchase` when RAI flows into the pool,
+    a `tokenPurchase` otherwise). The state columns of the netted swap are
+    the pool state at the end of the bucket, so arbitrage trades on the
+    backtest target the closing ratio of each bucket.
+
+    The first row is kept as-is, as it holds the initial state of the
+    backtest.
+
+    Parameters
+    ----------
+    events : BacktestingData
+        Event level data, as returned by `Data.create_data`
+    bucket : str
+        Pandas offset alias for the bucket size
+
+    Returns
+    -------
+    BacktestingData
+        Netted events with an additional `n_events` column with the number
+        of raw events on each row
+
+    """
+    head = events.iloc[:1].assign(n_events=1)
+    tail = events.iloc[1:]
+    timestamps = pd.to_datetime(tail['timestamp'])
+    buckets = timestamps.dt.floor(bucket).rename('bucket')
+
+    # End of bucket state and timestamps
+    closing = tail[STATE_COLUMNS].groupby(buckets).last()
+    closing['timestamp'] = timestamps.groupby(buckets).max()
+
+    is_swap = tail['event'].isin(SWAP_EVENTS)
+    is_liquidity = tail['event'].isin(LIQUIDITY_EVENTS)
+
+    swaps = tail.loc[is_swap, DELTA_COLUMNS].groupby(buckets[is_swap])
+    swap_flows = swaps.sum().reindex(closing.index, fill_value=0.0)
+    swap_counts = swaps.size().reindex(closing.index, fill_value=0)
+
+    liquidity = tail.loc[is_liquidity, DELTA_COLUMNS].groupby(buckets[is_liquidity])
+    liquidity_flows = liquidity.sum().reindex(closing.index, fill_value=0.0)
+    liquidity_counts = liquidity.size().reindex(closing.index, fill_value=0)
+
+    # Liquidity events are applied before the swaps of the same bucket
+    liquidity_rows = pd.DataFrame({
+        'token_delta': liquidity_flows['token_delta'],
+        'eth_delta': liquidity_flows['eth_delta'],
+        'UNI_delta': liquidity_flows['UNI_delta'],
+        'timestamp': closing['timestamp'],
+        'event': np.where(liquidity_flows['UNI_delta'] > 0, 'mint', 'burn'),
+        'token_balance': closing['token_balance'] - swap_flows['token_delta'],
+        'eth_balance': closing['eth_balance'] - swap_flows['eth_delta'],
+        'UNI_supply': closing['UNI_supply'],
+        'n_events': liquidity_counts,
+        'order': 0
+    })
+    liquidity_rows = liquidity_rows[liquidity_rows['UNI_delta'] != 0]
+
+    swap_rows = pd.DataFrame({
+        'token_delta': swap_flows['token_delta'],
+        'eth_delta': swap_flows['eth_delta'],
+        'UNI_delta': 0.0,
+        'timestamp': closing['timestamp'],
+        'event': np.where(swap_flows['token_delta'] > 0, 'ethPurchase', 'tokenPurchase'),
+        'token_balance': closing['token_balance'],
+        'eth_balance': closing['eth_balance'],
+        'UNI_supply': closing['UNI_supply'],
+        'n_events': swap_counts,
+        'order': 1
+    })
+    swap_rows = swap_rows[(swap_rows['token_delta'] != 0)
+                          | (swap_rows['eth_delta'] != 0)]
+
+    netted = (pd.concat([liquidity_rows, swap_rows])
+                .reset_index()
+                .sort_values(['bucket', 'order'])
+                .drop(columns=['bucket', 'order']))
+    if 'logIndex' in events.columns:
+        netted['logIndex'] = np.nan
+    head = head.assign(timestamp=pd.to_datetime(head['timestamp']))
+    output = pd.concat([head, netted[head.columns]], ignore_index=True)
+    return output
+
+
+def bucket_closing_index(events: BacktestingData, bucket: str = '1h') -> pd.Series:
+    """
+    Positional index of the last event in each bucket.
+    """
+    timestamps = pd.to_datetime(events['timestamp']).iloc[1:]
+    positions = pd.Series(np.arange(1, len(events)), index=timestamps.index)
+    return positions.groupby(timestamps.dt.floor(bucket).values).last()
+
+
+def aggregation_error(events: BacktestingData,
+                      full_sim: pd.DataFrame,
+                      aggregated_events: BacktestingData,
+                      aggregated_sim: pd.DataFrame,
+                      bucket: str = '1h') -> pd.DataFrame:
+    """
+    Error bounds of an aggregated backtest against the full event-level
+    replay, evaluated at the end of every bucket.
+
+    Returns
+    -------
+    DataFrame
+        Max absolute error, RMSE and max relative error for each
+        state variable
+
+    """
+    full_close = full_sim.reset_index(drop=True).iloc[
+        bucket_closing_index(events, bucket).values]
+    full_close.index = bucket_closing_index(events, bucket).index
+
+    aggregated_close = aggregated_sim.reset_index(drop=True).iloc[
+        bucket_closing_index(aggregated_events, bucket).values]
+    aggregated_close.index = bucket_closing_index(aggregated_events, bucket).index
+
+    error = aggregated_close - full_close
+    summary = pd.DataFrame({'max_abs_error': error.abs().max(),
+                            'rmse': (error ** 2).mean() ** .5,
+                            'max_rel_error': (error / full_close).abs().max()})
+    return summary
+
+
+def aggregated_backtest_error(events: BacktestingData,
+                              bucket: str = '1h') -> pd.DataFrame:
+    """
+    Run the backtest on both the event level and the bucketed data, and
+    report the error bounds of the latter. The RMSE of both runs against
+    the historical balances is reported alongside for reference.
+    """
+    from extrapolation_cycle import backtest_model, rmse
+
+    (full_sim, full_true, _) = backtest_model(events, report=False)
+    aggregated_events = aggregate_events(events, bucket)
+    (aggregated_sim, aggregated_true, _) = backtest_model(aggregated_events,
+                                                          report=False)
+    summary = aggregation_error(events, full_sim, aggregated_events,
+                                aggregated_sim, bucket)
+    summary['full_rmse_vs_historical'] = rmse(full_true, full_sim)
+    summary['aggregated_rmse_vs_historical'] = rmse(aggregated_true,
+                                                    aggregated_sim)
+    summary['n_steps'] = len(aggregated_events)
+    summary['n_events'] = len(events)
+    return summary
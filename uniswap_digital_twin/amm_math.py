@@ -0,0 +1,114 @@
+from decimal import Decimal
+from fractions import Fraction
+from math import isqrt
+import numpy as np
+import pandas as pd
+from Types import BacktestingData
+
+# Integer-exact Uniswap V2 math. Amounts are converted to wei and the
+# pair contract formulas are evaluated on Python integers, so that the
+# only rounding left is the conversion of the result back to tokens.
+# The float64 path is the one of `policy_aux`, and its vectorized
+# counterpart is on `batched`.
+
+WEI = 10 ** 18
+AMM_MATH_MODES = ('float', 'exact')
+
+
+def to_wei(amount) -> int:
+    """
+    Token amount to wei, through the shortest decimal representation of
+    the float (as read from the subgraph data).
+    """
+    return int(Decimal(repr(float(amount))).scaleb(18))
+
+
+def from_wei(amount: int) -> float:
+    return amount / WEI
+
+
+def fee_multiplier(fee_percentage: float) -> Fraction:
+    """
+    Fraction of the input kept after the fee, eg. 997/1000 for 0.3%.
+    """
+    return 1 - Fraction(repr(fee_percentage))
+
+
+def get_amount_out(amount_in: int, reserve_in: int, reserve_out: int, gamma: Fraction) -> int:
+    amount_in_with_fee = amount_in * gamma.numerator
+    numerator = amount_in_with_fee * reserve_out
+    denominator = reserve_in * gamma.denominator + amount_in_with_fee
+    return numerator // denominator
+
+
+def get_amount_in(amount_out: int, reserve_in: int, reserve_out: int, gamma: Fraction) -> int:
+    numerator = reserve_in * amount_out * gamma.denominator
+    denominator = (reserve_out - amount_out) * gamma.numerator
+    return numerator // denominator + 1
+
+
+def get_delta_I_to_price(P: Fraction, reserve_in: int, reserve_out: int, gamma: Fraction) -> int:
+    """
+    Input that moves the pool to the price `P`, as on `policy_aux.get_delta_I`
+    with the square root taken on integers.
+    """
+    (n, d) = (gamma.numerator, gamma.denominator)
+    radicand = (reserve_in ** 2 * (d - n) ** 2 * P.denominator
+                + 4 * P.numerator * reserve_out * reserve_in * n * d)
+    root = isqrt(radicand * P.denominator) // P.denominator
+    return (root - reserve_in * (d + n)) // (2 * n)
+
+
+def exact_output_amount(delta_I: float, I_t: float, O_t: float, fee_percentage: float) -> float:
+    amount = get_amount_out(to_wei(delta_I), to_wei(I_t), to_wei(O_t),
+                            fee_multiplier(fee_percentage))
+    return from_wei(amount)
+
+
+def exact_input_amount(delta_O: float, I_t: float, O_t: float, fee_percentage: float) -> float:
+    amount = get_amount_in(to_wei(delta_O), to_wei(I_t), to_wei(O_t),
+                           fee_multiplier(fee_percentage))
+    return from_wei(amount)
+
+
+def exact_delta_I(P: float, I_t: float, O_t: float, fee_percentage: float) -> float:
+    amount = get_delta_I_to_price(Fraction(P), to_wei(I_t), to_wei(O_t),
+                                  fee_multiplier(fee_percentage))
+    return from_wei(amount)
+
+
+def swap_error_report(events: BacktestingData, fee_percentage: float = 0.003) -> pd.DataFrame:
+    """
+    Error of the swap output amounts computed by each mode against the
+    historical ones, given the reserves before each swap.
+
+    Returns
+    -------
+    DataFrame
+        Error statistics in tokens, indexed by mode and output token
+
+    """
+    from policy_aux import get_output_amount
+
+    swaps = events[events['event'].isin(['tokenPurchase', 'ethPurchase'])]
+    params = {'fee_percentage': fee_percentage}
+    rows = []
+    for swap in swaps.itertuples():
+        if swap.event == 'tokenPurchase':
+            (delta_I, delta_O, I_t1, O_t1, token) = (swap.eth_delta, -swap.token_delta,
+                                                     swap.eth_balance, swap.token_balance, 'RAI')
+        else:
+            (delta_I, delta_O, I_t1, O_t1, token) = (swap.token_delta, -swap.eth_delta,
+                                                     swap.token_balance, swap.eth_balance, 'ETH')
+        (I_t, O_t) = (I_t1 - delta_I, O_t1 + delta_O)
+        for mode in AMM_MATH_MODES:
+            output = get_output_amount(delta_I, I_t, O_t, {**params, 'amm_math': mode})
+            rows.append((mode, token, output - delta_O, (output - delta_O) / delta_O))
+
+    errors = pd.DataFrame(rows, columns=['mode', 'token', 'error', 'relative_error'])
+    grouped = errors.groupby(['mode', 'token'])
+    return pd.DataFrame({'swaps': grouped.size(),
+                         'median_abs_error': grouped['error'].agg(lambda x: x.abs().median()),
+                         'max_abs_error': grouped['error'].agg(lambda x: x.abs().max()),
+                         'rmse': grouped['error'].agg(lambda x: np.sqrt((x ** 2).mean())),
+                         'max_rel_error': grouped['relative_error'].agg(lambda x: x.abs().max())})
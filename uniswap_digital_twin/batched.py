@@ -0,0 +1,226 @@
+from typing import List, Tuple
+import numpy as np
+import pandas as pd
+from cadCAD_tools.preparation import ParamSweep
+from kernels import AGENT_CODES, agent_trades
+
+# Vectorized counterparts of the `policy_aux` AMM helpers. They keep the
+# same floating point operations, so that results match the cadCAD model.
+
+
+def output_amount(delta_I: np.ndarray, I_t: np.ndarray, O_t: np.ndarray, fee: float) -> np.ndarray:
+    delta_I_with_fee = delta_I * (1 - fee)
+    numerator = delta_I_with_fee * O_t
+    denominator = I_t + delta_I_with_fee
+    return np.floor_divide(numerator, denominator)
+
+
+def input_amount(delta_O: np.ndarray, I_t: np.ndarray, O_t: np.ndarray, fee: float) -> np.ndarray:
+    numerator = I_t * delta_O
+    denominator = (O_t - delta_O) * (1 - fee)
+    return np.floor_divide(numerator, denominator) + 1
+
+
+def delta_I_to_price(P: np.ndarray, I_t: np.ndarray, O_t: np.ndarray, fee: float) -> np.ndarray:
+    a = 1 - fee
+    delta_I = (-(I_t + I_t * a) + np.sqrt((I_t - I_t * a) ** 2 + 4 * P * O_t * I_t * a)) / (2 * a)
+    return np.trunc(delta_I)
+
+
+def is_retail(delta_I: np.ndarray, delta_O: np.ndarray, retail_precision: int) -> np.ndarray:
+    scale = 10 ** retail_precision
+    with np.errstate(invalid='ignore'):
+        return (np.mod(delta_I * scale, 1) == 0) | (np.mod(delta_O * scale, 1) == 0)
+
+
+def unprofitable(I_t, O_t, delta_I, delta_O, eth_sold, params) -> np.ndarray:
+    fix_cost = params['fix_cost']
+    if fix_cost == -1:
+        return np.zeros(len(I_t), dtype=bool)
+    fee = params['fee_percentage']
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # tokenPurchase
+        after_P = 1 / output_amount(1, I_t, O_t, fee)
+        eth_profit = np.trunc(np.abs(delta_O * after_P) - delta_I)
+        # ethPurchase
+        after_P = input_amount(1, I_t, O_t, fee)
+        token_profit = np.trunc(np.abs(delta_O) - np.trunc(delta_I / after_P))
+    profit = np.where(eth_sold, eth_profit, token_profit)
+    return profit < fix_cost
+
+
+def decode_actions(I_t, O_t, delta_I, delta_O, eth_sold, params) -> np.ndarray:
+    """
+    Vectorized `p_actionDecoder` on extrapolation mode. Returns the amount
+    sold to the pool on each run.
+    """
+    if params['retail_precision'] == -1:
+        return delta_I
+    fee = params['fee_percentage']
+
+    # Convenience trader case
+    calculated_delta_O = output_amount(delta_I, I_t, O_t, fee)
+    conv_trade = np.where(calculated_delta_O >= delta_O * (1 - params['retail_tolerance']),
+                          delta_I,
+                          0.0)
+
+    # Arbitrage trader case
+    P = I_t / O_t
+    arb_delta_I = delta_I_to_price(P, I_t, O_t, fee)
+    arb_delta_O = output_amount(arb_delta_I, I_t, O_t, fee)
+    arb_trade = np.where(unprofitable(I_t, O_t, arb_delta_I, arb_delta_O, eth_sold, params),
+                         0.0,
+                         arb_delta_I)
+
+    return np.where(is_retail(delta_I, delta_O, params['retail_precision']),
+                    conv_trade,
+                    arb_trade)
+
+
+def apply_trades(rai: np.ndarray, eth: np.ndarray, sold: np.ndarray,
+                 eth_sold: np.ndarray, fee: float) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Constant product update, as in the `suf_aux` swap functions.
+    """
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # tokenPurchase: the RAI output is computed on the truncated ETH input
+        eth_in = np.trunc(sold)
+        rai_out = np.where(eth_in == 0, 0.0, output_amount(eth_in, eth, rai, fee))
+        # ethPurchase
+        eth_out = np.where(sold == 0, 0.0, output_amount(sold, rai, eth, fee))
+    new_rai = np.where(eth_sold, rai - rai_out, rai + sold)
+    new_eth = np.where(eth_sold, eth + sold, eth - eth_out)
+    return (new_rai, new_eth)
+
+
+def within_fee_band(signal: np.ndarray, rai: np.ndarray, eth: np.ndarray, fee: float) -> np.ndarray:
+    ratio = rai / eth
+    return (ratio * (1 - fee) <= signal) & (signal <= ratio * (1 + fee))
+
+
+def simulate_reserves(initial_rai: float,
+                      initial_eth: float,
+                      signals: np.ndarray,
+                      agents: np.ndarray,
+                      timesteps: int,
+                      params: dict,
+                      counters: dict = None) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Advance all runs together, one timestep per vectorized operation.
+
+    With the `approximate_fee_band_skip` parameter, runs whose signal is
+    within the fee band of the pool ratio keep their reserves and skip the
+    trade computation. The agents may still trade within the band, so this
+    is a lossy approximation and is off by default.
+    The number of skipped and total run-steps is added to `counters`.
+
+    Parameters
+    ----------
+    signals : np.ndarray
+        Signal of each run, with shape (runs, timesteps)
+    agents : np.ndarray
+        Agent code of each run, with shape (runs,)
+
+    Returns
+    -------
+    Tuple[np.ndarray, np.ndarray]
+        RAI and ETH reserves, with shape (timesteps + 1, runs)
+
+    """
+    if params.get('amm_math', 'float') != 'float':
+        raise ValueError("The batched engine only implements the float AMM math")
+    N = len(agents)
+    rai = np.empty((timesteps + 1, N))
+    eth = np.empty((timesteps + 1, N))
+    rai[0] = initial_rai
+    eth[0] = initial_eth
+    fee = params['fee_percentage']
+    fee_band_skip = params.get('approximate_fee_band_skip', False)
+    skipped = 0
+    for t in range(timesteps):
+        (rai_t, eth_t, signal) = (rai[t], eth[t], signals[:, t])
+        if fee_band_skip:
+            active = ~within_fee_band(signal, rai_t, eth_t, fee)
+            skipped += N - active.sum()
+            rai[t + 1] = rai_t
+            eth[t + 1] = eth_t
+            if not active.any():
+                continue
+            (rai_t, eth_t, signal) = (rai_t[active], eth_t[active], signal[active])
+            run_agents = agents[active]
+        else:
+            active = slice(None)
+            run_agents = agents
+        (eth_delta, rai_delta, eth_sold) = agent_trades(run_agents, eth_t, rai_t, signal)
+        I_t = np.where(eth_sold, eth_t, rai_t)
+        O_t = np.where(eth_sold, rai_t, eth_t)
+        delta_I = np.where(eth_sold, eth_delta, rai_delta)
+        delta_O = np.where(eth_sold, rai_delta, eth_delta)
+        sold = decode_actions(I_t, O_t, delta_I, delta_O, eth_sold, params)
+        (rai[t + 1, active], eth[t + 1, active]) = apply_trades(rai_t, eth_t, sold, eth_sold, fee)
+    if counters is not None:
+        counters['skipped'] = counters.get('skipped', 0) + int(skipped)
+        counters['steps'] = counters.get('steps', 0) + N * timesteps
+    return (rai, eth)
+
+
+def signal_matrix(extrapolated_signals) -> np.ndarray:
+    """
+    Convert the exogenous data injected on the cadCAD model, either a
+    single sample or a tuple of samples, into a (samples, timesteps) array.
+    """
+    if isinstance(extrapolated_signals[0], dict):
+        extrapolated_signals = (extrapolated_signals,)
+    return np.array([[el['ratio'] for el in sample]
+                     for sample in extrapolated_signals])
+
+
+def model_params() -> dict:
+    """
+    Scalar values of the default model parameters.
+    """
+    import model as default_model
+    return {k: v.value[0] if isinstance(v, ParamSweep) else v.value
+            for k, v in default_model.parameters.items()}
+
+
+def simulate_batched(initial_rai: float,
+                     initial_eth: float,
+                     signals: np.ndarray,
+                     timesteps: int,
+                     agent_types: List[str] = ["Arb1", "Arb2"],
+                     params: dict = None) -> pd.DataFrame:
+    """
+    Lockstep Monte Carlo extrapolation over every combination of agent type
+    and signal sample.
+
+    Returns
+    -------
+    DataFrame
+        Results on the same long format as `extrapolate_data`, with one
+        subset per agent type and one run per signal sample
+
+    """
+    if params is None:
+        params = model_params()
+    signals = np.atleast_2d(signals)
+    n_samples = len(signals)
+
+    agents = np.repeat([AGENT_CODES[agent] for agent in agent_types], n_samples)
+    run_signals = np.tile(signals[:, :timesteps], (len(agent_types), 1))
+    counters = {}
+    (rai, eth) = simulate_reserves(initial_rai, initial_eth, run_signals,
+                                   agents, timesteps, params, counters)
+
+    N = len(agents)
+    T = timesteps + 1
+    df = pd.DataFrame({'RAI_balance': rai.T.ravel(),
+                       'ETH_balance': eth.T.ravel(),
+                       'Ratio': None,
+                       'Action': None,
+                       'simulation': 0,
+                       'subset': np.repeat(np.arange(N) // n_samples, T),
+                       'run': np.repeat(np.arange(N) % n_samples + 1, T),
+                       'timestep': np.tile(np.arange(T), N)})
+    df.attrs['fee_band_skip'] = counters
+    return df
@@ -0,0 +1,596 @@
+from time import perf_counter
+import click
+import numpy as np
+
+
+def timed(f, *args, repeat: int = 3, **kwargs) -> float:
+    """
+    Best wall time of `repeat` calls of `f`.
+    """
+    best = np.inf
+    for _ in range(repeat):
+        t1 = perf_counter()
+        f(*args, **kwargs)
+        best = min(best, perf_counter() - t1)
+    return best
+
+
+@click.group()
+def cli() -> None:
+    """
+    Benchmarks for the digital twin hot paths.
+    """
+    pass
+
+
+@cli.command('agent-kernels')
+@click.option('-n', '--runs', 'n', default=100_000, help="Batch size")
+def agent_kernels(n) -> None:
+    from kernels import HAS_NUMBA, AGENT_CODES, agent_trades, check_equivalence
+    from policy_aux import agent_action
+
+    print(f"Numba available: {HAS_NUMBA}")
+    print(f"Max relative difference: {check_equivalence(n=min(n, 10_000))}")
+
+    rng = np.random.default_rng(0)
+    eth_res = rng.uniform(1e3, 2e4, n)
+    rai_res = eth_res * rng.uniform(500, 1000, n)
+    signal = rai_res / eth_res * np.exp(rng.normal(0, 0.05, n))
+
+    for (agent_type, code) in AGENT_CODES.items():
+        agent = np.full(n, code)
+        t_kernel = timed(agent_trades, agent, eth_res, rai_res, signal)
+
+        def python_loop():
+            for i in range(n):
+                s = {'ETH_balance': eth_res[i], 'RAI_balance': rai_res[i]}
+                agent_action(signal[i], s, {'agent_type': agent_type})
+        t_python = timed(python_loop, repeat=1)
+        print(f"{agent_type}: python {t_python:.3f}s, kernel {t_kernel:.4f}s "
+              f"({t_python / t_kernel:.0f}x)")
+
+
+@cli.command('signal-processes')
+@click.option('-s', '--samples', 'samples', default=10_000, help="Number of samples")
+@click.option('-t', '--timesteps', 'timesteps', default=10_000, help="Number of timesteps")
+def signal_processes(samples, timesteps) -> None:
+    from stochastic import SIGNAL_PROCESSES, FitParams, generate_samples
+
+    fit_params = FitParams(0.000036906289210966747, 0.014081285145600045)
+    initial_value = 6.455903839554217
+    returns = np.random.default_rng(0).normal(fit_params.shape, fit_params.scale, 1000)
+    kwargs = {'bootstrap': {'returns': returns}}
+    for process in SIGNAL_PROCESSES:
+        t = timed(generate_samples, process, fit_params, timesteps, samples,
+                  initial_value, **kwargs.get(process, {}), repeat=1)
+        print(f"{process}: {t:.2f}s ({samples * timesteps / t / 1e6:.1f}M values/s)")
+
+
+@cli.command('variance-reduction')
+@click.option('-t', '--timesteps', 'timesteps', default=7 * 24, help="Extrapolation timesteps")
+@click.option('-r', '--replications', 'replications', default=30, help="Independent replications")
+@click.option('-a', '--agent', 'agent', default='Arb2', help="Agent type")
+def variance_reduction(timesteps, replications, agent) -> None:
+    """
+    Spread of the terminal RAI reserve estimators across independent
+    replications. The variance ratio against plain pseudo-random sampling
+    is the factor by which the sample count can be cut for the same
+    confidence interval width.
+    """
+    from stochastic import FitParams, generate_samples
+    from batched import simulate_reserves, model_params
+    from kernels import AGENT_CODES
+    from estimators import mean_estimate, quantile_estimate
+
+    # RAI/ETH pool state and signal fit from the bundled run
+    (rai0, eth0) = (3700536.0, 10161.485)
+    fit_params = FitParams(0.00016220538556076036, 0.0077787667872738515)
+    initial_value = np.log1p(rai0 / eth0)
+    control_mean = initial_value + fit_params.shape * timesteps
+    params = model_params()
+
+    methods = {'pseudo': 'pseudo', 'antithetic': 'antithetic',
+               'sobol': 'sobol', 'control variate': 'pseudo'}
+    for n in (32, 128, 512):
+        spread = {}
+        agents = np.full(n, AGENT_CODES[agent])
+        for (method, sampling) in methods.items():
+            means, p95s = [], []
+            for seed in range(replications):
+                signals = generate_samples('gbm', fit_params, timesteps, n,
+                                           initial_value, seed=seed, sampling=sampling)
+                (rai, _) = simulate_reserves(rai0, eth0, signals, agents, timesteps, params)
+                if method == 'control variate':
+                    # Terminal signal as control, its expectation being known
+                    control = np.log1p(signals[:, -1])
+                    covariance = np.cov(rai[-1], control)
+                    beta = covariance[0, 1] / covariance[1, 1] if covariance[1, 1] > 0 else 0.0
+                    means.append(float(np.mean(rai[-1] - beta * (control - control_mean))))
+                else:
+                    means.append(mean_estimate(rai[-1], antithetic=(sampling == 'antithetic')).value)
+                p95s.append(quantile_estimate(rai[-1], 0.95).value)
+            spread[method] = (np.var(means), np.var(p95s))
+        for (method, (var_mean, var_p95)) in spread.items():
+            print(f"n={n:4d} {method:>15}: mean std {var_mean ** .5:10.1f} "
+                  f"(x{spread['pseudo'][0] / var_mean:5.1f} fewer samples), "
+                  f"P95 std {var_p95 ** .5:10.1f} "
+                  f"(x{spread['pseudo'][1] / var_p95:5.1f})")
+
+
+@cli.command('fee-band-skip')
+@click.option('-t', '--timesteps', 'timesteps', default=7 * 24 * 7, help="Extrapolation timesteps")
+@click.option('-n', '--runs', 'n', default=1000, help="Number of batched runs")
+@click.option('-v', '--volatility', 'volatility', default=0.0005, help="Signal log-ratio volatility")
+def fee_band_skip(timesteps, n, volatility) -> None:
+    """
+    Extrapolation time with and without the approximate fee band skip on
+    low-volatility signals. The skip is lossy, so the results differ.
+    """
+    from extrapolation_cycle import extrapolate_data
+    from batched import simulate_reserves, model_params
+    from kernels import ARB1
+    import pandas as pd
+
+    (rai0, eth0) = (3700536.0, 10161.485)
+    rng = np.random.default_rng(0)
+    signals = rai0 / eth0 * np.exp(rng.normal(0, volatility, (n, timesteps)).cumsum(axis=1))
+    bt = pd.DataFrame({'RAI_balance': [rai0], 'ETH_balance': [eth0]})
+    exogenous = tuple({'ratio': el} for el in signals[0])
+    # Warm-up the kernel compilation
+    simulate_reserves(rai0, eth0, signals[:1, :2], np.full(1, ARB1), 2, model_params())
+
+    for enabled in (False, True):
+        t_cadcad = timed(extrapolate_data, None, exogenous, timesteps, None, bt,
+                         params={'approximate_fee_band_skip': enabled}, repeat=1)
+
+        params = {**model_params(), 'approximate_fee_band_skip': enabled}
+        counters = {}
+        t_batched = timed(simulate_reserves, rai0, eth0, signals, np.full(n, ARB1),
+                          timesteps, params, counters=counters, repeat=1)
+        print(f"fee band skip {'on' if enabled else 'off'}: cadCAD {t_cadcad:.2f}s, "
+              f"batched {t_batched:.3f}s, skipped {counters['skipped']} of "
+              f"{counters['steps']} run-steps")
+
+
+@cli.command('event-driven')
+@click.option('-t', '--timesteps', 'timesteps', default=24 * 365, help="Extrapolation horizon in hours")
+@click.option('-n', '--samples', 'n', default=100, help="Number of signal samples")
+@click.option('-a', '--activity', 'activity', default=1.0, help="Scale of the fitted arrival rates")
+def event_driven(timesteps, n, activity) -> None:
+    """
+    Event-driven against hourly batched extrapolation, on the arrival
+    model fitted from the bundled run.
+    """
+    from loader import load_events
+    from batched import simulate_batched
+    from event_driven import fit_arrivals, simulate_event_driven
+
+    (events, _) = load_events('data/runs/2021-08-02 17:23:03.984710_retrieval.csv.gz')
+    arrivals = fit_arrivals(events)
+    arrivals.rates = arrivals.rates * activity
+    (rai0, eth0, uni0) = (3700536.0, 10161.485, events['UNI_supply'].iloc[-1])
+    rng = np.random.default_rng(0)
+    signals = rai0 / eth0 * np.exp(rng.normal(0, 0.0078, (n, timesteps)).cumsum(axis=1))
+
+    t_batched = timed(simulate_batched, rai0, eth0, signals, timesteps, repeat=1)
+    t1 = perf_counter()
+    df = simulate_event_driven(rai0, eth0, uni0, signals, arrivals, timesteps)
+    t_events = perf_counter() - t1
+    events_per_run = df.groupby(['subset', 'run']).size().mean() - 1
+    print(f"{events_per_run / timesteps:.2f} events per hour: hourly batched "
+          f"{t_batched:.2f}s, event-driven {t_events:.2f}s")
+
+
+@cli.command('amm-math')
+@click.option('-n', '--calls', 'n', default=10_000, help="Number of AMM function calls")
+def amm_math(n) -> None:
+    """
+    Speed and accuracy of the float and exact AMM math, per call and on the
+    backtest of the bundled run.
+    """
+    from cadCAD_tools.preparation import Param
+    from amm_math import AMM_MATH_MODES, swap_error_report
+    from batched import output_amount
+    from extrapolation_cycle import backtest_model, rmse
+    from loader import load_events
+    from policy_aux import get_output_amount, get_delta_I
+    import model as default_model
+
+    (events, _) = load_events('data/runs/2021-08-02 17:23:03.984710_retrieval.csv.gz')
+    print(swap_error_report(events).to_string())
+
+    (rai0, eth0) = (3700536.0, 10161.485)
+    rng = np.random.default_rng(0)
+    delta_I = rng.uniform(0.1, 100, n)
+    t_vector = timed(output_amount, delta_I, eth0, rai0, 0.003)
+    print(f"vectorized float: {t_vector / n * 1e9:.0f}ns per call")
+    for mode in AMM_MATH_MODES:
+        params = {'fee_percentage': 0.003, 'amm_math': mode}
+
+        def calls():
+            for x in delta_I:
+                get_output_amount(x, eth0, rai0, params)
+                get_delta_I(rai0 / eth0 * 1.01, eth0, rai0, params)
+        t_calls = timed(calls, repeat=1)
+
+        default_model.parameters['amm_math'] = Param(mode, str)
+        t1 = perf_counter()
+        (sim_df, test_df, _) = backtest_model(events, report=False)
+        t_backtest = perf_counter() - t1
+        error = rmse(test_df['RAI_balance'], sim_df['RAI_balance'])
+        print(f"{mode}: {t_calls / n * 1e6:.1f}us per output/delta_I pair, "
+              f"backtest {t_backtest:.2f}s with RAI RMSE {error:.2f}")
+
+
+@cli.command('retrieval')
+@click.option('-d', '--days', 'days', default=14, help="Days of synthetic events")
+@click.option('-e', '--events-per-day', 'events_per_day', default=2000, help="Synthetic events per day")
+@click.option('-l', '--latency', 'latency', default=0.2, help="Stub server latency per request")
+@click.option('-p', '--page-size', 'page_size', default=1000, help="Subgraph stub page size")
+@click.option('-m', '--max-logs', 'max_logs', default=10000, help="JSON-RPC stub logs per eth_getLogs")
+def retrieval(days, events_per_day, latency, page_size, max_logs) -> None:
+    """
+    Retrieval and ingestion throughput of `Data.create_data` against the
+    offline subgraph stub server, and of `chain_data.create_data` against
+    the JSON-RPC stub, on the same synthetic history.
+    """
+    from datetime import datetime, timedelta
+    from stub_server import (StubServer, SyntheticSource, JsonRpcSource,
+                             synthetic_entities, synthetic_events)
+    import chain_data
+    import Data
+
+    start_date = datetime(2021, 7, 1)
+    end_date = start_date + timedelta(days=days - 1)
+    events = synthetic_events(start_date, days, events_per_day)
+
+    def run(name, server, create_data, workers):
+        for max_workers in workers:
+            server.requests = 0
+            t1 = perf_counter()
+            df = create_data(start_date, end_date, max_workers=max_workers)
+            elapsed = perf_counter() - t1
+            print(f"{name}, {max_workers} workers: {len(df)} events in {elapsed:.2f}s "
+                  f"({len(df) / elapsed:.0f} events/s, {server.requests} requests)")
+
+    with StubServer(SyntheticSource(synthetic_entities(events)),
+                    latency=latency, page_size=page_size) as server:
+        Data.graph_url = server.url
+        run('subgraph', server, Data.create_data, (1, 3))
+    with StubServer(JsonRpcSource(events), latency=latency, page_size=max_logs) as server:
+        chain_data.rpc_url = server.url
+        run('JSON-RPC', server, chain_data.create_data, (1, 4))
+
+
+@cli.command('classification')
+@click.option('-p', '--retail-precision', 'retail_precision', default=3, help="Retail precision")
+def classification(retail_precision) -> None:
+    """
+    Per-event trader classification against the up-front vectorized pass,
+    followed by the class breakdown of the bundled history.
+    """
+    from loader import load_events
+    from policy_aux import classifier, get_parameters
+    from classification import classify_events, class_breakdown
+
+    (events, _) = load_events('data/runs/2021-08-02 17:23:03.984710_retrieval.csv.gz')
+    state = {'RAI_balance': 1.0, 'ETH_balance': 1.0}
+
+    def per_event():
+        for t in range(1, len(events)):
+            event = events['event'][t]
+            if event in ('tokenPurchase', 'ethPurchase'):
+                (_, _, _, _, delta_I, delta_O, _) = get_parameters(events, event, state, t)
+                classifier(delta_I, delta_O, retail_precision)
+
+    t_loop = timed(per_event)
+    t_vectorized = timed(classify_events, events, retail_precision)
+    print(f"{len(events)} events: per event {t_loop:.3f}s, vectorized {t_vectorized:.4f}s")
+    print(class_breakdown(events, retail_precision))
+
+
+@cli.command('service')
+@click.option('-n', '--requests', 'n', default=2000, help="Requests per client")
+@click.option('-c', '--clients', 'clients', default=8, help="Concurrent clients")
+@click.option('-r', '--runs', 'runs', default=500, help="Extrapolation runs per agent type")
+def service(n, clients, runs) -> None:
+    """
+    Load test of the forecast service on a synthetic extrapolation, with
+    keep-alive clients alternating quantile and price impact queries.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    from http.client import HTTPConnection
+    import pandas as pd
+    from service import ForecastService, ForecastSummary
+
+    timesteps = 7 * 24
+    rng = np.random.default_rng(0)
+    paths = np.exp(np.cumsum(rng.normal(0, 0.01, (2 * runs, timesteps + 1)), axis=1))
+    extrapolation = pd.DataFrame({'subset': np.repeat(np.arange(2 * runs) // runs, timesteps + 1),
+                                  'run': np.repeat(np.arange(2 * runs), timesteps + 1),
+                                  'timestep': np.tile(np.arange(timesteps + 1), 2 * runs),
+                                  'RAI_balance': 3.7e6 * paths.ravel(),
+                                  'ETH_balance': 1e4 / paths.ravel()})
+    backtest = pd.DataFrame({'RAI_balance': [3.7e6], 'ETH_balance': [1e4]})
+    t1 = perf_counter()
+    summary = ForecastSummary.from_frames('synthetic', backtest, extrapolation)
+    print(f"Summary of {len(extrapolation)} rows built in {perf_counter() - t1:.2f}s")
+
+    queries = ['/quantiles?agent=Arb1&horizon=24&q=50,95',
+               '/quantiles?agent=Arb2&horizon=168&q=5,50,95&variable=ratio',
+               '/impact?sell=ETH&amount=10']
+
+    def client(url):
+        (host, port) = url.split('//')[1].rstrip('/').split(':')
+        connection = HTTPConnection(host, int(port))
+        latencies = []
+        for i in range(n):
+            t = perf_counter()
+            connection.request('GET', queries[i % len(queries)])
+            response = connection.getresponse()
+            response.read()
+            assert response.status == 200
+            latencies.append(perf_counter() - t)
+        connection.close()
+        return latencies
+
+    with ForecastService('.', refresh_interval=0, summary=summary) as server:
+        t1 = perf_counter()
+        with ThreadPoolExecutor(max_workers=clients) as executor:
+            latencies = np.concatenate(list(executor.map(client, [server.url] * clients)))
+        elapsed = perf_counter() - t1
+    print(f"{len(latencies)} requests from {clients} clients in {elapsed:.2f}s "
+          f"({len(latencies) / elapsed:.0f} requests/s)")
+    print(f"Latency p50 {np.percentile(latencies, 50) * 1e3:.2f}ms, "
+          f"p95 {np.percentile(latencies, 95) * 1e3:.2f}ms, "
+          f"p99 {np.percentile(latencies, 99) * 1e3:.2f}ms")
+
+
+@cli.command('impact')
+@click.option('-s', '--samples', 'samples', default=1000, help="Extrapolated paths")
+@click.option('-t', '--timesteps', 'timesteps', default=7 * 24, help="Timesteps per path")
+@click.option('-n', '--sizes', 'n_sizes', default=64, help="Trade sizes per direction")
+def impact(samples, timesteps, n_sizes) -> None:
+    """
+    Build time, size and interpolation error of a price impact surface,
+    and lookup time against evaluating `policy_aux.get_output_amount`
+    on every path.
+    """
+    from impact import impact_surface, price_impact
+    from policy_aux import get_output_amount
+
+    rng = np.random.default_rng(0)
+    paths = np.exp(np.cumsum(rng.normal(0, 0.01, (timesteps + 1, samples)), axis=0))
+    reserves = np.stack([3.7e6 * paths, 1e4 / paths], axis=-1)
+    fee = 0.003
+
+    t_build = timed(impact_surface, reserves, fee_percentage=fee, n_sizes=n_sizes, repeat=1)
+    surface = impact_surface(reserves, fee_percentage=fee, n_sizes=n_sizes)
+    print(f"{samples} paths x {timesteps + 1} timesteps x {n_sizes} sizes: built in {t_build:.2f}s, "
+          f"{surface.impact.nbytes / 1024 ** 2:.0f} MiB")
+
+    # Interpolation error against the exact impact
+    amounts = np.exp(rng.uniform(np.log(surface.sizes[0, 0]), np.log(surface.sizes[0, -1]), 200))
+    t = rng.integers(0, timesteps + 1, 200)
+    errors = [np.abs(surface.lookup('ETH', a, i)
+                     - price_impact(a, reserves[i, :, 1], reserves[i, :, 0], fee)).max()
+              for (a, i) in zip(amounts, t)]
+    print(f"Max absolute interpolation error {max(errors):.2e}")
+
+    params = {'fee_percentage': fee}
+
+    def per_path():
+        for (rai, eth) in reserves[timesteps]:
+            get_output_amount(10.0, eth, rai, params)
+    t_loop = timed(per_path)
+    t_lookup = timed(surface.quantiles, 'ETH', 10.0, timesteps, [5, 50, 95], repeat=100)
+    print(f"Impact of 10 ETH on all paths: per path {t_loop * 1e3:.2f}ms, "
+          f"surface quantiles {t_lookup * 1e3:.3f}ms")
+
+
+@cli.command('sensitivity')
+@click.option('-n', 'n', default=16, help="Saltelli base points")
+@click.option('-w', '--max-workers', 'max_workers', default=4, help="Worker processes")
+def sensitivity(n, max_workers) -> None:
+    """
+    Backtest time of the sensitivity analysis core against cadCAD, and
+    time of a Saltelli design evaluated from scratch and then extended
+    to twice the base points on the same cache.
+    """
+    from tempfile import TemporaryDirectory
+    from batched import model_params
+    from cache import ResultCache
+    from classification import classify_events
+    from extrapolation_cycle import backtest_model
+    from loader import load_events
+    from sensitivity import backtest_core, sensitivity_analysis
+
+    (events, _) = load_events('data/runs/2021-08-02 17:23:03.984710_retrieval.csv.gz')
+    params = model_params()
+    classified = classify_events(events, params['retail_precision'])
+    t_cadcad = timed(backtest_model, events, report=False, repeat=1)
+    t_core = timed(backtest_core, classified, params)
+    print(f"Backtest of {len(events)} events: cadCAD {t_cadcad:.3f}s, core {t_core:.4f}s")
+
+    with TemporaryDirectory() as path:
+        cache = ResultCache(path)
+        for base_points in (n, 2 * n):
+            t1 = perf_counter()
+            sensitivity_analysis(events, 'sobol', base_points, cache=cache, max_workers=max_workers)
+            print(f"Sobol with {base_points} base points: {perf_counter() - t1:.2f}s")
+
+
+@cli.command('population')
+@click.option('-t', '--timesteps', 'timesteps', default=7 * 24, help="Extrapolation horizon in hours")
+@click.option('-n', '--samples', 'n', default=10, help="Number of signal samples")
+def population(timesteps, n) -> None:
+    """
+    Timesteps per second of the population engine for growing numbers of
+    agents, against the single agent batched engine.
+    """
+    from batched import simulate_batched
+    from population import PopulationConfig, simulate_population
+
+    (rai0, eth0, uni0) = (3700536.0, 10161.485, 5.4e4)
+    rng = np.random.default_rng(0)
+    signals = rai0 / eth0 * np.exp(rng.normal(0, 0.0078, (n, timesteps)).cumsum(axis=1))
+
+    # Compile once before timing
+    simulate_population(rai0, eth0, uni0, signals, 2)
+    t_batched = timed(simulate_batched, rai0, eth0, signals, timesteps, ["Arb1"])
+    print(f"Single agent batched: {timesteps / t_batched:.0f} timesteps/s")
+    for agents in (10, 100, 500, 1000):
+        config = PopulationConfig(n_arbitrageurs=agents // 5,
+                                  n_noise_traders=agents - 2 * (agents // 5),
+                                  n_liquidity_providers=agents // 5)
+        t = timed(simulate_population, rai0, eth0, uni0, signals, timesteps, config)
+        print(f"{agents} agents: {timesteps / t:.0f} timesteps/s, "
+              f"{agents * n * timesteps / t:.2e} agent-steps/s")
+
+
+@cli.command('lp-analytics')
+@click.option('-r', '--runs', 'runs', default=1000, help="Extrapolation runs per agent type")
+@click.option('-t', '--timesteps', 'timesteps', default=7 * 24, help="Timesteps per run")
+def lp_analytics(runs, timesteps) -> None:
+    """
+    Vectorized LP metrics against a per-run pandas groupby, and the
+    streaming path on chunks of the same frame.
+    """
+    from batched import simulate_batched
+    from lp_analytics import lp_metrics, stream_lp_metrics
+    import pandas as pd
+
+    (rai0, eth0, uni0) = (3700536.0, 10161.485, 5.4e4)
+    rng = np.random.default_rng(0)
+    signals = rai0 / eth0 * np.exp(rng.normal(0, 0.0078, (runs, timesteps)).cumsum(axis=1))
+    df = simulate_batched(rai0, eth0, signals, timesteps)
+
+    def per_run():
+        rows = []
+        for (_, path) in df.groupby(['subset', 'run']):
+            first = path.iloc[0]
+            price = path['ETH_balance'] / path['RAI_balance']
+            uni_value = 2 * path['ETH_balance'] / uni0
+            hold_value = (first['ETH_balance'] + first['RAI_balance'] * price) / uni0
+            fee_growth = (path['RAI_balance'] * path['ETH_balance']) ** .5 \
+                / (first['RAI_balance'] * first['ETH_balance']) ** .5
+            rows.append(pd.DataFrame({'uni_value': uni_value,
+                                      'fee_income': uni_value - uni_value / fee_growth,
+                                      'lp_return': uni_value / hold_value - 1}))
+        return pd.concat(rows)
+
+    t_groupby = timed(per_run, repeat=1)
+    t_vectorized = timed(lp_metrics, df, uni0)
+    (metrics, _) = lp_metrics(df, uni0)
+    chunks = (df.iloc[i:i + 100_000] for i in range(0, len(df), 100_000))
+    streamed = pd.concat(stream_lp_metrics(chunks, uni0), ignore_index=True)
+    assert np.allclose(streamed['lp_return'], metrics['lp_return'])
+    expected = per_run().sort_index()
+    assert np.allclose(metrics['lp_return'], expected['lp_return'])
+    print(f"{len(df)} rows: per-run groupby {t_groupby:.2f}s, vectorized {t_vectorized:.3f}s")
+
+
+@cli.command('distributed')
+@click.option('-n', '--samples', 'n', default=2000, help="Number of signal samples")
+@click.option('-t', '--timesteps', 'timesteps', default=7 * 24, help="Extrapolation timesteps")
+@click.option('-w', '--max-workers', 'max_workers', default=4, help="Largest worker count")
+def distributed(n, timesteps, max_workers) -> None:
+    """
+    Fee sweep on local clusters of growing size, against the same runs on
+    a single process.
+    """
+    from batched import model_params, simulate_reserves
+    from distributed import LocalCluster, distributed_sweep
+    from kernels import AGENT_CODES
+
+    (rai0, eth0) = (3700536.0, 10161.485)
+    rng = np.random.default_rng(0)
+    signals = rai0 / eth0 * np.exp(rng.normal(0, 0.0078, (n, timesteps)).cumsum(axis=1))
+    fees = [0.001, 0.003, 0.01]
+
+    def single_process():
+        for fee in fees:
+            for code in AGENT_CODES.values():
+                simulate_reserves(rai0, eth0, signals, np.full(n, code), timesteps,
+                                  {**model_params(), 'fee_percentage': fee})
+    t_single = timed(single_process, repeat=1)
+    print(f"{n} samples x 2 agents x {len(fees)} fees: single process {t_single:.2f}s")
+    workers = 1
+    while workers <= max_workers:
+        with LocalCluster(workers) as cluster:
+            # Workers import and compile on their first shard
+            distributed_sweep(cluster.coordinator, rai0, eth0, signals[:workers], timesteps, shard_size=1)
+            for dtype in ('float64', 'float32'):
+                t = timed(distributed_sweep, cluster.coordinator, rai0, eth0, signals, timesteps,
+                          sweep={'fee_percentage': fees}, dtype=dtype, repeat=1)
+                print(f"{workers} workers, {dtype} results: {t:.2f}s ({t_single / t:.1f}x)")
+        workers *= 2
+
+
+# Worker state of the 'shared-data' benchmark
+_worker_events = None
+_worker_ready = None
+
+
+def _init_shared_worker(payload) -> None:
+    global _worker_events, _worker_ready
+    from time import time
+    from shared_data import SharedEventsHandle, attach
+    _worker_events = attach(payload) if isinstance(payload, SharedEventsHandle) else payload
+    _worker_ready = time()
+
+
+def _shared_worker_task(_) -> tuple:
+    from time import sleep
+    # Touch every column, as a backtest would
+    for col in ('token_delta', 'eth_delta', 'token_balance', 'eth_balance'):
+        _worker_events[col].sum()
+    sleep(0.5)
+    with open('/proc/self/smaps_rollup') as fid:
+        fields = dict(line.split(':', 1) for line in fid if ':' in line)
+    private_kb = sum(int(fields[k].split()[0]) for k in ('Private_Clean', 'Private_Dirty'))
+    return (_worker_ready, private_kb / 1024)
+
+
+@cli.command('shared-data')
+@click.option('-n', '--rows', 'n', default=2_000_000, help="Number of events")
+@click.option('-w', '--max-workers', 'max_workers', default=8, help="Largest worker count")
+def shared_data(n, max_workers) -> None:
+    """
+    Worker startup time and private memory when the event history is
+    pickled to every worker against attached from shared memory. Linux
+    only, as it reads /proc/self/smaps_rollup.
+    """
+    from concurrent.futures import ProcessPoolExecutor
+    from multiprocessing import get_context
+    from time import time
+    import pandas as pd
+    from shared_data import SharedEvents
+
+    rng = np.random.default_rng(0)
+    events = pd.DataFrame({col: rng.random(n) for col in ('token_delta', 'eth_delta', 'UNI_delta',
+                                                          'token_balance', 'eth_balance', 'UNI_supply')})
+    events['timestamp'] = pd.date_range('2021-01-01', periods=n, freq='s')
+    events['event'] = pd.Categorical.from_codes(rng.integers(0, 4, n),
+                                                ['mint', 'burn', 'tokenPurchase', 'ethPurchase'])
+    print(f"{events.memory_usage().sum() / 1024 ** 2:.0f} MiB of events")
+
+    with SharedEvents(events) as shared:
+        workers = 1
+        while workers <= max_workers:
+            for (mode, payload) in (('pickled', events), ('shared', shared.handle)):
+                t0 = time()
+                with ProcessPoolExecutor(max_workers=workers,
+                                         mp_context=get_context('spawn'),
+                                         initializer=_init_shared_worker,
+                                         initargs=(payload,)) as executor:
+                    results = list(executor.map(_shared_worker_task, range(workers)))
+                startup = max(ready for (ready, _) in results) - t0
+                private = np.mean([mb for (_, mb) in results])
+                print(f"{workers} workers, {mode:>7}: startup {startup:.2f}s, "
+                      f"private memory per worker {private:.0f} MiB")
+            workers *= 2
+
+
+if __name__ == '__main__':
+    cli()
@@ -0,0 +1,151 @@
+from dataclasses import asdict, is_dataclass
+from hashlib import sha256
+from pathlib import Path
+from typing import Iterable, Optional
+import os
+import pickle
+import numpy as np
+import pandas as pd
+
+# Default upper bound for the size of the cache folder
+DEFAULT_MAX_BYTES = 512 * 1024 ** 2
+
+
+def file_digest(path: str, chunk_size: int = 2 ** 20) -> str:
+    """
+    Hash the raw bytes of an artifact on disk.
+    """
+    h = sha256()
+    with open(path, 'rb') as fid:
+        for chunk in iter(lambda: fid.read(chunk_size), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def code_version(modules: Optional[Iterable[str]] = None) -> str:
+    """
+    Hash the source code of `modules`, by default every module of the
+    package, so that any change on the code producing cached results
+    invalidates them.
+    """
+    h = sha256()
+    base = Path(__file__).parent
+    if modules is None:
+        modules = sorted(path.name for path in base.glob('*.py'))
+    for module in modules:
+        h.update(module.encode())
+        h.update((base / module).read_bytes())
+    return h.hexdigest()
+
+
+def _canonical(obj: object) -> bytes:
+    """
+    Deterministic byte representation of the objects used as cache keys.
+    """
+    if isinstance(obj, pd.DataFrame):
+        hashed = pd.util.hash_pandas_object(obj, index=True).values
+        return b'df' + repr(list(obj.columns)).encode() + hashed.tobytes()
+    elif isinstance(obj, pd.Series):
+        hashed = pd.util.hash_pandas_object(obj, index=True).values
+        return b'sr' + hashed.tobytes()
+    elif isinstance(obj, np.ndarray):
+        return b'nd' + repr((obj.dtype.str, obj.shape)).encode() + obj.tobytes()
+    elif is_dataclass(obj) and not isinstance(obj, type):
+        return b'dc' + type(obj).__name__.encode() + _canonical(asdict(obj))
+    elif isinstance(obj, dict):
+        return b'{' + b','.join(_canonical(k) + b':' + _canonical(v)
+                                for k, v in sorted(obj.items(), key=lambda kv: str(kv[0]))) + b'}'
+    elif isinstance(obj, (list, tuple)):
+        return b'[' + b','.join(_canonical(el) for el in obj) + b']'
+    elif isinstance(obj, type):
+        return b'ty' + obj.__qualname__.encode()
+    else:
+        return repr(obj).encode()
+
+
+def digest(*parts: object) -> str:
+    """
+    Content hash of an arbitrary sequence of key parts.
+    """
+    h = sha256()
+    for part in parts:
+        h.update(_canonical(part))
+    return h.hexdigest()
+
+
+class ResultCache():
+    """
+    Content-addressed store of pickled results, with size-bounded LRU
+    eviction. The last access time of an entry is tracked through the file
+    modification time.
+    """
+
+    suffix = '.pkl.gz'
+
+    def __init__(self,
+                 path: Path,
+                 max_bytes: int = DEFAULT_MAX_BYTES,
+                 enabled: bool = True) -> None:
+        self.path = Path(path).expanduser()
+        self.max_bytes = max_bytes
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+        if self.enabled:
+            self.path.mkdir(parents=True, exist_ok=True)
+
+    def _entry(self, key: str) -> Path:
+        return self.path / f'{key}{self.suffix}'
+
+    def get(self, key: str) -> Optional[object]:
+        """
+        Return the cached value for `key`, or None when there is no entry
+        or the cache is bypassed.
+        """
+        if self.enabled is False:
+            return None
+        entry = self._entry(key)
+        try:
+            value = pd.read_pickle(entry, compression='gzip')
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        except (OSError, EOFError, pickle.UnpicklingError):
+            # Truncated or corrupt entry, e.g. gzip.BadGzipFile
+            entry.unlink(missing_ok=True)
+            self.misses += 1
+            return None
+        # Mark as recently used
+        os.utime(entry)
+        self.hits += 1
+        return value
+
+    def put(self, key: str, value: object) -> None:
+        if self.enabled is False:
+            return None
+        entry = self._entry(key)
+        tmp_entry = entry.with_name(entry.name + '.tmp')
+        pd.to_pickle(value, tmp_entry, compression='gzip')
+        os.replace(tmp_entry, entry)
+        self.evict()
+
+    def size(self) -> int:
+        return sum(entry.stat().st_size
+                   for entry in self.path.glob(f'*{self.suffix}'))
+
+    def evict(self) -> list[Path]:
+        """
+        Remove the least recently used entries until the cache fits
+        into `max_bytes`.
+        """
+        entries = sorted(self.path.glob(f'*{self.suffix}'),
+                         key=lambda entry: entry.stat().st_mtime)
+        total = sum(entry.stat().st_size for entry in entries)
+        removed = []
+        for entry in entries:
+            if total <= self.max_bytes:
+                break
+            total -= entry.stat().st_size
+            entry.unlink()
+            removed.append(entry)
+        return removed
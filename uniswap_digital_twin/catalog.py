@@ -0,0 +1,334 @@
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+import json
+import re
+import sqlite3
+import click
+from cache import digest, file_digest
+from pipeline import digest_path
+
+# Index of the runs under `data/runs`. Every run of the extrapolation
+# cycle registers its parameters, artifacts (with their size, content
+# hash and time coverage) and stage timings on a SQLite file next to the
+# artifacts, so that lookups do not depend on listing and sorting the
+# folder by filename.
+
+CATALOG_FILE = 'catalog.sqlite'
+ARTIFACT_PATTERN = re.compile(r'^(?P<runtime>.+?)[-_]'
+                              r'(?P<kind>retrieval|backtesting|historical|signal|extrapolation|meta|impact|lp)'
+                              r'\.(?:csv\.gz|json|npz)$')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    runtime TEXT PRIMARY KEY,
+    created_at TEXT NOT NULL,
+    status TEXT NOT NULL,
+    params TEXT,
+    params_hash TEXT,
+    wall_time REAL
+);
+CREATE TABLE IF NOT EXISTS artifacts (
+    runtime TEXT NOT NULL REFERENCES runs(runtime) ON DELETE CASCADE,
+    kind TEXT NOT NULL,
+    path TEXT NOT NULL,
+    bytes INTEGER,
+    sha256 TEXT,
+    coverage_start TEXT,
+    coverage_end TEXT,
+    PRIMARY KEY (runtime, kind)
+);
+CREATE TABLE IF NOT EXISTS timings (
+    runtime TEXT NOT NULL REFERENCES runs(runtime) ON DELETE CASCADE,
+    stage TEXT NOT NULL,
+    start REAL,
+    duration REAL,
+    skipped INTEGER,
+    PRIMARY KEY (runtime, stage)
+);
+CREATE INDEX IF NOT EXISTS artifacts_coverage ON artifacts (kind, coverage_start, coverage_end);
+CREATE INDEX IF NOT EXISTS runs_params ON runs (params_hash);
+CREATE INDEX IF NOT EXISTS runs_created ON runs (created_at);
+"""
+
+
+class RunCatalog():
+    """
+    SQLite catalog of the runs of a `data/runs` folder. Paths are stored
+    relative to the folder.
+    """
+
+    def __init__(self, data_path: Path, filename: str = CATALOG_FILE) -> None:
+        self.data_path = Path(data_path).expanduser()
+        self.data_path.mkdir(parents=True, exist_ok=True)
+        self.connection = sqlite3.connect(self.data_path / filename, check_same_thread=False)
+        self.connection.row_factory = sqlite3.Row
+        with self.connection:
+            self.connection.execute('PRAGMA foreign_keys = ON')
+            self.connection.executescript(SCHEMA)
+
+    def close(self) -> None:
+        self.connection.close()
+
+    def __enter__(self) -> 'RunCatalog':
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def register_run(self,
+                     runtime: str,
+                     params: dict = None,
+                     status: str = 'running',
+                     created_at: str = None) -> None:
+        created_at = created_at or datetime.utcnow().isoformat(sep=' ')
+        params_json = None if params is None else json.dumps(params, sort_keys=True, default=str)
+        params_hash = None if params is None else digest(params_json)
+        with self.connection:
+            self.connection.execute(
+                """INSERT INTO runs (runtime, created_at, status, params, params_hash)
+                   VALUES (?, ?, ?, ?, ?)
+                   ON CONFLICT (runtime) DO UPDATE SET
+                       status = excluded.status,
+                       params = COALESCE(excluded.params, runs.params),
+                       params_hash = COALESCE(excluded.params_hash, runs.params_hash)""",
+                (str(runtime), created_at, status, params_json, params_hash))
+
+    def add_artifact(self,
+                     runtime: str,
+                     kind: str,
+                     path: Path,
+                     coverage: Tuple[object, object] = None,
+                     hashed: bool = True) -> None:
+        """
+        Index the artifact of kind `kind` (eg. 'retrieval') of a run.
+        `coverage` is the time range of the data it holds.
+        """
+        path = Path(path)
+        (start, end) = (None, None) if coverage is None else (str(coverage[0]), str(coverage[1]))
+        with self.connection:
+            self.connection.execute(
+                """INSERT OR REPLACE INTO artifacts
+                   (runtime, kind, path, bytes, sha256, coverage_start, coverage_end)
+                   VALUES (?, ?, ?, ?, ?, ?, ?)""",
+                (str(runtime), kind, self._relative(path), path.stat().st_size,
+                 file_digest(path) if hashed else None, start, end))
+
+    def finish_run(self,
+                   runtime: str,
+                   timings: Dict[str, object] = None,
+                   wall_time: float = None,
+                   status: str = 'done') -> None:
+        """
+        Close a run, with the `pipeline.StageTiming` of each stage.
+        """
+        timings = timings or {}
+        origin = min((t.start for t in timings.values()), default=0.0)
+        with self.connection:
+            self.connection.execute('UPDATE runs SET status = ?, wall_time = ? WHERE runtime = ?',
+                                    (status, wall_time, str(runtime)))
+            self.connection.executemany(
+                'INSERT OR REPLACE INTO timings VALUES (?, ?, ?, ?, ?)',
+                [(str(runtime), stage, t.start - origin, t.duration, int(t.skipped))
+                 for (stage, t) in timings.items()])
+
+    def _relative(self, path: Path) -> str:
+        path = Path(path).expanduser()
+        try:
+            return str(path.relative_to(self.data_path))
+        except ValueError:
+            return str(path)
+
+    def path(self, relative: str) -> Path:
+        return self.data_path / relative
+
+    def latest(self,
+               kind: str = 'retrieval',
+               covering: Tuple[object, object] = None) -> Optional[Path]:
+        """
+        Most recent artifact of `kind` still on disk, optionally among
+        those whose coverage includes the `covering` time range.
+        """
+        query = 'SELECT path FROM artifacts JOIN runs USING (runtime) WHERE kind = ?'
+        args: list = [kind]
+        if covering is not None:
+            query += ' AND coverage_start <= ? AND coverage_end >= ?'
+            args += [str(covering[0]), str(covering[1])]
+        query += ' ORDER BY runs.created_at DESC, runtime DESC'
+        for row in self.connection.execute(query, args):
+            path = self.path(row['path'])
+            if path.exists():
+                return path
+        return None
+
+    def find_runs(self, status: str = None, **params) -> List[dict]:
+        """
+        Runs whose parameters include `params`, most recent first.
+        """
+        query = 'SELECT * FROM runs WHERE 1 = 1'
+        args: list = []
+        if status is not None:
+            query += ' AND status = ?'
+            args.append(status)
+        for (key, value) in params.items():
+            query += ' AND json_extract(params, ?) = ?'
+            args += [f'$.{key}', value]
+        query += ' ORDER BY created_at DESC, runtime DESC'
+        return [dict(row) for row in self.connection.execute(query, args)]
+
+    def artifacts(self, runtime: str) -> Dict[str, Path]:
+        rows = self.connection.execute('SELECT kind, path FROM artifacts WHERE runtime = ?',
+                                       (str(runtime),))
+        return {row['kind']: self.path(row['path']) for row in rows}
+
+    def timings(self, runtime: str) -> List[dict]:
+        rows = self.connection.execute('SELECT * FROM timings WHERE runtime = ? ORDER BY start',
+                                       (str(runtime),))
+        return [dict(row) for row in rows]
+
+    def index_directory(self, hashed: bool = False) -> int:
+        """
+        Register the artifacts on the folder which are not indexed yet,
+        grouped by their runtime prefix. The coverage of the retrievals
+        comes from the `-meta.json` file of the run when there is one.
+        Returns the number of artifacts added.
+        """
+        known = {row['path'] for row in self.connection.execute('SELECT path FROM artifacts')}
+        found: Dict[str, List[Tuple[str, Path]]] = {}
+        for path in self.data_path.iterdir():
+            match = ARTIFACT_PATTERN.match(path.name)
+            if match is not None and path.name not in known:
+                found.setdefault(match['runtime'], []).append((match['kind'], path))
+
+        for (runtime, artifacts) in found.items():
+            meta_path = self.data_path / f'{runtime}-meta.json'
+            coverage = None
+            if meta_path.exists():
+                with open(meta_path) as fid:
+                    meta = json.load(fid)
+                coverage = (meta.get('initial_backtesting_timestamp'),
+                            meta.get('final_backtesting_timestamp'))
+            # Runtimes are the `str` of the UTC datetime the run started at
+            self.register_run(runtime, status='indexed', created_at=runtime)
+            for (kind, path) in artifacts:
+                self.add_artifact(runtime, kind, path,
+                                  coverage if kind == 'retrieval' and coverage else None,
+                                  hashed=hashed)
+        return sum(len(artifacts) for artifacts in found.values())
+
+    def prune(self,
+              keep_last: int = 24,
+              max_age: timedelta = timedelta(days=30),
+              kinds: Iterable[str] = ('backtesting', 'historical', 'signal', 'extrapolation',
+                                      'impact', 'lp'),
+              dry_run: bool = False) -> List[Path]:
+        """
+        Retention policy: delete the artifacts of `kinds` of the runs that
+        are both older than `max_age` and not among the `keep_last` most
+        recent ones. Retrievals and metadata are kept by default, as later
+        runs may reuse them. Returns the deleted paths.
+        """
+        cutoff = (datetime.utcnow() - max_age).isoformat(sep=' ')
+        kinds = list(kinds)
+        recent = {row['runtime'] for row in self.connection.execute(
+            'SELECT runtime FROM runs ORDER BY created_at DESC, runtime DESC LIMIT ?', (keep_last,))}
+        rows = self.connection.execute(
+            f"""SELECT runtime, kind, path FROM artifacts JOIN runs USING (runtime)
+                WHERE kind IN ({','.join('?' * len(kinds))}) AND created_at < ?""",
+            kinds + [cutoff]).fetchall()
+        rows = [row for row in rows if row['runtime'] not in recent]
+        deleted = [self.path(row['path']) for row in rows]
+        if dry_run:
+            return deleted
+        for path in deleted:
+            path.unlink(missing_ok=True)
+            # Digest written by the pipeline for resuming
+            digest_path(path).unlink(missing_ok=True)
+        with self.connection:
+            self.connection.executemany('DELETE FROM artifacts WHERE runtime = ? AND kind = ?',
+                                        [(row['runtime'], row['kind']) for row in rows])
+            self.connection.executemany("UPDATE runs SET status = 'pruned' WHERE runtime = ?",
+                                        [(runtime,) for runtime in {row['runtime'] for row in rows}])
+        return deleted
+
+    def compact(self) -> int:
+        """
+        Drop the entries of artifacts no longer on disk and of runs left
+        without artifacts, then vacuum the database. Returns the number of
+        artifact entries dropped.
+        """
+        missing = [(row['runtime'], row['kind'])
+                   for row in self.connection.execute('SELECT runtime, kind, path FROM artifacts')
+                   if not self.path(row['path']).exists()]
+        with self.connection:
+            self.connection.executemany('DELETE FROM artifacts WHERE runtime = ? AND kind = ?', missing)
+            self.connection.execute(
+                """DELETE FROM runs WHERE status != 'running'
+                   AND runtime NOT IN (SELECT runtime FROM artifacts)""")
+        self.connection.execute('VACUUM')
+        return len(missing)
+
+
+@click.group()
+@click.option('-d', '--data-path', 'data_path', default='data/runs', help="Runs folder")
+@click.pass_context
+def cli(ctx, data_path) -> None:
+    """
+    Query and maintain the run catalog.
+    """
+    ctx.obj = RunCatalog(data_path)
+
+
+@cli.command('index')
+@click.option('--hash', 'hashed', is_flag=True, help="Hash the artifacts while indexing")
+@click.pass_obj
+def index(catalog, hashed) -> None:
+    print(f"Indexed {catalog.index_directory(hashed=hashed)} artifacts")
+
+
+@cli.command('latest')
+@click.option('-k', '--kind', 'kind', default='retrieval', help="Artifact kind")
+@click.option('--start', 'start', default=None, help="Start of the window to be covered")
+@click.option('--end', 'end', default=None, help="End of the window to be covered")
+@click.pass_obj
+def latest(catalog, kind, start, end) -> None:
+    covering = None if start is None else (start, end or start)
+    print(catalog.latest(kind, covering))
+
+
+@cli.command('runs')
+@click.option('-p', '--param', 'params', multiple=True, help="Parameter filter as key=value (JSON value)")
+@click.option('-s', '--status', 'status', default=None, help="Run status")
+@click.pass_obj
+def runs(catalog, params, status) -> None:
+    filters = {}
+    for param in params:
+        (key, value) = param.split('=', 1)
+        try:
+            filters[key] = json.loads(value)
+        except json.JSONDecodeError:
+            filters[key] = value
+    for run in catalog.find_runs(status, **filters):
+        print(f"{run['runtime']}  {run['status']:<8}  {run['wall_time'] or 0:.2f}s  {run['params']}")
+
+
+@cli.command('prune')
+@click.option('--keep-last', 'keep_last', default=24, help="Number of recent runs always kept")
+@click.option('--max-age-days', 'max_age_days', default=30, help="Age after which artifacts are deleted")
+@click.option('--dry-run', 'dry_run', is_flag=True, help="Only list the artifacts to be deleted")
+@click.pass_obj
+def prune(catalog, keep_last, max_age_days, dry_run) -> None:
+    deleted = catalog.prune(keep_last, timedelta(days=max_age_days), dry_run=dry_run)
+    for path in deleted:
+        print(path)
+    print(f"{'Would delete' if dry_run else 'Deleted'} {len(deleted)} artifacts")
+
+
+@cli.command('compact')
+@click.pass_obj
+def compact(catalog) -> None:
+    print(f"Dropped {catalog.compact()} missing artifacts")
+
+
+if __name__ == '__main__':
+    cli()
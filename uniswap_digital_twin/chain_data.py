@@ -0,0 +1,247 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from itertools import count
+from typing import Dict, Iterable, List, Tuple
+import os
+import numpy as np
+import pandas as pd
+import requests
+from pandas import DataFrame
+from Data import convert_to_unix
+
+######Global Params#######
+rpc_url = os.environ.get('ETH_RPC_URL', 'http://localhost:8545')
+
+PAIR = "0x8ae720a71622e824f576b4a8c03031066548a3b1"
+#Decimals of token0 (RAI) and token1 (WETH), and of the pair liquidity token
+DECIMALS = (18, 18)
+UNI_DECIMALS = 18
+
+#Event topics of the pair
+MINT_TOPIC = "0x4c209b5fc8ad50758f13e2e1088ba56a560dff690a1c6fef26394f4c03821c4f"  # Mint(address,uint256,uint256)
+BURN_TOPIC = "0xdccd412f0b1252819cb1fd330b93224ca42612892bb3f4f789976e6d81936496"  # Burn(address,uint256,uint256,address)
+SWAP_TOPIC = "0xd78ad95fa46c994b6551d0da85fc275fe613ce37657fb8d5e3d130840159d822"  # Swap(address,uint256,uint256,uint256,uint256,address)
+SYNC_TOPIC = "0x1c411e9a96e071241c2f21f7726b17ae89e3cab4c78be50e062b03a9fffbbad1"  # Sync(uint112,uint112)
+TRANSFER_TOPIC = "0xddf252ad1be2c89b69c2b068fc378daa952ba7f163c4a11628f55a4df523b3ef"  # Transfer(address,address,uint256)
+PAIR_TOPICS = [MINT_TOPIC, BURN_TOPIC, SWAP_TOPIC, SYNC_TOPIC, TRANSFER_TOPIC]
+
+ZERO_TOPIC = "0x" + "0" * 64
+TOTAL_SUPPLY_SELECTOR = "0x18160ddd"
+#########################
+
+_request_ids = count()
+
+
+class JsonRpcError(Exception):
+    def __init__(self, code: int, message: str) -> None:
+        super().__init__(f"{code}: {message}")
+        self.code = code
+
+
+def _result(response: dict) -> object:
+    if 'error' in response:
+        raise JsonRpcError(response['error'].get('code'), response['error'].get('message'))
+    return response['result']
+
+
+def rpc_call(method: str, params: list, url: str = None) -> object:
+    """
+    Single JSON-RPC request.
+    """
+    payload = {'jsonrpc': '2.0', 'id': next(_request_ids), 'method': method, 'params': params}
+    return _result(requests.post(url or rpc_url, json=payload).json())
+
+
+def rpc_batch(calls: List[Tuple[str, list]], url: str = None) -> List[object]:
+    """
+    JSON-RPC batch request. Results are returned in the order of `calls`.
+    """
+    payload = [{'jsonrpc': '2.0', 'id': i, 'method': method, 'params': params}
+               for (i, (method, params)) in enumerate(calls)]
+    responses = sorted(requests.post(url or rpc_url, json=payload).json(), key=lambda r: r['id'])
+    return [_result(response) for response in responses]
+
+
+def block_at(timestamp: int, url: str = None) -> int:
+    """
+    First block with a timestamp at or after `timestamp`, by bisection.
+    """
+    (lo, hi) = (0, int(rpc_call('eth_blockNumber', [], url), 16) + 1)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        block = rpc_call('eth_getBlockByNumber', [hex(mid), False], url)
+        if int(block['timestamp'], 16) < timestamp:
+            lo = mid + 1
+        else:
+            hi = mid
+    return lo
+
+
+def get_logs(from_block: int, to_block: int, url: str = None,
+             address: str = PAIR, topics: List[str] = PAIR_TOPICS) -> List[dict]:
+    """
+    Logs of `address` on a block range. Ranges rejected by the node (too
+    many results or too wide a range) are split in halves until they pass.
+    """
+    log_filter = {'address': address,
+                  'fromBlock': hex(from_block),
+                  'toBlock': hex(to_block),
+                  'topics': [topics]}
+    try:
+        return rpc_call('eth_getLogs', [log_filter], url)
+    except JsonRpcError:
+        if from_block >= to_block:
+            raise
+        mid = (from_block + to_block) // 2
+        return get_logs(from_block, mid, url, address, topics) + get_logs(mid + 1, to_block, url, address, topics)
+
+
+def fetch_logs(from_block: int, to_block: int, url: str = None,
+               chunk_blocks: int = 5000, max_workers: int = 4) -> List[dict]:
+    """
+    Logs of the pair on a block range, requested in chunks of
+    `chunk_blocks` blocks with `max_workers` concurrent requests.
+    """
+    ranges = [(start, min(start + chunk_blocks - 1, to_block))
+              for start in range(from_block, to_block + 1, chunk_blocks)]
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        chunks = executor.map(lambda r: get_logs(r[0], r[1], url), ranges)
+        return [log for chunk in chunks for log in chunk]
+
+
+def block_timestamps(blocks: Iterable[int], url: str = None,
+                     batch_size: int = 500, max_workers: int = 4) -> Dict[int, int]:
+    """
+    Timestamps of `blocks`, through batched `eth_getBlockByNumber` requests.
+    """
+    blocks = sorted(set(blocks))
+    batches = [blocks[i:i + batch_size] for i in range(0, len(blocks), batch_size)]
+
+    def fetch(batch):
+        return rpc_batch([('eth_getBlockByNumber', [hex(block), False]) for block in batch], url)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        results = [block for batch in executor.map(fetch, batches) for block in batch]
+    return {int(block['number'], 16): int(block['timestamp'], 16) for block in results}
+
+
+def total_supply(block: int, url: str = None, address: str = PAIR) -> float:
+    """
+    Supply of the pair liquidity token at the end of `block`.
+    """
+    result = rpc_call('eth_call', [{'to': address, 'data': TOTAL_SUPPLY_SELECTOR}, hex(block)], url)
+    return int(result, 16) / 10 ** UNI_DECIMALS
+
+
+def _words(data: str) -> List[int]:
+    data = data[2:]
+    return [int(data[i:i + 64], 16) for i in range(0, len(data), 64)]
+
+
+def decode_logs(logs: List[dict], timestamps: Dict[int, int], initial_supply: float) -> DataFrame:
+    """
+    Decode the pair logs into the schema of `Data.create_data`. Balances
+    are the reserves of the `Sync` emitted with each event, and the
+    liquidity token deltas are the mints and burns of the `Transfer` logs.
+
+    Parameters
+    ----------
+    logs : List[dict]
+        Logs of the pair, as returned by `eth_getLogs`
+    timestamps : Dict[int, int]
+        Unix timestamp of each block
+    initial_supply : float
+        Liquidity token supply before the first log
+
+    Returns
+    -------
+    DataFrame
+        A dataframe with the uniswap data
+
+    """
+    (scale0, scale1) = (10 ** DECIMALS[0], 10 ** DECIMALS[1])
+    logs = sorted(logs, key=lambda log: (int(log['blockNumber'], 16), int(log['logIndex'], 16)))
+    reserves = (np.nan, np.nan)
+    #Supply changes not yet attributed to a mint or burn
+    pending_UNI = 0.0
+    rows = []
+    for log in logs:
+        topic = log['topics'][0]
+        words = _words(log['data'])
+        if topic == SYNC_TOPIC:
+            reserves = (words[0] / scale0, words[1] / scale1)
+            continue
+        elif topic == TRANSFER_TOPIC:
+            value = words[0] / 10 ** UNI_DECIMALS
+            if log['topics'][1] == ZERO_TOPIC:
+                pending_UNI += value
+            elif log['topics'][2] == ZERO_TOPIC:
+                pending_UNI -= value
+            continue
+        elif topic == MINT_TOPIC:
+            (event, token_delta, eth_delta) = ('mint', words[0] / scale0, words[1] / scale1)
+            (UNI_delta, pending_UNI) = (pending_UNI, 0.0)
+        elif topic == BURN_TOPIC:
+            (event, token_delta, eth_delta) = ('burn', -words[0] / scale0, -words[1] / scale1)
+            (UNI_delta, pending_UNI) = (pending_UNI, 0.0)
+        elif topic == SWAP_TOPIC:
+            (amount0In, amount1In, amount0Out, amount1Out) = words
+            token_delta = amount0In / scale0 - amount0Out / scale0
+            eth_delta = amount1In / scale1 - amount1Out / scale1
+            event = 'ethPurchase' if token_delta > 0 else 'tokenPurchase'
+            UNI_delta = 0.0
+        else:
+            continue
+        rows.append((timestamps[int(log['blockNumber'], 16)], token_delta, eth_delta,
+                     int(log['logIndex'], 16), UNI_delta, event, *reserves))
+
+    data = pd.DataFrame(rows, columns=['timestamp', 'token_delta', 'eth_delta', 'logIndex',
+                                       'UNI_delta', 'event', 'token_balance', 'eth_balance'])
+    data['timestamp'] = pd.to_datetime(data['timestamp'], unit='s')
+    data['liquidity'] = (data['token_balance'] * data['eth_balance']) ** .5
+    data['UNI_supply'] = data['UNI_delta'].cumsum() + initial_supply
+    return data
+
+
+def create_data(start_date: datetime,
+                end_date: datetime,
+                url: str = None,
+                chunk_blocks: int = 5000,
+                max_workers: int = 4) -> DataFrame:
+    """
+    Pull and decode the pair events from a JSON-RPC node, as an
+    alternative to the subgraph-based `Data.create_data`.
+
+    Parameters
+    ----------
+    start_date : datetime
+        The start date of the data
+    end_date : datetime
+        The end date of the data (inclusive)
+    url : str, optional
+        The url of the JSON-RPC node, defaults to `rpc_url`
+    chunk_blocks : int, optional
+        Initial block range of each `eth_getLogs` request
+    max_workers : int, optional
+        Number of concurrent requests
+
+    Returns
+    -------
+    DataFrame
+        A dataframe with the uniswap data
+
+    """
+    start_unix = convert_to_unix(start_date)
+    end_unix = convert_to_unix(end_date + pd.Timedelta("1D")) - 1
+    from_block = block_at(start_unix, url)
+    to_block = block_at(end_unix + 1, url) - 1
+
+    logs = fetch_logs(from_block, to_block, url, chunk_blocks, max_workers)
+    #Some clients include the block timestamp on the logs
+    if all('blockTimestamp' in log for log in logs):
+        timestamps = {int(log['blockNumber'], 16): int(log['blockTimestamp'], 16) for log in logs}
+    else:
+        timestamps = block_timestamps((int(log['blockNumber'], 16) for log in logs),
+                                      url, max_workers=max_workers)
+    initial_supply = total_supply(from_block - 1, url)
+    return decode_logs(logs, timestamps, initial_supply)
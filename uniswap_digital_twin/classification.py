@@ -0,0 +1,93 @@
+import numpy as np
+import pandas as pd
+from Types import BacktestingData
+from batched import is_retail
+
+# Trader classification of the historical swaps, computed once per event
+# history rather than on every step of the backtest. Everything here
+# depends only on the events, so `p_actionDecoder` is left with the
+# reads of the simulated reserves.
+
+SWAP_EVENTS = ('tokenPurchase', 'ethPurchase')
+TRADER_CLASSES = ('Conv', 'Arb')
+# Swap inputs on the orientation of the event, as on `policy_aux.get_parameters`
+CLASSIFIED_COLUMNS = ['trader_class', 'delta_I', 'delta_O', 'I_t1', 'O_t1',
+                      'target_price', 'reverse_target_price']
+
+
+def classify_events(events: BacktestingData, retail_precision: int = 3) -> BacktestingData:
+    """
+    Label every swap as a convenience ("Conv") or an arbitrage ("Arb")
+    trade, as `policy_aux.classifier` does, and store the swap inputs
+    along with the target prices of both sides.
+
+    Parameters
+    ----------
+    events : BacktestingData
+        Event level data, as returned by `Data.create_data`
+    retail_precision : int
+        Decimal places of the round amounts traded by convenience traders
+
+    Returns
+    -------
+    BacktestingData
+        A copy of `events` with the `CLASSIFIED_COLUMNS` added, and the
+        precision used kept on `attrs['retail_precision']`. The columns
+        are missing values on liquidity events.
+
+    """
+    events = events.copy()
+    is_token_purchase = (events['event'] == 'tokenPurchase').to_numpy()
+    is_swap = events['event'].isin(SWAP_EVENTS).to_numpy()
+
+    def side(input_column, output_column):
+        values = np.where(is_token_purchase, events[input_column], events[output_column])
+        return np.where(is_swap, values, np.nan)
+
+    delta_I = side('eth_delta', 'token_delta')
+    delta_O = side('token_delta', 'eth_delta')
+    I_t1 = side('eth_balance', 'token_balance')
+    O_t1 = side('token_balance', 'eth_balance')
+
+    retail = is_retail(delta_I, delta_O, retail_precision)
+    trader_class = np.where(retail, 'Conv', 'Arb')
+    events['trader_class'] = pd.Categorical(np.where(is_swap, trader_class, None),
+                                            categories=list(TRADER_CLASSES))
+    events['delta_I'] = delta_I
+    events['delta_O'] = delta_O
+    events['I_t1'] = I_t1
+    events['O_t1'] = O_t1
+    events['target_price'] = I_t1 / O_t1
+    events['reverse_target_price'] = O_t1 / I_t1
+    events.attrs['retail_precision'] = retail_precision
+    return events
+
+
+def is_classified(events: BacktestingData, retail_precision: int) -> bool:
+    """
+    Whether `events` holds a classification made with `retail_precision`.
+    """
+    return ('trader_class' in events.columns
+            and events.attrs.get('retail_precision') == retail_precision)
+
+
+def class_breakdown(events: BacktestingData, retail_precision: int = 3) -> pd.DataFrame:
+    """
+    Number of swaps and ETH volume of each trader class.
+
+    Returns
+    -------
+    DataFrame
+        Swap counts, share of the swaps, ETH volume and share of the ETH
+        volume, indexed by event and trader class
+
+    """
+    if not is_classified(events, retail_precision):
+        events = classify_events(events, retail_precision)
+    swaps = events[events['event'].isin(SWAP_EVENTS)]
+    volume = swaps['eth_delta'].abs().rename('eth_volume')
+    grouped = volume.groupby([swaps['event'].astype(str), swaps['trader_class']], observed=True)
+    breakdown = pd.DataFrame({'swaps': grouped.size(), 'eth_volume': grouped.sum()})
+    breakdown['swap_share'] = breakdown['swaps'] / breakdown['swaps'].sum()
+    breakdown['volume_share'] = breakdown['eth_volume'] / breakdown['eth_volume'].sum()
+    return breakdown
@@ -0,0 +1,430 @@
+from dataclasses import dataclass, field
+from itertools import product
+from multiprocessing import get_context
+from multiprocessing.managers import BaseManager
+from queue import Empty, Queue
+from time import perf_counter, sleep
+from typing import Dict, List, Optional, Tuple
+import os
+import secrets
+import socket
+import click
+import numpy as np
+import pandas as pd
+from batched import model_params, simulate_reserves
+from kernels import AGENT_CODES
+
+# Distributed sweeps of the batched engine. A coordinator serves a task
+# queue over TCP (`multiprocessing.managers`), and workers on any host
+# pull shards of (signal rows, agent type, parameter overrides). The
+# signal matrix and model parameters are fetched once per worker and
+# sweep, so that tasks and results only carry row ranges and reserves.
+
+AUTHKEY_VARIABLE = 'TWIN_CLUSTER_AUTHKEY'
+DEFAULT_PORT = 8051
+
+
+@dataclass
+class SweepPayload():
+    sweep_id: str
+    initial_rai: float
+    initial_eth: float
+    # Signal of each path, as (paths, timesteps)
+    signals: np.ndarray
+    timesteps: int
+    params: dict
+    # Dtype of the reserves sent back by the workers
+    dtype: str = 'float64'
+
+
+@dataclass
+class ShardResult():
+    task_id: int
+    sweep_id: str
+    worker: str
+    rai: np.ndarray
+    eth: np.ndarray
+    elapsed: float
+    counters: dict = field(default_factory=dict)
+
+
+class _CoordinatorState():
+    """
+    Payload of the current sweep, on the coordinator server process.
+    """
+
+    def __init__(self) -> None:
+        self.payload = None
+
+    def set_payload(self, payload: Optional[SweepPayload]) -> None:
+        self.payload = payload
+
+    def get_payload(self, sweep_id: str) -> Optional[SweepPayload]:
+        payload = self.payload
+        return payload if payload is not None and payload.sweep_id == sweep_id else None
+
+
+# Shared objects of the coordinator server process
+_tasks = Queue()
+_results = Queue()
+_state = _CoordinatorState()
+
+
+def _get_tasks() -> Queue:
+    return _tasks
+
+
+def _get_results() -> Queue:
+    return _results
+
+
+def _get_state() -> _CoordinatorState:
+    return _state
+
+
+class _Manager(BaseManager):
+    pass
+
+
+_Manager.register('tasks', callable=_get_tasks)
+_Manager.register('results', callable=_get_results)
+_Manager.register('state', callable=_get_state)
+
+
+def parse_address(address: str) -> Tuple[str, int]:
+    (host, _, port) = address.rpartition(':')
+    return (host or '127.0.0.1', int(port) if port else DEFAULT_PORT)
+
+
+def resolve_authkey(authkey: Optional[bytes]) -> bytes:
+    if authkey is not None:
+        return authkey
+    if AUTHKEY_VARIABLE not in os.environ:
+        raise ValueError(f"No cluster authkey given, and {AUTHKEY_VARIABLE} is not set")
+    return os.environ[AUTHKEY_VARIABLE].encode()
+
+
+class Coordinator():
+    """
+    TCP server of the sweep tasks, on its own process. Sweeps are
+    submitted one at a time with `run_sweep`.
+    """
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, authkey: bytes = None) -> None:
+        self.authkey = resolve_authkey(authkey)
+        self._manager = _Manager(address=(host, port), authkey=self.authkey, ctx=get_context('spawn'))
+        self._manager.start()
+        self._tasks = self._manager.tasks()
+        self._results = self._manager.results()
+        self._state = self._manager.state()
+
+    @property
+    def address(self) -> str:
+        (host, port) = self._manager.address
+        return f'{host}:{port}'
+
+    def run_sweep(self,
+                  payload: SweepPayload,
+                  tasks: List[dict],
+                  task_timeout: float = 600.0,
+                  log=None) -> Tuple[Dict[int, ShardResult], dict]:
+        """
+        Queue `tasks` under `payload` and gather their results. Tasks
+        without a result `task_timeout` seconds after the queue is drained
+        are queued again, so that the shards of a lost worker are redone.
+        Duplicate results are dropped.
+        """
+        self._state.set_payload(payload)
+        for task in tasks:
+            self._tasks.put({**task, 'sweep_id': payload.sweep_id})
+        results = {}
+        (requeued, stale) = (0, 0)
+        while len(results) < len(tasks):
+            try:
+                result = self._results.get(timeout=task_timeout)
+            except Empty:
+                if self._tasks.qsize() > 0:
+                    continue
+                missing = [task for task in tasks if task['task_id'] not in results]
+                for task in missing:
+                    self._tasks.put({**task, 'sweep_id': payload.sweep_id})
+                requeued += len(missing)
+                continue
+            if isinstance(result, Exception):
+                raise result
+            if result.sweep_id != payload.sweep_id or result.task_id in results:
+                stale += 1
+                continue
+            results[result.task_id] = result
+            if log is not None:
+                log(f"Shard {result.task_id} done by {result.worker} in {result.elapsed:.2f}s "
+                    f"({len(results)}/{len(tasks)})")
+        self._state.set_payload(None)
+        workers = sorted({result.worker for result in results.values()})
+        return (results, {'tasks': len(tasks), 'requeued': requeued, 'stale': stale,
+                          'workers': workers})
+
+    def stop_workers(self, n: int) -> None:
+        for _ in range(n):
+            self._tasks.put(None)
+
+    def close(self) -> None:
+        self._manager.shutdown()
+
+
+def run_shard(payload: SweepPayload, task: dict) -> Tuple[np.ndarray, np.ndarray, dict]:
+    rows = slice(task['start'], task['stop'])
+    signals = payload.signals[rows, :payload.timesteps]
+    agents = np.full(len(signals), AGENT_CODES[task['agent_type']])
+    params = {**payload.params, **task['params']}
+    counters = {}
+    (rai, eth) = simulate_reserves(payload.initial_rai, payload.initial_eth, signals,
+                                   agents, payload.timesteps, params, counters)
+    return (rai.astype(payload.dtype), eth.astype(payload.dtype), counters)
+
+
+def connect(address: str, authkey: bytes = None, connect_timeout: float = 60.0) -> _Manager:
+    """
+    Connect to the coordinator at `address`, retrying until it is up or
+    `connect_timeout` seconds have passed.
+    """
+    manager = _Manager(address=parse_address(address), authkey=resolve_authkey(authkey))
+    t1 = perf_counter()
+    while True:
+        try:
+            manager.connect()
+            return manager
+        except ConnectionRefusedError:
+            if connect_timeout is not None and perf_counter() - t1 > connect_timeout:
+                raise
+            sleep(1)
+
+
+def worker_loop(address: str,
+                authkey: bytes = None,
+                idle_timeout: float = None,
+                connect_timeout: float = 60.0) -> int:
+    """
+    Pull and run shards from the coordinator at `address` until it sends
+    a stop sentinel, shuts down or stays idle for `idle_timeout` seconds.
+    Returns the number of shards run.
+    """
+    manager = connect(address, authkey, connect_timeout)
+    (tasks, results, state) = (manager.tasks(), manager.results(), manager.state())
+    worker = f'{socket.gethostname()}:{os.getpid()}'
+    payload = None
+    done = 0
+    while True:
+        try:
+            task = tasks.get(timeout=idle_timeout)
+        except Empty:
+            return done
+        except (EOFError, OSError):
+            # The coordinator shut down
+            return done
+        if task is None:
+            return done
+        if payload is None or payload.sweep_id != task['sweep_id']:
+            payload = state.get_payload(task['sweep_id'])
+            if payload is None:
+                # Task of a finished sweep
+                continue
+        t1 = perf_counter()
+        try:
+            (rai, eth, counters) = run_shard(payload, task)
+        except Exception as e:
+            results.put(RuntimeError(f"Shard {task['task_id']} failed on {worker}: {e!r}"))
+            continue
+        results.put(ShardResult(task['task_id'], payload.sweep_id, worker, rai, eth,
+                                perf_counter() - t1, counters))
+        done += 1
+
+
+class LocalCluster():
+    """
+    Coordinator and worker processes on this host, as a stand-in for a
+    cluster of machines. Workers are spawned, so that they only share
+    what they fetch from the coordinator.
+    """
+
+    def __init__(self, n_workers: int = None) -> None:
+        self.n_workers = n_workers or os.cpu_count()
+        self.coordinator = Coordinator(authkey=secrets.token_hex(16).encode())
+        context = get_context('spawn')
+        self.workers = [context.Process(target=worker_loop,
+                                        args=(self.coordinator.address, self.coordinator.authkey),
+                                        daemon=True)
+                        for _ in range(self.n_workers)]
+        for process in self.workers:
+            process.start()
+
+    @property
+    def address(self) -> str:
+        return self.coordinator.address
+
+    def close(self) -> None:
+        self.coordinator.stop_workers(len(self.workers))
+        for process in self.workers:
+            process.join(timeout=10)
+            if process.is_alive():
+                process.terminate()
+        self.coordinator.close()
+
+    def __enter__(self) -> 'LocalCluster':
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+
+def distributed_sweep(coordinator: Coordinator,
+                      initial_rai: float,
+                      initial_eth: float,
+                      signals: np.ndarray,
+                      timesteps: int,
+                      agent_types: List[str] = ["Arb1", "Arb2"],
+                      sweep: Dict[str, list] = None,
+                      params: dict = None,
+                      shard_size: int = 256,
+                      dtype: str = 'float64',
+                      task_timeout: float = 600.0,
+                      log=None) -> pd.DataFrame:
+    """
+    Batched extrapolation of every signal sample for every combination of
+    agent type and swept parameter values, sharded over the workers of
+    `coordinator`.
+
+    Parameters
+    ----------
+    signals : np.ndarray
+        Signal of each run, with shape (runs, timesteps)
+    sweep : Dict[str, list], optional
+        Values of the model parameters to sweep, e.g.
+        {'fee_percentage': [0.001, 0.003, 0.01]}
+    shard_size : int
+        Signal rows per task
+    dtype : str
+        Dtype of the reserves sent back, 'float32' halving the transfer
+
+    Returns
+    -------
+    DataFrame
+        Results on the same long format as `batched.simulate_batched`, with
+        one subset per combination and a column per swept parameter. The
+        task counts and workers are stored on `attrs['distributed']`.
+
+    """
+    if params is None:
+        params = model_params()
+    sweep = sweep or {}
+    signals = np.ascontiguousarray(np.atleast_2d(signals)[:, :timesteps])
+    n_samples = len(signals)
+    payload = SweepPayload(secrets.token_hex(8), float(initial_rai), float(initial_eth),
+                           signals, timesteps, params, dtype)
+
+    combinations = [dict(zip(sweep, values)) for values in product(*sweep.values())]
+    subsets = [(agent_type, overrides) for overrides in combinations for agent_type in agent_types]
+    shards = [(subset, start) for subset in range(len(subsets)) for start in range(0, n_samples, shard_size)]
+    tasks = [{'task_id': task_id, 'subset': subset, 'agent_type': subsets[subset][0],
+              'params': subsets[subset][1], 'start': start, 'stop': min(start + shard_size, n_samples)}
+             for (task_id, (subset, start)) in enumerate(shards)]
+
+    t1 = perf_counter()
+    (results, info) = coordinator.run_sweep(payload, tasks, task_timeout, log)
+    T = timesteps + 1
+    rai = np.empty((len(subsets), n_samples, T), dtype=dtype)
+    eth = np.empty((len(subsets), n_samples, T), dtype=dtype)
+    counters = {}
+    for task in tasks:
+        result = results[task['task_id']]
+        rai[task['subset'], task['start']:task['stop']] = result.rai.T
+        eth[task['subset'], task['start']:task['stop']] = result.eth.T
+        for (k, v) in result.counters.items():
+            counters[k] = counters.get(k, 0) + v
+
+    N = len(subsets) * n_samples
+    df = pd.DataFrame({'RAI_balance': rai.ravel(),
+                       'ETH_balance': eth.ravel(),
+                       'Ratio': None,
+                       'Action': None,
+                       'simulation': 0,
+                       'subset': np.repeat(np.arange(len(subsets)), n_samples * T),
+                       'run': np.tile(np.repeat(np.arange(n_samples) + 1, T), len(subsets)),
+                       'timestep': np.tile(np.arange(T), N)})
+    for name in sweep:
+        df[name] = np.repeat([overrides[name] for (_, overrides) in subsets], n_samples * T)
+    df.attrs['fee_band_skip'] = counters
+    df.attrs['distributed'] = {**info, 'elapsed': perf_counter() - t1,
+                               'subsets': [{'agent_type': agent_type, **overrides}
+                                           for (agent_type, overrides) in subsets]}
+    return df
+
+
+def simulate_distributed(initial_rai: float,
+                         initial_eth: float,
+                         signals: np.ndarray,
+                         timesteps: int,
+                         address: str = None,
+                         authkey: bytes = None,
+                         **kwargs) -> pd.DataFrame:
+    """
+    `distributed_sweep` on the coordinator served at `address`, or on a
+    `LocalCluster` started for the call when `address` is None.
+    """
+    if address is None:
+        with LocalCluster() as cluster:
+            return distributed_sweep(cluster.coordinator, initial_rai, initial_eth,
+                                     signals, timesteps, **kwargs)
+    (host, port) = parse_address(address)
+    coordinator = Coordinator(host, port, authkey)
+    try:
+        return distributed_sweep(coordinator, initial_rai, initial_eth, signals, timesteps, **kwargs)
+    finally:
+        coordinator.close()
+
+
+@click.group()
+def cli() -> None:
+    """
+    Workers of the distributed sweeps. The coordinator runs on the
+    extrapolation cycle, with the `--cluster` option.
+    """
+    pass
+
+
+@cli.command()
+@click.option('-a', '--address', 'address', default=f'127.0.0.1:{DEFAULT_PORT}',
+              help="Address of the coordinator, as host:port")
+@click.option('-w', '--workers', 'workers', default=1, help="Worker processes on this host")
+@click.option('--idle-timeout', 'idle_timeout', default=None, type=float,
+              help="Exit after this many seconds without tasks")
+@click.option('--reconnect/--no-reconnect', 'reconnect', default=True,
+              help="Wait for the next coordinator once one shuts down")
+def worker(address, workers, idle_timeout, reconnect) -> None:
+    """
+    Run shards from a coordinator, with the authkey taken from the
+    TWIN_CLUSTER_AUTHKEY environment variable.
+    """
+    authkey = resolve_authkey(None)
+    if workers == 1:
+        _worker_process(address, authkey, idle_timeout, reconnect)
+        return
+    context = get_context('spawn')
+    processes = [context.Process(target=_worker_process, args=(address, authkey, idle_timeout, reconnect))
+                 for _ in range(workers)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+
+
+def _worker_process(address: str, authkey: bytes, idle_timeout: float, reconnect: bool) -> None:
+    while True:
+        done = worker_loop(address, authkey, idle_timeout, connect_timeout=None if reconnect else 60.0)
+        print(f"Ran {done} shards from {address}")
+        if not reconnect:
+            return
+
+
+if __name__ == '__main__':
+    cli()
@@ -0,0 +1,48 @@
+from dataclasses import dataclass
+import numpy as np
+from scipy.special import ndtri
+
+
+@dataclass
+class Estimate():
+    value: float
+    half_width: float
+    samples: int
+
+
+def _z(confidence: float) -> float:
+    return float(ndtri(0.5 + confidence / 2))
+
+
+def mean_estimate(values: np.ndarray,
+                  confidence: float = 0.95,
+                  antithetic: bool = False) -> Estimate:
+    """
+    Sample mean and its confidence interval half-width. With `antithetic`,
+    sample i and sample i + (n + 1) // 2 are averaged into a single
+    independent observation, as generated by the 'antithetic' sampling.
+    The middle sample of an odd n has no mirror and is left out.
+    """
+    values = np.asarray(values, dtype=float)
+    n = len(values)
+    if antithetic:
+        offset = (n + 1) // 2
+        values = (values[:n - offset] + values[offset:]) / 2
+    half_width = _z(confidence) * values.std(ddof=1) / np.sqrt(len(values))
+    return Estimate(float(values.mean()), float(half_width), n)
+
+
+def quantile_estimate(values: np.ndarray,
+                      q: float,
+                      confidence: float = 0.95) -> Estimate:
+    """
+    Sample quantile, with a distribution-free interval from the order
+    statistics (normal approximation to the binomial).
+    """
+    values = np.sort(np.asarray(values, dtype=float))
+    n = len(values)
+    spread = _z(confidence) * np.sqrt(n * q * (1 - q))
+    lower = values[max(int(np.floor(n * q - spread)), 0)]
+    upper = values[min(int(np.ceil(n * q + spread)), n - 1)]
+    return Estimate(float(np.quantile(values, q)), float((upper - lower) / 2), n)
+
@@ -0,0 +1,266 @@
+from dataclasses import dataclass
+from typing import List, Tuple
+import numpy as np
+import pandas as pd
+from Types import BacktestingData
+from batched import (apply_trades, decode_actions, is_retail,
+                     model_params, within_fee_band)
+from kernels import AGENT_CODES, agent_trades
+
+# Event types of the event-driven simulation
+ARBITRAGE = 0
+RETAIL = 1
+MINT = 2
+BURN = 3
+EVENT_NAMES = np.array(['arbitrage', 'retail', 'mint', 'burn', None], dtype=object)
+
+
+@dataclass
+class ArrivalModel():
+    """
+    Empirical activity model of the pool.
+
+    rates: arrival intensity per hour of the day of each event type,
+           with shape (4, 24) and units of events per hour
+    retail_amounts: amounts sold to the pool by retail swaps
+    retail_eth_sold: whether each retail swap sold ETH (or RAI)
+    mint_pcts / burn_pcts: liquidity changes relative to the UNI supply
+    start_hour: hour of the day when the extrapolation starts
+    """
+    rates: np.ndarray
+    retail_amounts: np.ndarray
+    retail_eth_sold: np.ndarray
+    mint_pcts: np.ndarray
+    burn_pcts: np.ndarray
+    start_hour: int
+
+
+def fit_arrivals(events: BacktestingData, retail_precision: int = 3) -> ArrivalModel:
+    """
+    Fit the arrival intensities and the empirical trade and liquidity
+    distributions from the backtesting events.
+    """
+    events = events.iloc[1:]
+    timestamps = pd.to_datetime(events['timestamp'])
+    hours = (timestamps.max() - timestamps.min()) / pd.Timedelta('1h')
+    hour_of_day = timestamps.dt.hour.values
+    event = events['event'].astype(str).values
+    token_delta = events['token_delta'].values
+    eth_delta = events['eth_delta'].values
+
+    is_swap = np.isin(event, ['tokenPurchase', 'ethPurchase'])
+    retail = is_swap & is_retail(token_delta, eth_delta, retail_precision)
+    types = np.select([retail, is_swap, event == 'mint', event == 'burn'],
+                      [RETAIL, ARBITRAGE, MINT, BURN],
+                      -1)
+
+    rates = np.zeros((4, 24))
+    valid = types >= 0
+    np.add.at(rates, (types[valid], hour_of_day[valid]), 1)
+    rates /= max(hours / 24, 1)
+
+    # Positive deltas flow into the pool
+    retail_eth_sold = eth_delta[retail] > 0
+    retail_amounts = np.where(retail_eth_sold, eth_delta[retail], token_delta[retail])
+
+    previous_supply = events['UNI_supply'].values - events['UNI_delta'].values
+    liquidity_pcts = events['UNI_delta'].values / previous_supply
+    return ArrivalModel(rates=rates,
+                        retail_amounts=retail_amounts,
+                        retail_eth_sold=retail_eth_sold,
+                        mint_pcts=liquidity_pcts[types == MINT],
+                        burn_pcts=liquidity_pcts[types == BURN],
+                        start_hour=int(timestamps.iloc[-1].hour))
+
+
+def sample_arrivals(model: ArrivalModel,
+                    horizon: int,
+                    samples: int,
+                    rng: np.random.Generator) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Sample the event times (in hours) and types of every sample through a
+    piecewise constant Poisson process.
+
+    Returns
+    -------
+    Tuple[np.ndarray, np.ndarray]
+        Times and types, with shape (samples, max events). Samples with
+        fewer events are padded with NaN times and -1 types.
+
+    """
+    hour_rates = model.rates[:, (model.start_hour + np.arange(horizon)) % 24]
+    total_rates = hour_rates.sum(axis=0)
+    counts = rng.poisson(total_rates, (samples, horizon))
+
+    n_events = counts.sum(axis=1)
+    sample_index = np.repeat(np.arange(samples), n_events)
+    hour = np.repeat(np.tile(np.arange(horizon), samples), counts.ravel())
+    times = hour + rng.random(len(hour))
+
+    # Event type given the hour, through the inverse CDF of the type mix
+    cdf = np.cumsum(hour_rates / np.maximum(total_rates, 1e-300), axis=0)
+    u = rng.random(len(hour))
+    types = (u[None, :] > cdf[:, hour]).sum(axis=0).clip(0, 3)
+
+    order = np.lexsort((times, sample_index))
+    starts = np.concatenate([[0], np.cumsum(n_events)[:-1]])
+    position = np.arange(len(order)) - np.repeat(starts, n_events)
+
+    K = n_events.max() if samples > 0 else 0
+    padded_times = np.full((samples, K), np.nan)
+    padded_types = np.full((samples, K), -1)
+    padded_times[sample_index[order], position] = times[order]
+    padded_types[sample_index[order], position] = types[order]
+    return (padded_times, padded_types)
+
+
+def _swap(rai, eth, amount_in, eth_sold, fee):
+    """
+    Constant product swap of `amount_in`, with the fee kept in the pool.
+    """
+    (I_t, O_t) = (np.where(eth_sold, eth, rai), np.where(eth_sold, rai, eth))
+    amount_in_with_fee = amount_in * (1 - fee)
+    amount_out = amount_in_with_fee * O_t / (I_t + amount_in_with_fee)
+    new_rai = np.where(eth_sold, rai - amount_out, rai + amount_in)
+    new_eth = np.where(eth_sold, eth + amount_in, eth - amount_out)
+    return (new_rai, new_eth)
+
+
+def simulate_event_driven(initial_rai: float,
+                          initial_eth: float,
+                          initial_uni: float,
+                          signals: np.ndarray,
+                          model: ArrivalModel,
+                          horizon: int,
+                          agent_types: List[str] = ["Arb1", "Arb2"],
+                          params: dict = None,
+                          seed: int = 0) -> pd.DataFrame:
+    """
+    Event-driven extrapolation. Each run only advances on its sampled
+    events: arbitrage swaps sized by the run agent against the signal of
+    the current hour, retail swaps, mints and burns drawn from the
+    empirical distributions of `model`. Runs are advanced in lockstep over
+    the event index, so the cost scales with the number of events rather
+    than with the horizon.
+
+    Returns
+    -------
+    DataFrame
+        Long format results with one subset per agent type and one run per
+        signal sample. `timestep` is the event index and `time` the event
+        time in hours. The number of arbitrage events skipped by the lossy
+        `approximate_fee_band_skip` is stored on `attrs['fee_band_skip']`.
+
+    """
+    if params is None:
+        params = model_params()
+    fee = params['fee_percentage']
+    rng = np.random.default_rng(seed)
+    signals = np.atleast_2d(signals)
+    n_samples = len(signals)
+
+    agents = np.repeat([AGENT_CODES[agent] for agent in agent_types], n_samples)
+    run_signals = np.tile(signals[:, :horizon], (len(agent_types), 1))
+    N = len(agents)
+    (times, types) = sample_arrivals(model, horizon, N, rng)
+    K = times.shape[1]
+
+    rai = np.empty((K + 1, N))
+    eth = np.empty((K + 1, N))
+    uni = np.empty((K + 1, N))
+    (rai[0], eth[0], uni[0]) = (initial_rai, initial_eth, initial_uni)
+    runs = np.arange(N)
+    counters = {'skipped': 0, 'steps': 0}
+    for k in range(K):
+        (rai_k, eth_k, uni_k) = (rai[k].copy(), eth[k].copy(), uni[k].copy())
+        event = types[:, k]
+
+        # Arbitrage agents
+        arb = event == ARBITRAGE
+        if arb.any():
+            hour = np.minimum(times[arb, k].astype(int), horizon - 1)
+            signal = run_signals[runs[arb], hour]
+            active = np.flatnonzero(arb)
+            counters['steps'] += len(active)
+            if params.get('approximate_fee_band_skip', False):
+                outside = ~within_fee_band(signal, rai_k[active], eth_k[active], fee)
+                counters['skipped'] += int((~outside).sum())
+                (active, signal) = (active[outside], signal[outside])
+            if len(active) > 0:
+                (r, e) = (rai_k[active], eth_k[active])
+                (eth_delta, rai_delta, eth_sold) = agent_trades(agents[active], e, r, signal)
+                I_t = np.where(eth_sold, e, r)
+                O_t = np.where(eth_sold, r, e)
+                delta_I = np.where(eth_sold, eth_delta, rai_delta)
+                delta_O = np.where(eth_sold, rai_delta, eth_delta)
+                sold = decode_actions(I_t, O_t, delta_I, delta_O, eth_sold, params)
+                (rai_k[active], eth_k[active]) = apply_trades(r, e, sold, eth_sold, fee)
+
+        # Retail swaps
+        retail = np.flatnonzero(event == RETAIL)
+        if len(retail) > 0:
+            draw = rng.integers(len(model.retail_amounts), size=len(retail))
+            (rai_k[retail], eth_k[retail]) = _swap(rai_k[retail], eth_k[retail],
+                                                   model.retail_amounts[draw],
+                                                   model.retail_eth_sold[draw],
+                                                   fee)
+
+        # Liquidity changes, proportional to the pool
+        for (event_type, pcts) in ((MINT, model.mint_pcts), (BURN, model.burn_pcts)):
+            changed = np.flatnonzero(event == event_type)
+            if len(changed) > 0 and len(pcts) > 0:
+                growth = 1 + pcts[rng.integers(len(pcts), size=len(changed))]
+                rai_k[changed] *= growth
+                eth_k[changed] *= growth
+                uni_k[changed] *= growth
+
+        (rai[k + 1], eth[k + 1], uni[k + 1]) = (rai_k, eth_k, uni_k)
+
+    # Drop the padding after the last event of each run
+    n_events = (types >= 0).sum(axis=1)
+    valid = np.arange(K + 1)[:, None] <= n_events[None, :]
+    event_names = EVENT_NAMES[np.vstack([np.full((1, N), -1), types.T])]
+    event_times = np.vstack([np.zeros((1, N)), times.T])
+    df = pd.DataFrame({'RAI_balance': rai.T[valid.T],
+                       'ETH_balance': eth.T[valid.T],
+                       'UNI_supply': uni.T[valid.T],
+                       'event': event_names.T[valid.T],
+                       'time': event_times.T[valid.T],
+                       'simulation': 0,
+                       'subset': np.repeat(runs // n_samples, n_events + 1),
+                       'run': np.repeat(runs % n_samples + 1, n_events + 1),
+                       'timestep': np.concatenate([np.arange(n + 1) for n in n_events])})
+    df.attrs['fee_band_skip'] = counters
+    return df
+
+
+def hourly_states(extrapolation: pd.DataFrame, horizon: int = None) -> pd.DataFrame:
+    """
+    Event-driven results sampled on the hour, as on the output of the
+    hourly engines: `timestep` h holds the state of each run after its
+    last event at or before hour h, so that every run has the same
+    timesteps.
+
+    Parameters
+    ----------
+    extrapolation : pd.DataFrame
+        Output of `simulate_event_driven`, with rows ordered by event
+        within each run
+    horizon : int, optional
+        Last hour, the one of the last event by default
+
+    """
+    if horizon is None:
+        horizon = int(np.ceil(extrapolation['time'].max()))
+    paths = extrapolation.groupby(['subset', 'run'], sort=False).ngroup().to_numpy()
+    order = np.lexsort((extrapolation['timestep'].to_numpy(), paths))
+    (paths, times) = (paths[order], extrapolation['time'].to_numpy()[order])
+    # Search all the paths at once, each offset past the hours of the previous ones
+    offset = horizon + 2
+    hours = np.arange(horizon + 1)
+    n_paths = paths.max() + 1
+    queries = (np.arange(n_paths)[:, None] * offset + hours[None, :]).ravel()
+    rows = np.searchsorted(paths * offset + times, queries, side='right') - 1
+    hourly = extrapolation.iloc[order[rows]].drop(columns=['event', 'time'], errors='ignore')
+    hourly['timestep'] = np.tile(hours, n_paths)
+    return hourly.reset_index(drop=True)
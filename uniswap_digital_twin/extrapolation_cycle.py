@@ -2,7 +2,6 @@ from time import time
 from datetime import datetime, timedelta
 from pathlib import Path
 import os
-from os import listdir
 from typing import List, Tuple
 from dataclasses import dataclass
 from enum import Enum
@@ -11,26 +10,107 @@ from Types import BacktestingData, Days, USD_per_ETH, ExogenousData
 from cadCAD_tools.execution import easy_run
 from cadCAD_tools.preparation import prepare_params, Param, ParamSweep
 from Data import create_data
+import chain_data
+from aggregation import aggregate_events
+from loader import load_events, BACKTEST_COLUMNS
+from batched import model_params, simulate_batched, signal_matrix
+from event_driven import fit_arrivals, hourly_states, simulate_event_driven
+from population import AGENT_TYPES as POPULATION_AGENT_TYPES, simulate_population
+from distributed import simulate_distributed
+from shared_data import SharedEvents, SharedEventsHandle
+from classification import classify_events
+from pipeline import Stage, run_pipeline
+from catalog import RunCatalog
+from impact import surface_from_run
+from lp_analytics import lp_metrics
+from adaptive import adaptive_extrapolation
+from cache import ResultCache, DEFAULT_MAX_BYTES, code_version, digest, file_digest
 import matplotlib.pyplot as plt
-from stochastic import FitParams, generate_eth_samples, generate_ratio_samples
+from stochastic import FitParams, SignalFit, generate_eth_samples, generate_ratio_samples
+from stochastic import resample_ratio, fit_log_ratio, fit_log_ratio_bayesian, fit_gamma
+from stochastic import generate_samples
 import numpy as np
 import papermill as pm
 from json import dump
 
 def retrieve_data(output_path: str,
-                  date_range: Tuple[datetime, datetime]) -> None:
+                  date_range: Tuple[datetime, datetime],
+                  rpc_url: str = None) -> None:
     """
-    Download data and store it to a *.csv.xz file.
+    Download data and store it to a *.csv.xz file. The data comes from the
+    subgraph, or from the pair logs of a JSON-RPC node when `rpc_url` is set.
     """
-    df = create_data(start_date=date_range[0], end_date=date_range[1])
+    if rpc_url is None:
+        df = create_data(start_date=date_range[0], end_date=date_range[1])
+    else:
+        df = chain_data.create_data(start_date=date_range[0], end_date=date_range[1], url=rpc_url)
     df.to_csv(output_path, compression='gzip')
 
 
-def prepare(data_path: str) -> BacktestingData:
-    return pd.read_csv(data_path,index_col=0)
+# Parameters which carry data rather than model configuration
+DATA_PARAMS = ('uniswap_events', 'extrapolated_signals')
+
+
+def model_params_key(params: dict) -> dict:
+    """
+    Prepared model parameters without the data-carrying entries, for use
+    on cache keys.
+    """
+    return {k: v for k, v in prepare_params(params).items()
+            if k not in DATA_PARAMS}
+
+
+def backtest_cache_key(data_path: str, bucket: str = None) -> str:
+    import model as default_model
+    return digest('backtest',
+                  file_digest(data_path),
+                  bucket,
+                  model_params_key(default_model.parameters),
+                  code_version())
+
+
+def extrapolation_cache_key(backtest_key: str,
+                            signal_params: SignalFit,
+                            seeds: List[int],
+                            timesteps: int,
+                            initial_ratio: float,
+                            engine: str = 'cadCAD',
+                            process: str = 'random_walk',
+                            process_kwargs: dict = None) -> str:
+    import model as default_model
+    params = {**default_model.parameters,
+              'backtest_mode': Param(False, bool),
+              'agent_type': ParamSweep(["Arb1", "Arb2"], str)}
+    return digest('extrapolation',
+                  backtest_key,
+                  signal_params,
+                  process,
+                  process_kwargs,
+                  seeds,
+                  timesteps,
+                  initial_ratio,
+                  engine,
+                  model_params_key(params),
+                  code_version())
+
+
+def prepare(data_path: str,
+            columns: List[str] = BACKTEST_COLUMNS,
+            chunksize: int = None) -> BacktestingData:
+    """
+    Load the retrieved events with explicit data types, keeping only
+    `columns`. When `chunksize` is given, the file is parsed in chunks.
+    """
+    (df, report) = load_events(data_path, columns=columns, chunksize=chunksize)
+    print(report)
+    return df
+
+def rmse(true: BacktestingData, predicted: BacktestingData) -> pd.Series:
+    return (((true-predicted) ** 2).sum() / len(true)) ** .5
+
 
 def simulation_loss(true: BacktestingData, predicted: BacktestingData) -> None:
-    loss = (((true-predicted) ** 2).sum() / len(true)) ** .5
+    loss = rmse(true, predicted)
     print("RMSE:")
     print(loss)
     
@@ -43,18 +123,40 @@ def simulation_loss(true: BacktestingData, predicted: BacktestingData) -> None:
         plt.legend(['True', 'Predicted'])
         plt.show()
         
-def stochastic_fit(input_data: object) -> FitParams:
+def stochastic_fit(input_data: BacktestingData,
+                   bar_size: str = '1h',
+                   bayesian: bool = False) -> SignalFit:
     """
     Acquire parameters for the stochastic input signals.
     """
+    ratio = resample_ratio(input_data, bar_size)
+    log_ratio = np.log1p(ratio.values)
+
+    if bayesian is True:
+        (ratio_params, _) = fit_log_ratio_bayesian(log_ratio)
+    else:
+        ratio_params = fit_log_ratio(log_ratio)
 
-    params = FitParams(0.000036906289210966747, 0.014081285145600045)
+    params = SignalFit(ratio=ratio_params,
+                       eth=fit_gamma(ratio.values),
+                       initial_ratio=float(log_ratio[-1]),
+                       bar_size=bar_size)
     return params
 
-def backtest_model(historical_events_data: BacktestingData) -> pd.DataFrame:
+def backtest_model(historical_events_data: BacktestingData,
+                   bucket: str = None,
+                   report: bool = True,
+                   share_events: bool = False) -> pd.DataFrame:
     """
     Runs the cadCAD model in backtesting model and using `backtesting_data`
     as one of the parameters.
+
+    If `bucket` is given, the events are netted into time buckets of that
+    size before running (see `aggregation.aggregate_events`).
+
+    With `share_events`, the events are published into shared memory and
+    only a handle to them is set on the parameters, so that simulation
+    worker processes attach to them instead of receiving a pickled copy.
     """
 
     """
@@ -65,17 +167,29 @@ def backtest_model(historical_events_data: BacktestingData) -> pd.DataFrame:
     # HACK
     import model as default_model
 
+    if bucket is not None:
+        historical_events_data = aggregate_events(historical_events_data, bucket)
+
     # Set-up initial state
-    initial_state = default_model.initial_state
+    initial_state = {**default_model.initial_state}
     
     
     initial_state.update({'RAI_balance': historical_events_data.loc[0, "token_balance"]})
     initial_state.update({'ETH_balance': historical_events_data.loc[0, "eth_balance"]})
 
     # Set-up params
-    params = default_model.parameters
+    params = {**default_model.parameters}
+
+    # Classify the swaps up-front, unless the precision is swept
+    if isinstance(params['retail_precision'], Param):
+        historical_events_data = classify_events(historical_events_data,
+                                                 params['retail_precision'].value)
     
-    params.update({'uniswap_events': Param(historical_events_data, BacktestingData)})
+    shared_events = SharedEvents(historical_events_data) if share_events else None
+    if shared_events is None:
+        params.update({'uniswap_events': Param(historical_events_data, BacktestingData)})
+    else:
+        params.update({'uniswap_events': Param(shared_events.handle, SharedEventsHandle)})
 
     timesteps = len(historical_events_data) - 1
 
@@ -83,13 +197,17 @@ def backtest_model(historical_events_data: BacktestingData) -> pd.DataFrame:
 
 
     # Run cadCAD model
-    raw_sim_df = easy_run(initial_state,
-                          params,
-                          default_model.PSUBs[1:],
-                          timesteps,
-                          1,
-                          drop_substeps=True,
-                          assign_params=False)
+    try:
+        raw_sim_df = easy_run(initial_state,
+                              params,
+                              default_model.PSUBs[1:],
+                              timesteps,
+                              1,
+                              drop_substeps=True,
+                              assign_params=False)
+    finally:
+        if shared_events is not None:
+            shared_events.close()
     
     #Post processing
     sim_df = default_model.post_processing(raw_sim_df)
@@ -98,18 +216,73 @@ def backtest_model(historical_events_data: BacktestingData) -> pd.DataFrame:
     test_df = historical_events_data[['token_balance','eth_balance']]
     test_df.columns = ['RAI_balance', 'ETH_balance']
 
-    simulation_loss(test_df, sim_df)
+    if report is True:
+        simulation_loss(test_df, sim_df)
 
     return (sim_df, test_df, raw_sim_df)
 
 
 
-def extrapolate_data(backtesting_data, extrapolated_signals, timesteps, initial_ratio, bt)  -> pd.DataFrame:
+def extrapolate_data(backtesting_data, extrapolated_signals, timesteps, initial_ratio, bt, engine='cadCAD',
+                     cluster=None, params=None)  -> pd.DataFrame:
+    """
+    Extrapolate the pool reserves from the last backtested state.
+
+    `engine` is either 'cadCAD', 'batched', 'event_driven', 'population' or
+    'distributed'. The batched
+    engine advances all runs in lockstep (see `batched.simulate_batched`)
+    and also accepts several signal samples, each becoming a run of every
+    agent type. The event-driven engine does the same, but only advances on
+    Poisson arrivals fitted on `backtesting_data`, with retail swaps, mints
+    and burns resampled from it (see `event_driven.simulate_event_driven`).
+    The population engine replaces the single agent of each run by
+    arbitrageurs, noise traders and LPs trading on every timestep (see
+    `population.simulate_population`).
+    The distributed engine shards the batched runs over the workers of the
+    coordinator served at `cluster` (host:port), or of a local cluster when
+    it is None (see `distributed.simulate_distributed`).
+
+    `params` overrides the scalar model parameters of this call only, for
+    instance `{'approximate_fee_band_skip': True}`, which trades the exact
+    model results for speed.
+    """
+    overrides = params
+    if overrides is not None:
+        params = {**model_params(), **overrides}
+    if engine == 'distributed':
+        return simulate_distributed(bt["RAI_balance"].iloc[-1],
+                                    bt["ETH_balance"].iloc[-1],
+                                    signal_matrix(extrapolated_signals),
+                                    timesteps,
+                                    params=params,
+                                    address=cluster)
+    if engine == 'population':
+        return simulate_population(bt["RAI_balance"].iloc[-1],
+                                   bt["ETH_balance"].iloc[-1],
+                                   backtesting_data["UNI_supply"].iloc[-1],
+                                   signal_matrix(extrapolated_signals),
+                                   timesteps,
+                                   params=params)
+    if engine == 'event_driven':
+        return simulate_event_driven(bt["RAI_balance"].iloc[-1],
+                                     bt["ETH_balance"].iloc[-1],
+                                     backtesting_data["UNI_supply"].iloc[-1],
+                                     signal_matrix(extrapolated_signals),
+                                     fit_arrivals(backtesting_data),
+                                     timesteps,
+                                     params=params)
+    if engine == 'batched':
+        return simulate_batched(bt["RAI_balance"].iloc[-1],
+                                bt["ETH_balance"].iloc[-1],
+                                signal_matrix(extrapolated_signals),
+                                timesteps,
+                                params=params)
+
     # HACK
     import model as default_model
 
     # Set-up initial state
-    initial_state = default_model.initial_state
+    initial_state = {**default_model.initial_state}
     
     
     initial_state.update({'RAI_balance': bt["RAI_balance"].iloc[-1]})
@@ -118,7 +291,9 @@ def extrapolate_data(backtesting_data, extrapolated_signals, timesteps, initial_
     
 
     # Set-up params
-    params = default_model.parameters
+    params = {**default_model.parameters}
+    if overrides is not None:
+        params.update({k: Param(v, type(v)) for (k, v) in overrides.items()})
     params.update({'uniswap_events': Param(None, BacktestingData)})
     params.update({'extrapolated_signals': Param(extrapolated_signals, np.array)})
     params.update({'backtest_mode':Param(False, bool)})
@@ -163,12 +338,29 @@ def extrapolate_data(backtesting_data, extrapolated_signals, timesteps, initial_
 def extrapolate_signals(signal_params: FitParams,
                         timesteps: int,
                         initial_price: USD_per_ETH,
-                        N_samples=3) -> tuple[ExogenousData, ...]:
+                        N_samples=3,
+                        process='random_walk',
+                        sampling='pseudo',
+                        **process_kwargs) -> tuple[ExogenousData, ...]:
+    """
+    Generate `N_samples` ratio signals from the `process` registered on
+    `stochastic.SIGNAL_PROCESSES`, with innovations drawn according to
+    `sampling` ('pseudo', 'antithetic' or 'sobol').
+    """
 
-    eth_series_list = generate_ratio_samples(signal_params,
+    if process == 'random_walk':
+        eth_series_list = generate_ratio_samples(signal_params,
+                                                 timesteps,
+                                                 N_samples,
+                                                 initial_price)
+    else:
+        eth_series_list = generate_samples(process,
+                                           signal_params,
                                            timesteps,
                                            N_samples,
-                                           initial_price)
+                                           initial_price,
+                                           sampling=sampling,
+                                           **process_kwargs)
 
     # Clean-up data for injecting on the cadCAD model
     exogenous_data_sweep = tuple(tuple({'ratio': el}
@@ -186,13 +378,72 @@ def extrapolation_cycle(base_path: str = None,
                         extrapolation_samples: int = 1,
                         extrapolation_timesteps: int = 7 * 24 * 7,
                         use_last_data=False,
-                        generate_reports=True) -> object:
+                        generate_reports=True,
+                        backtest_bucket=None,
+                        bar_size='1h',
+                        bayesian_fit=False,
+                        signal_process='random_walk',
+                        signal_process_kwargs=None,
+                        signal_sampling='pseudo',
+                        load_chunksize=None,
+                        simulation_engine='cadCAD',
+                        use_cache=True,
+                        cache_max_bytes=DEFAULT_MAX_BYTES,
+                        rpc_url=None,
+                        resume=None,
+                        max_workers=4,
+                        adaptive_rtol=None,
+                        adaptive_time_budget=None,
+                        adaptive_max_samples=10_000,
+                        cluster_address=None) -> object:
     """
     Perform a entire extrapolation cycle.
+
+    The cycle is a DAG of stages (see `pipeline.run_pipeline`), so that
+    writing artifacts, fitting and generating signals, and rendering the
+    report overlap where they do not depend on each other. The stage
+    timings and the critical path are printed at the end.
+
+    When `backtest_bucket` is set, the backtest runs on events netted into
+    buckets of that size rather than on every individual event.
+
+    When `use_cache` is True, backtest and extrapolation results are
+    looked up on a content-addressed cache under `data/runs/cache` before
+    being computed.
+
+    When `rpc_url` is set, the events are retrieved from the logs of that
+    JSON-RPC node rather than from the subgraph.
+
+    When `resume` is the runtime of a previous cycle, its artifacts are
+    reused and the stages whose outputs were written from the same inputs
+    and parameters are skipped.
+
+    Without adaptive sampling, `price_samples` signals are generated but
+    only the first one is written and extrapolated, as on the original
+    cadCAD cycle. `signal_sampling` then has no variance reduction effect
+    (and the 'random_walk' process ignores it): it is meant for the
+    adaptive extrapolation below, which uses every sample it draws.
+
+    When `adaptive_rtol` or `adaptive_time_budget` is set, the
+    extrapolation draws signal samples in batches rather than using a fixed
+    `price_samples`, until the confidence intervals of the final reserves
+    and tracking error of every agent type are within `adaptive_rtol` of
+    their estimates, or the time budget (in seconds) or
+    `adaptive_max_samples` is spent (see `adaptive.adaptive_extrapolation`).
+    The achieved precision and sample count are written on the metadata.
+
+    With the 'distributed' engine, the runs are sharded over the workers
+    connecting to a coordinator served on `cluster_address` (host:port),
+    or over a local cluster when it is None.
     """
     t1 = time()
-    print("0. Retrieving Data\n---")
-    runtime = datetime.utcnow()
+    runtime = datetime.utcnow() if resume is None else resume
+    adaptive = adaptive_rtol is not None or adaptive_time_budget is not None
+    # Label of each subset of the extrapolation
+    agent_types = list(POPULATION_AGENT_TYPES) if simulation_engine == 'population' else ['Arb1', 'Arb2']
+    adaptive_kwargs = {'rtol': adaptive_rtol or 0.0,
+                       'time_budget': adaptive_time_budget,
+                       'max_samples': adaptive_max_samples} if adaptive else None
 
     if base_path is None:
         working_path = Path(os.getcwd())
@@ -200,110 +451,230 @@ def extrapolation_cycle(base_path: str = None,
     else:
         working_path = Path(base_path)
         data_path = working_path / 'data/runs'
+
+    cache = ResultCache(data_path / 'cache',
+                        max_bytes=cache_max_bytes,
+                        enabled=use_cache)
     
+    catalog = RunCatalog(data_path)
     if use_last_data is False:
-        date_end = runtime - timedelta(days=historical_lag)
-        date_start = date_end - timedelta(days=historical_interval)
-        date_range = (date_start, date_end)
-
         historical_data_path = data_path / f'{runtime}_retrieval.csv.gz'
-        retrieve_data(str(historical_data_path),
-                      date_range)
-        print(f"Data written at {historical_data_path}")
     else:
-        files = listdir(data_path.expanduser())
-        files = sorted(
-            file for file in files if 'retrieval.csv.gz' in file)
-        historical_data_path = data_path / f'{files[-1]}'
+        if catalog.latest('retrieval') is None:
+            # Folder from before the catalog
+            catalog.index_directory()
+        historical_data_path = catalog.latest('retrieval')
         print(f"Using last data at {historical_data_path}")
+    catalog.register_run(runtime, {'historical_interval': historical_interval,
+                                   'historical_lag': historical_lag,
+                                   'price_samples': price_samples,
+                                   'extrapolation_samples': extrapolation_samples,
+                                   'extrapolation_timesteps': extrapolation_timesteps,
+                                   'retrieval': catalog._relative(historical_data_path),
+                                   'backtest_bucket': backtest_bucket,
+                                   'bar_size': bar_size,
+                                   'bayesian_fit': bayesian_fit,
+                                   'signal_process': signal_process,
+                                   'signal_process_kwargs': signal_process_kwargs,
+                                   'signal_sampling': signal_sampling,
+                                   'simulation_engine': simulation_engine,
+                                   'agent_types': agent_types,
+                                   'rpc_url': rpc_url,
+                                   'adaptive': adaptive_kwargs})
+
+    def retrieve():
+        print("0. Retrieving Data\n---")
+        date_end = datetime.utcnow() - timedelta(days=historical_lag)
+        date_start = date_end - timedelta(days=historical_interval)
+        retrieve_data(str(historical_data_path),
+                      (date_start, date_end),
+                      rpc_url)
+        print(f"Data written at {historical_data_path}")
+        return historical_data_path
+
+    def prepare_data(path):
+        print("1. Preparing Data\n---")
+        return prepare(str(path), chunksize=load_chunksize)
+
+    def backtest(backtesting_data):
+        print("2. Backtesting Model\n---")
+        backtest_key = backtest_cache_key(str(historical_data_path), backtest_bucket)
+        backtest_results = cache.get(backtest_key)
+        if backtest_results is None:
+            backtest_results = backtest_model(backtesting_data, bucket=backtest_bucket)
+            cache.put(backtest_key, backtest_results)
+        else:
+            print(f"Using cached backtest {backtest_key[:12]}")
+        return (backtest_key, backtest_results)
+
+    def write_backtest(backtest):
+        (_, backtest_results) = backtest
+        backtest_results[0].to_csv(data_path / f'{runtime}-backtesting.csv.gz',
+                                   compression='gzip',
+                                   index=False)
+
+        backtest_results[1].to_csv(data_path / f'{runtime}-historical.csv.gz',
+                                   compression='gzip',
+                                   index=False)
+
+    def write_metadata(backtesting_data, extrapolation=None):
+        timestamps = (backtesting_data['timestamp'].min(), backtesting_data['timestamp'].max())
+
+        metadata = {'createdAt': str(runtime),
+                    'initial_backtesting_timestamp': str(timestamps[0]),
+                    'final_backtesting_timestamp': str(timestamps[-1]),
+                    'agent_types': agent_types}
+        if extrapolation is not None and 'adaptive' in extrapolation[0].attrs:
+            metadata['adaptive'] = extrapolation[0].attrs['adaptive']
+
+        with open(data_path.expanduser() / f"{runtime}-meta.json", 'w') as fid:
+            dump(metadata, fid)
+
+    def fit(backtesting_data):
+        print("3. Fitting Stochastic Processes\n---")
+        stochastic_params = stochastic_fit(backtesting_data,
+                                           bar_size=bar_size,
+                                           bayesian=bayesian_fit)
+        print(stochastic_params)
+        return stochastic_params
+
+    def signals(backtesting_data, stochastic_params):
+        print("4. Extrapolating Exogenous Signals\n---")
+        kwargs = dict(signal_process_kwargs or {})
+        if signal_process == 'bootstrap' and 'returns' not in kwargs:
+            ratio_bars = resample_ratio(backtesting_data, bar_size)
+            kwargs['returns'] = np.diff(np.log1p(ratio_bars.values))
+
+        extrapolated_signals = extrapolate_signals(stochastic_params.ratio,
+                                                   extrapolation_timesteps + 10,
+                                                   stochastic_params.initial_ratio,
+                                                   price_samples,
+                                                   signal_process,
+                                                   signal_sampling,
+                                                   **kwargs)
+        return (extrapolated_signals, kwargs)
+
+    def write_signal(signals):
+        # The adaptive signals are only known after the extrapolation
+        if adaptive:
+            (_, extrapolation_signals) = signals
+        else:
+            extrapolation_signals = signal_matrix(signals[0][0])
+        (runs, length) = extrapolation_signals.shape
+        if runs == 1:
+            signal_df = pd.DataFrame({'ratio': extrapolation_signals[0]})
+        else:
+            signal_df = pd.DataFrame({'run': np.repeat(np.arange(runs) + 1, length),
+                                      'ratio': extrapolation_signals.ravel()},
+                                     index=np.tile(np.arange(length), runs))
+        signal_df.to_csv(data_path / f'{runtime}-signal.csv.gz',
+                         compression='gzip')
+
+    def extrapolate(backtesting_data, backtest, stochastic_params, signals):
+        print("5. Extrapolating Future Data\n---")
+        (backtest_key, backtest_results) = backtest
+        (extrapolated_signals, kwargs) = signals
+        N_t = extrapolation_timesteps
+        initial_ratio = stochastic_params.initial_ratio
+        extrapolation_key = extrapolation_cache_key(backtest_key,
+                                                    stochastic_params,
+                                                    list(range(price_samples)),
+                                                    N_t,
+                                                    initial_ratio,
+                                                    simulation_engine,
+                                                    signal_process,
+                                                    {**kwargs,
+                                                     'sampling': signal_sampling,
+                                                     'adaptive': adaptive_kwargs})
+        signals_key = digest(extrapolation_key, 'signals')
+        extrapolation_df = cache.get(extrapolation_key)
+        if adaptive:
+            extrapolation_signals = cache.get(signals_key)
+        else:
+            extrapolation_signals = signal_matrix(extrapolated_signals[0])
+        if adaptive and (extrapolation_df is None or extrapolation_signals is None):
+            result = adaptive_extrapolation(backtesting_data, backtest_results[0], stochastic_params, N_t,
+                                            simulation_engine,
+                                            process=signal_process,
+                                            sampling=signal_sampling,
+                                            cluster=cluster_address,
+                                            **adaptive_kwargs,
+                                            **kwargs)
+            print(f"Adaptive sampling stopped on {result.stop_reason} after {result.samples} samples")
+            (extrapolation_df, extrapolation_signals) = (result.extrapolation, result.signals)
+            cache.put(extrapolation_key, extrapolation_df)
+            cache.put(signals_key, extrapolation_signals)
+        elif extrapolation_df is None:
+            extrapolation_df = extrapolate_data(backtesting_data, extrapolated_signals[0], N_t, np.exp(initial_ratio)-1, backtest_results[0],
+                                                engine=simulation_engine,
+                                                cluster=cluster_address)
+            extrapolation_df = extrapolation_df.reset_index(drop=True)
+            cache.put(extrapolation_key, extrapolation_df)
+        else:
+            print(f"Using cached extrapolation {extrapolation_key[:12]}")
+
+        # HACK
+        import model as default_model
+        skip = default_model.fee_band_skip_counts(extrapolation_df)
+        print(f"Approximate fee band skip: {skip['skipped']} of {skip['steps']} steps skipped")
+        return (extrapolation_df, extrapolation_signals)
+
+    def on_the_hour(extrapolation_df):
+        # Event-driven runs are numbered by event, the other engines by hour
+        if 'time' in extrapolation_df.columns:
+            return hourly_states(extrapolation_df)
+        return extrapolation_df
+
+    def plot_convergence(extrapolation):
+        (extrapolation_df, extrapolation_signals) = extrapolation
+        extrapolation_df = on_the_hour(extrapolation_df)
+        print("Test Code for Agents Convergence:")
+        pd.DataFrame({'ratio': extrapolation_signals[0]}).plot(kind='line')
+        # The first run of each agent type
+        first_run = extrapolation_df.groupby('subset')['run'].transform('min')
+        extrapolation_df = extrapolation_df[extrapolation_df['run'] == first_run]
+        labels = ['True Ratio']
+        for (subset, path) in extrapolation_df.groupby('subset'):
+            path = path.set_index('timestep')
+            (path['RAI_balance']/path['ETH_balance']).plot(kind='line')
+            labels.append(agent_types[subset] if subset < len(agent_types) else str(subset))
+        plt.legend(labels)
+        plt.ylabel("Price Ratio")
+        plt.title("Extrapolated Results")
+        plt.show()
 
-    print("1. Preparing Data\n---")
-    backtesting_data = prepare(str(historical_data_path))
-
-    print("2. Backtesting Model\n---")
-    backtest_results = backtest_model(backtesting_data)
-    
-
-
-    
-
-    backtest_results[0].to_csv(data_path / f'{runtime}-backtesting.csv.gz',
-                               compression='gzip',
-                               index=False)
-
-    backtest_results[1].to_csv(data_path / f'{runtime}-historical.csv.gz',
-                               compression='gzip',
-                               index=False)
-    print(backtesting_data.columns)
-    timestamps = (backtesting_data['timestamp'].min(), backtesting_data['timestamp'].max())
-
-    metadata = {'createdAt': str(runtime),
-                'initial_backtesting_timestamp': str(timestamps[0]),
-                'final_backtesting_timestamp': str(timestamps[-1])}
-
-    with open(data_path.expanduser() / f"{runtime}-meta.json", 'w') as fid:
-        dump(metadata, fid)
-        
-    
-    
-    print("3. Fitting Stochastic Processes\n---")
-    #stochastic_params = stochastic_fit(backtesting_data.exogenous_data)
-    stochastic_params = stochastic_fit(None)
-    
-    
-    
-    print("4. Extrapolating Exogenous Signals\n---")
-    N_t = extrapolation_timesteps
-    N_price_samples = price_samples
-    
-    #initial_price = backtest_results[0].iloc[-1].eth_price
-    initial_ratio = 6.455903839554217
-    
-    #extrapolated_signals = extrapolate_signals(stochastic_params,
-    #                                           N_t + 10,
-    #                                           initial_price,
-    #                                           N_price_samples)
-    
-    extrapolated_signals = extrapolate_signals(stochastic_params,
-                                               N_t + 10,
-                                               initial_ratio,
-                                               N_price_samples)
-
-    pd.DataFrame(extrapolated_signals[0]).to_csv(data_path / f'{runtime}-signal.csv.gz',
-                               compression='gzip')
-
-    
-    print("5. Extrapolating Future Data\n---")
-    N_extrapolation_samples = extrapolation_samples
-    extrapolation_df = extrapolate_data(backtesting_data, extrapolated_signals[0], N_t, np.exp(initial_ratio)-1, backtest_results[0])
-    extrapolation_df = extrapolation_df.reset_index(drop=True)
-    
-
-    print("Test Code for Arb Traders Convergence:")
-    pd.DataFrame(extrapolated_signals[0]).plot(kind='line')
-    a = extrapolation_df[extrapolation_df['subset'] == 0].set_index('timestep')
-    b = extrapolation_df[extrapolation_df['subset'] == 1].set_index('timestep')
-    (a['RAI_balance']/a['ETH_balance']).plot(kind='line')
-    (b['RAI_balance']/b['ETH_balance']).plot(kind='line')
-    plt.legend(['True Ratio', 'Arb Trader 1', 'Arb Trader 2'])
-    plt.ylabel("Price Ratio")
-    plt.title("Extrapolated Results")
-    plt.show()
-    
-    
-    extrapolation_df.to_csv(data_path / f'{runtime}-extrapolation.csv.gz',
-                            compression='gzip',
-                            index=False)
-
-    print("6. Exporting results\n---")
-    if generate_reports == True:
+    def write_impact(backtest, extrapolation):
+        # HACK
+        import model as default_model
+        (_, backtest_results) = backtest
+        (extrapolation_df, _) = extrapolation
+        surface = surface_from_run(backtest_results[0], extrapolation_df, agent_types,
+                                   fee_percentage=default_model.parameters['fee_percentage'].value)
+        surface.save(data_path / f'{runtime}-impact.npz')
+
+    def write_lp(backtesting_data, extrapolation):
+        (extrapolation_df, _) = extrapolation
+        (metrics, _) = lp_metrics(on_the_hour(extrapolation_df), backtesting_data['UNI_supply'].iloc[-1])
+        metrics.to_csv(data_path / f'{runtime}-lp.csv.gz',
+                       compression='gzip',
+                       index=False)
+
+    def write_extrapolation(extrapolation):
+        (extrapolation_df, _) = extrapolation
+        on_the_hour(extrapolation_df).to_csv(data_path / f'{runtime}-extrapolation.csv.gz',
+                                compression='gzip',
+                                index=False)
+
+    output_html_path = (
+        working_path / f'reports/{runtime}-extrapolation.html').expanduser()
+
+    def report(*_):
+        print("6. Exporting results\n---")
         path = str((data_path / f'{runtime}-').expanduser())
         input_nb_path = (
             working_path / 'templates/extrapolation.ipynb').expanduser()
         output_nb_path = (
             working_path / f'reports/{runtime}-extrapolation.ipynb').expanduser()
-        output_html_path = (
-            working_path / f'reports/{runtime}-extrapolation.html').expanduser()
         pm.execute_notebook(
             input_nb_path,
             output_nb_path,
@@ -312,9 +683,76 @@ def extrapolation_cycle(base_path: str = None,
         export_cmd = f"jupyter nbconvert --to html '{output_nb_path}'"
         os.system(export_cmd)
         os.system(f"rm '{output_nb_path}'")
-    
+
+    # HACK
+    import model as default_model
+
+    # Configuration of the stages, for resuming them
+    model_key = (model_params_key(default_model.parameters), code_version())
+    stages = [
+        Stage('retrieve', retrieve, outputs=(historical_data_path,),
+              load=lambda: historical_data_path),
+        Stage('prepare', prepare_data, ('retrieve',)),
+        Stage('backtest', backtest, ('prepare',),
+              params=(backtest_bucket, model_key)),
+        Stage('write_backtest', write_backtest, ('backtest',),
+              outputs=(data_path / f'{runtime}-backtesting.csv.gz',
+                       data_path / f'{runtime}-historical.csv.gz')),
+        Stage('write_metadata', write_metadata, ('prepare', 'extrapolate') if adaptive else ('prepare',),
+              outputs=(data_path / f'{runtime}-meta.json',)),
+        Stage('fit', fit, ('prepare',),
+              params=(bar_size, bayesian_fit)),
+        Stage('signals', signals, ('prepare', 'fit'),
+              params=(extrapolation_timesteps, price_samples, signal_process,
+                      signal_process_kwargs, signal_sampling)),
+        Stage('write_signal', write_signal, ('extrapolate',) if adaptive else ('signals',),
+              outputs=(data_path / f'{runtime}-signal.csv.gz',)),
+        Stage('extrapolate', extrapolate, ('prepare', 'backtest', 'fit', 'signals'),
+              params=(extrapolation_timesteps, simulation_engine, adaptive_kwargs, model_key)),
+        Stage('plot_convergence', plot_convergence, ('extrapolate',),
+              main_thread=True),
+        Stage('write_extrapolation', write_extrapolation, ('extrapolate',),
+              outputs=(data_path / f'{runtime}-extrapolation.csv.gz',)),
+        Stage('write_impact', write_impact, ('backtest', 'extrapolate'),
+              outputs=(data_path / f'{runtime}-impact.npz',)),
+        Stage('write_lp', write_lp, ('prepare', 'extrapolate'),
+              outputs=(data_path / f'{runtime}-lp.csv.gz',)),
+    ]
+    if generate_reports == True:
+        stages.append(Stage('report', report,
+                            ('write_backtest', 'write_metadata', 'write_signal', 'write_extrapolation'),
+                            outputs=(output_html_path,)))
+
+    try:
+        run = run_pipeline(stages, max_workers=max_workers)
+    except BaseException:
+        catalog.finish_run(runtime, wall_time=time() - t1, status='failed')
+        catalog.close()
+        raise
+    print(run.report())
+
+    # Index the artifacts of the run
+    backtesting_data = run.results['prepare']
+    if use_last_data is False:
+        catalog.add_artifact(runtime, 'retrieval', historical_data_path,
+                             coverage=(backtesting_data['timestamp'].min(),
+                                       backtesting_data['timestamp'].max()))
+    artifacts = {kind: data_path / f'{runtime}-{kind}.csv.gz'
+                 for kind in ('backtesting', 'historical', 'signal', 'extrapolation', 'lp')}
+    artifacts.update({'meta': data_path / f'{runtime}-meta.json',
+                      'impact': data_path / f'{runtime}-impact.npz',
+                      'report': output_html_path})
+    for (kind, path) in artifacts.items():
+        if path.exists():
+            catalog.add_artifact(runtime, kind, path)
+
     t2 = time()
+    catalog.finish_run(runtime, run.timings, wall_time=t2 - t1)
+    catalog.close()
     print(f"7. Done! {t2 - t1 :.2f}s\n---")
 
+    backtest_results = run.results['backtest'][1]
+    (extrapolation_df, _) = run.results['extrapolate']
+    stochastic_params = run.results['fit']
     output = (backtest_results, extrapolation_df, stochastic_params)
     return output
\ No newline at end of file
@@ -0,0 +1,186 @@
+from dataclasses import dataclass
+from pathlib import Path
+from typing import List, Union
+import numpy as np
+import pandas as pd
+from event_driven import hourly_states
+
+# Price impact surfaces of the constant product pool: the impact of
+# selling each size of a log-spaced grid, for both tokens, on every
+# timestep and sample of an extrapolation. Lookups interpolate on the
+# grid, so that what-if queries do not need to re-run the model.
+
+# Token sold, as the first axis of `ImpactSurface.impact`
+DIRECTIONS = ('ETH', 'RAI')
+
+
+def output_amount(delta_I: np.ndarray, I_t: np.ndarray, O_t: np.ndarray, fee: float) -> np.ndarray:
+    """
+    Constant product output with the fee on the input, without the
+    rounding of `policy_aux.get_output_amount`.
+    """
+    delta_I_with_fee = delta_I * (1 - fee)
+    return delta_I_with_fee * O_t / (I_t + delta_I_with_fee)
+
+
+def price_impact(delta_I: np.ndarray, I_t: np.ndarray, O_t: np.ndarray, fee: float) -> np.ndarray:
+    """
+    Relative shortfall of the execution price against the spot price O_t/I_t,
+    fee included.
+    """
+    return 1 - output_amount(delta_I, I_t, O_t, fee) / delta_I / (O_t / I_t)
+
+
+@dataclass
+class ImpactSurface():
+    # Trade sizes of each direction, as (2, n_sizes) log-spaced grids
+    sizes: np.ndarray
+    timesteps: np.ndarray
+    # Agent type of each sample
+    agent_types: np.ndarray
+    # Price impact as (direction, timestep, sample, size), in float32
+    impact: np.ndarray
+    # RAI and ETH reserves as (timestep, sample, 2)
+    reserves: np.ndarray
+    fee_percentage: float
+
+    def _grid_position(self, direction: int, amount: float) -> tuple:
+        # Constant time, as the grid is evenly spaced on log sizes
+        log_sizes = np.log(self.sizes[direction, [0, -1]])
+        n = self.sizes.shape[1]
+        position = (np.log(amount) - log_sizes[0]) / (log_sizes[1] - log_sizes[0]) * (n - 1)
+        if not 0 <= position <= n - 1:
+            raise ValueError(f"Amount outside of the surface, between {self.sizes[direction, 0]:g} "
+                             f"and {self.sizes[direction, -1]:g}")
+        i = min(int(position), n - 2)
+        return (i, position - i)
+
+    def lookup(self,
+               sell: str,
+               amount: float,
+               timestep: int = 0,
+               sample: Union[int, slice] = slice(None)) -> np.ndarray:
+        """
+        Interpolated price impact of selling `amount` of `sell` on
+        `timestep`, for one or all samples.
+        """
+        direction = DIRECTIONS.index(sell)
+        (i, w) = self._grid_position(direction, amount)
+        t = int(np.searchsorted(self.timesteps, timestep))
+        if t == len(self.timesteps) or self.timesteps[t] != timestep:
+            raise ValueError(f"Timestep {timestep} is not on the surface")
+        values = self.impact[direction, t, sample, i:i + 2].astype(np.float64)
+        return values[..., 0] * (1 - w) + values[..., 1] * w
+
+    def amount_out(self,
+                   sell: str,
+                   amount: float,
+                   timestep: int = 0,
+                   sample: Union[int, slice] = slice(None)) -> np.ndarray:
+        """
+        Output of selling `amount` of `sell`, from the interpolated impact.
+        """
+        t = int(np.searchsorted(self.timesteps, timestep))
+        (rai, eth) = (self.reserves[t, sample, 0], self.reserves[t, sample, 1])
+        spot = rai / eth if sell == 'ETH' else eth / rai
+        return amount * spot * (1 - self.lookup(sell, amount, timestep, sample))
+
+    def quantiles(self, sell: str, amount: float, timestep: int, q: List[float]) -> np.ndarray:
+        """
+        Percentiles `q` of the price impact across samples.
+        """
+        return np.percentile(self.lookup(sell, amount, timestep), q)
+
+    def save(self, path: Path) -> None:
+        with open(path, 'wb') as fid:
+            np.savez_compressed(fid,
+                                sizes=self.sizes,
+                                timesteps=self.timesteps,
+                                agent_types=self.agent_types.astype(str),
+                                impact=self.impact,
+                                reserves=self.reserves,
+                                fee_percentage=self.fee_percentage)
+
+    @classmethod
+    def load(cls, path: Path) -> 'ImpactSurface':
+        with np.load(path) as data:
+            return cls(data['sizes'], data['timesteps'], data['agent_types'], data['impact'],
+                       data['reserves'], float(data['fee_percentage']))
+
+
+def impact_surface(reserves: np.ndarray,
+                   timesteps: np.ndarray = None,
+                   agent_types: np.ndarray = None,
+                   fee_percentage: float = 0.003,
+                   n_sizes: int = 64,
+                   min_fraction: float = 1e-6,
+                   max_fraction: float = 0.5) -> ImpactSurface:
+    """
+    Price impact of selling each token against `reserves`.
+
+    Parameters
+    ----------
+    reserves : np.ndarray
+        RAI and ETH reserves, as (timestep, sample, 2)
+    timesteps : np.ndarray, optional
+        Timestep of each row of `reserves`, defaults to their position
+    agent_types : np.ndarray, optional
+        Agent type of each sample
+    fee_percentage : float
+        Pool fee, as on the `fee_percentage` model parameter
+    n_sizes : int
+        Number of trade sizes on each direction
+    min_fraction, max_fraction : float
+        Smallest and largest trade sizes, as fractions of the median
+        initial reserve of the token sold
+
+    Returns
+    -------
+    ImpactSurface
+
+    """
+    reserves = np.asarray(reserves, dtype=np.float64)
+    (T, S, _) = reserves.shape
+    timesteps = np.arange(T) if timesteps is None else np.asarray(timesteps)
+    agent_types = np.full(S, '') if agent_types is None else np.asarray(agent_types)
+    (rai, eth) = (reserves[..., 0, None], reserves[..., 1, None])
+
+    sizes = np.empty((len(DIRECTIONS), n_sizes))
+    impact = np.empty((len(DIRECTIONS), T, S, n_sizes), dtype=np.float32)
+    for (direction, (I_t, O_t)) in enumerate(((eth, rai), (rai, eth))):
+        reference = np.median(I_t[0])
+        sizes[direction] = np.geomspace(reference * min_fraction, reference * max_fraction, n_sizes)
+        impact[direction] = price_impact(sizes[direction], I_t, O_t, fee_percentage)
+
+    return ImpactSurface(sizes, timesteps, agent_types, impact, reserves, fee_percentage)
+
+
+def surface_from_run(backtest: pd.DataFrame,
+                     extrapolation: pd.DataFrame,
+                     agent_types: List[str] = None,
+                     **kwargs) -> ImpactSurface:
+    """
+    Surface along every extrapolated path of a cycle, from its
+    `-backtesting` and `-extrapolation` outputs. The samples are the
+    (subset, run) pairs of the extrapolation, with the subsets being the
+    agent type sweep of `extrapolation_cycle.extrapolate_data`, unless
+    labelled otherwise by `agent_types` or `attrs['agent_types']`.
+    Timestep 0 holds the latest backtested reserves. Event-driven results
+    are sampled on the hour (see `event_driven.hourly_states`).
+    """
+    if agent_types is None:
+        agent_types = extrapolation.attrs.get('agent_types', ["Arb1", "Arb2"])
+    if 'time' in extrapolation.columns:
+        extrapolation = hourly_states(extrapolation)
+    extrapolation = extrapolation[extrapolation['timestep'] > 0]
+    wide = extrapolation.pivot_table(index='timestep', columns=['subset', 'run'],
+                                     values=['RAI_balance', 'ETH_balance'])
+    samples = wide['RAI_balance'].columns
+    reserves = np.stack([wide['RAI_balance'][samples].values,
+                         wide['ETH_balance'][samples].values], axis=-1)
+    initial = np.array([backtest['RAI_balance'].iloc[-1], backtest['ETH_balance'].iloc[-1]])
+    reserves = np.concatenate([np.broadcast_to(initial, (1, len(samples), 2)), reserves])
+    timesteps = np.concatenate([[0], wide.index.values])
+    labels = np.array([agent_types[subset] if subset < len(agent_types) else str(subset)
+                       for (subset, _) in samples])
+    return impact_surface(reserves, timesteps, labels, **kwargs)
@@ -0,0 +1,149 @@
+import numpy as np
+
+try:
+    from numba import njit
+    HAS_NUMBA = True
+except ImportError:
+    HAS_NUMBA = False
+
+    def njit(*args, **kwargs):
+        if len(args) == 1 and callable(args[0]):
+            return args[0]
+        return lambda f: f
+
+# The kernels reproduce the sizing logic of `policy_aux.agent_action`,
+# and are compiled with Numba when it is available.
+
+ARB1 = 0
+ARB2 = 1
+AGENT_CODES = {'Arb1': ARB1, 'Arb2': ARB2}
+
+ARB1_ETH_SIZE = 10.0
+ARB2_OPTIMAL_FRACTION = .03
+
+
+@njit(cache=True)
+def arb1_trade(eth_res: float, rai_res: float, signal: float) -> tuple:
+    """
+    Fixed size ETH trade, halved until it does not overshoot the signal.
+    Returns (eth_delta, rai_delta, eth_sold).
+    """
+    eth_sold = signal < rai_res / eth_res
+    C = rai_res * eth_res
+    max_shift = abs(rai_res / eth_res - signal)
+    if eth_sold:
+        eth_delta = ARB1_ETH_SIZE
+    else:
+        eth_delta = -ARB1_ETH_SIZE
+    rai_delta = C / (eth_res + eth_delta) - rai_res
+    implied_shift = abs((rai_res + rai_delta) / (eth_res + eth_delta) - rai_res / eth_res)
+    while implied_shift > max_shift:
+        eth_delta = eth_delta / 2
+        rai_delta = C / (eth_res + eth_delta) - rai_res
+        implied_shift = abs((rai_res + rai_delta) / (eth_res + eth_delta) - rai_res / eth_res)
+    return (eth_delta, rai_delta, eth_sold)
+
+
+@njit(cache=True)
+def arb2_trade(eth_res: float, rai_res: float, signal: float) -> tuple:
+    """
+    Trade a fraction of the linearized optimal ETH amount.
+    Returns (eth_delta, rai_delta, eth_sold).
+    """
+    eth_sold = signal < rai_res / eth_res
+    C = rai_res * eth_res
+    amm_price = rai_res / eth_res
+    price_error = amm_price + signal
+    optimal_value = (eth_res * signal - rai_res) / price_error
+    eth_size = round(abs(optimal_value) * ARB2_OPTIMAL_FRACTION, 1)
+    if eth_sold:
+        eth_delta = eth_size
+    else:
+        eth_delta = -eth_size
+    rai_delta = C / (eth_res + eth_delta) - rai_res
+    return (eth_delta, rai_delta, eth_sold)
+
+
+@njit(cache=True)
+def agent_trades(agent: np.ndarray,
+                 eth_res: np.ndarray,
+                 rai_res: np.ndarray,
+                 signal: np.ndarray) -> tuple:
+    """
+    Batched agent sizing. `agent` holds the agent code of each run.
+    Returns the arrays (eth_delta, rai_delta, eth_sold).
+    """
+    n = len(eth_res)
+    eth_delta = np.empty(n)
+    rai_delta = np.empty(n)
+    eth_sold = np.empty(n, dtype=np.bool_)
+    for i in range(n):
+        if agent[i] == ARB1:
+            trade = arb1_trade(eth_res[i], rai_res[i], signal[i])
+        else:
+            trade = arb2_trade(eth_res[i], rai_res[i], signal[i])
+        eth_delta[i] = trade[0]
+        rai_delta[i] = trade[1]
+        eth_sold[i] = trade[2]
+    return (eth_delta, rai_delta, eth_sold)
+
+
+def agent_action_kernel(signal, s, params):
+    """
+    Drop-in replacement of `policy_aux.agent_action` backed by the kernels.
+    """
+    eth_res = s['ETH_balance']
+    rai_res = s['RAI_balance']
+    if params['agent_type'] == "Arb1":
+        (eth_delta, rai_delta, eth_sold) = arb1_trade(eth_res, rai_res, signal)
+    elif params['agent_type'] == "Arb2":
+        (eth_delta, rai_delta, eth_sold) = arb2_trade(eth_res, rai_res, signal)
+    else:
+        assert False
+    if eth_sold:
+        return (eth_res, rai_res, eth_res, rai_res, eth_delta, rai_delta, "eth_sold")
+    else:
+        return (rai_res, eth_res, rai_res, eth_res, rai_delta, eth_delta, "tokens_sold")
+
+
+def check_equivalence(n: int = 10_000,
+                      seed: int = 0,
+                      rtol: float = 1e-12) -> dict:
+    """
+    Compare the batched kernels against `policy_aux.agent_action` on random
+    reserves and signals around the RAI/ETH pool state.
+
+    Returns
+    -------
+    dict
+        Max relative difference of the ETH and RAI deltas per agent type
+
+    """
+    from policy_aux import agent_action
+
+    rng = np.random.default_rng(seed)
+    eth_res = rng.uniform(1e3, 2e4, n)
+    rai_res = eth_res * rng.uniform(500, 1000, n)
+    signal = rai_res / eth_res * np.exp(rng.normal(0, 0.05, n))
+
+    report = {}
+    for (agent_type, code) in AGENT_CODES.items():
+        (eth_delta, rai_delta, eth_sold) = agent_trades(np.full(n, code),
+                                                        eth_res,
+                                                        rai_res,
+                                                        signal)
+        expected = np.empty((n, 2))
+        for i in range(n):
+            s = {'ETH_balance': eth_res[i], 'RAI_balance': rai_res[i]}
+            output = agent_action(signal[i], s, {'agent_type': agent_type})
+            (delta_I, delta_O, action_key) = output[4:]
+            if action_key == "eth_sold":
+                expected[i] = (delta_I, delta_O)
+            else:
+                expected[i] = (delta_O, delta_I)
+            assert eth_sold[i] == (action_key == "eth_sold")
+        actual = np.stack([eth_delta, rai_delta], axis=1)
+        rel_diff = np.abs(actual - expected) / np.maximum(np.abs(expected), 1e-300)
+        report[agent_type] = float(rel_diff.max())
+        assert np.allclose(actual, expected, rtol=rtol, atol=0), agent_type
+    return report
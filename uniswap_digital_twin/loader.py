@@ -0,0 +1,133 @@
+from dataclasses import dataclass
+from pathlib import Path
+from time import time
+from typing import Iterator, List, Optional
+import pandas as pd
+from Types import BacktestingData
+
+EVENT_TYPES = pd.CategoricalDtype(['mint', 'burn', 'tokenPurchase', 'ethPurchase'])
+
+# Explicit data types for the retrieval files
+EVENT_DTYPES = {'token_delta': 'float64',
+                'eth_delta': 'float64',
+                'UNI_delta': 'float64',
+                'token_balance': 'float64',
+                'eth_balance': 'float64',
+                'UNI_supply': 'float64',
+                'logIndex': 'Int64',
+                'event': EVENT_TYPES}
+
+DATE_COLUMNS = ['timestamp']
+
+# Columns which are read by the backtest and by the stochastic fit
+BACKTEST_COLUMNS = ['token_delta',
+                    'eth_delta',
+                    'UNI_delta',
+                    'timestamp',
+                    'event',
+                    'token_balance',
+                    'eth_balance',
+                    'UNI_supply']
+
+
+@dataclass
+class LoadReport():
+    path: str
+    rows: int
+    columns: int
+    seconds: float
+    memory_bytes: int
+
+    def __str__(self) -> str:
+        return (f"Loaded {self.rows} rows x {self.columns} columns "
+                f"in {self.seconds:.3f}s ({self.memory_bytes / 1024 ** 2:.2f} MiB)")
+
+
+def _is_parquet(path: str) -> bool:
+    return Path(path).suffix == '.parquet'
+
+
+def _read_kwargs(path: str, columns: Optional[List[str]]) -> dict:
+    """
+    `pd.read_csv` arguments for a projection of a retrieval file.
+    """
+    header = list(pd.read_csv(path, nrows=0).columns)
+    index_column = header[0]
+    if columns is None:
+        usecols = header
+    else:
+        usecols = [index_column] + [col for col in header if col in columns]
+    return dict(index_col=0,
+                usecols=usecols,
+                dtype={k: v for k, v in EVENT_DTYPES.items() if k in usecols},
+                parse_dates=[col for col in DATE_COLUMNS if col in usecols])
+
+
+def _cast(df: pd.DataFrame) -> pd.DataFrame:
+    dtypes = {k: v for k, v in EVENT_DTYPES.items() if k in df.columns}
+    df = df.astype(dtypes)
+    for col in DATE_COLUMNS:
+        if col in df.columns:
+            df[col] = pd.to_datetime(df[col])
+    return df
+
+
+def iter_events(path: str,
+                chunksize: int = 100_000,
+                columns: Optional[List[str]] = BACKTEST_COLUMNS) -> Iterator[BacktestingData]:
+    """
+    Iterate over a retrieval file in chunks of `chunksize` rows.
+    """
+    path = str(path)
+    if _is_parquet(path):
+        import pyarrow.parquet as pq
+
+        parquet_file = pq.ParquetFile(path)
+        for batch in parquet_file.iter_batches(batch_size=chunksize, columns=columns):
+            yield _cast(batch.to_pandas())
+    else:
+        reader = pd.read_csv(path, chunksize=chunksize, **_read_kwargs(path, columns))
+        with reader:
+            for chunk in reader:
+                yield chunk
+
+
+def load_events(path: str,
+                columns: Optional[List[str]] = BACKTEST_COLUMNS,
+                chunksize: Optional[int] = None) -> tuple[BacktestingData, LoadReport]:
+    """
+    Load a retrieval file (*.csv, *.csv.gz or *.parquet) with explicit
+    data types.
+
+    Parameters
+    ----------
+    path : str
+        Path of the retrieval file
+    columns : List[str], optional
+        Columns to load. All of them are loaded if None.
+    chunksize : int, optional
+        If given, the file is read in chunks of this number of rows,
+        bounding the parser memory.
+
+    Returns
+    -------
+    tuple[BacktestingData, LoadReport]
+        The events and the load time and memory statistics
+
+    """
+    path = str(path)
+    t1 = time()
+    if chunksize is not None:
+        df = pd.concat(iter_events(path, chunksize, columns))
+    elif _is_parquet(path):
+        df = _cast(pd.read_parquet(path, columns=columns))
+    else:
+        df = pd.read_csv(path, **_read_kwargs(path, columns))
+    t2 = time()
+
+    report = LoadReport(path=path,
+                        rows=len(df),
+                        columns=len(df.columns),
+                        seconds=t2 - t1,
+                        memory_bytes=int(df.memory_usage(deep=True).sum()))
+    return (df, report)
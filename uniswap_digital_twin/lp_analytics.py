@@ -0,0 +1,152 @@
+from pathlib import Path
+from typing import Iterable, Iterator, List, Tuple
+import gzip
+import click
+import numpy as np
+import pandas as pd
+
+# Liquidity provider analytics of the extrapolated paths: value of a UNI
+# token, value of holding the tokens it was backed by at the start of the
+# path, the fees accrued and the impermanent loss. Metrics are elementwise
+# operations against the first row of each path, so that the output of
+# every engine is handled alike and files can be processed in chunks.
+
+PATH_KEYS = ['simulation', 'subset', 'run']
+REFERENCE_COLUMNS = ['RAI_0', 'ETH_0', 'UNI_0', 'root_k_0']
+LP_COLUMNS = ['rai_per_uni', 'eth_per_uni', 'uni_value', 'hold_value',
+              'fee_income', 'impermanent_loss', 'lp_return']
+
+
+def lp_metrics(extrapolation: pd.DataFrame,
+               uni_supply: float = None,
+               references: pd.DataFrame = None) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    LP metrics of every row of an extrapolation, valued in ETH at the pool
+    price and per UNI token held since the first row of the path.
+
+    The fees are the growth of sqrt(RAI * ETH) per UNI, which mints and
+    burns leave unchanged. The impermanent loss excludes them, so that
+    `lp_return` is the combination of both against holding.
+
+    Parameters
+    ----------
+    extrapolation : pd.DataFrame
+        Long format results, with rows ordered by timestep within each path
+    uni_supply : float, optional
+        UNI supply of engines that do not track `UNI_supply`
+    references : pd.DataFrame, optional
+        First rows of the paths seen on earlier chunks, as returned by a
+        previous call
+
+    Returns
+    -------
+    Tuple[pd.DataFrame, pd.DataFrame]
+        The path keys, timestep and `LP_COLUMNS` of every row, and the
+        updated references
+
+    """
+    keys = [key for key in PATH_KEYS if key in extrapolation.columns]
+    rai = extrapolation['RAI_balance'].to_numpy(dtype=np.float64)
+    eth = extrapolation['ETH_balance'].to_numpy(dtype=np.float64)
+    if 'UNI_supply' in extrapolation.columns:
+        uni = extrapolation['UNI_supply'].to_numpy(dtype=np.float64)
+    elif uni_supply is not None:
+        uni = np.full(len(rai), float(uni_supply))
+    else:
+        raise ValueError("The extrapolation has no UNI_supply, and no uni_supply was given")
+    root_k = np.sqrt(rai * eth)
+
+    # First row of the paths starting on this chunk
+    first = np.flatnonzero(~extrapolation[keys].duplicated().to_numpy())
+    new = extrapolation[keys].iloc[first].reset_index(drop=True)
+    for (column, values) in zip(REFERENCE_COLUMNS, (rai, eth, uni, root_k)):
+        new[column] = values[first]
+    if references is None:
+        references = new
+    else:
+        seen = new[keys].merge(references[keys], how='left', indicator=True)['_merge'] == 'both'
+        references = pd.concat([references, new[~seen.to_numpy()]], ignore_index=True)
+    reference = extrapolation[keys].merge(references, on=keys, how='left')
+    (rai_0, eth_0, uni_0, root_k_0) = (reference[c].to_numpy() for c in REFERENCE_COLUMNS)
+
+    price = eth / rai
+    rai_per_uni = rai / uni
+    eth_per_uni = eth / uni
+    uni_value = eth_per_uni + rai_per_uni * price
+    hold_value = eth_0 / uni_0 + rai_0 / uni_0 * price
+    fee_growth = (root_k / uni) / (root_k_0 / uni_0)
+    value_without_fees = uni_value / fee_growth
+
+    metrics = extrapolation[keys + ['timestep']].reset_index(drop=True)
+    metrics['rai_per_uni'] = rai_per_uni
+    metrics['eth_per_uni'] = eth_per_uni
+    metrics['uni_value'] = uni_value
+    metrics['hold_value'] = hold_value
+    metrics['fee_income'] = uni_value - value_without_fees
+    metrics['impermanent_loss'] = value_without_fees / hold_value - 1
+    metrics['lp_return'] = uni_value / hold_value - 1
+    return (metrics, references)
+
+
+def stream_lp_metrics(chunks: Iterable[pd.DataFrame],
+                      uni_supply: float = None) -> Iterator[pd.DataFrame]:
+    """
+    `lp_metrics` of each chunk of an extrapolation, carrying the first row
+    of every path across chunks.
+    """
+    references = None
+    for chunk in chunks:
+        (metrics, references) = lp_metrics(chunk, uni_supply, references)
+        yield metrics
+
+
+def write_lp_metrics(extrapolation_path: Path,
+                     output_path: Path,
+                     uni_supply: float = None,
+                     chunksize: int = 500_000) -> int:
+    """
+    Stream the LP metrics of an extrapolation file into `output_path`,
+    returning the number of rows written.
+    """
+    rows = 0
+    chunks = pd.read_csv(extrapolation_path, chunksize=chunksize)
+    with gzip.open(output_path, 'wt', newline='') as fid:
+        for (i, metrics) in enumerate(stream_lp_metrics(chunks, uni_supply)):
+            metrics.to_csv(fid, header=i == 0, index=False)
+            rows += len(metrics)
+    return rows
+
+
+def lp_summary(metrics: pd.DataFrame,
+               q: List[float] = [5, 50, 95],
+               columns: List[str] = ['uni_value', 'fee_income', 'impermanent_loss', 'lp_return']) -> pd.DataFrame:
+    """
+    Percentiles `q` of `columns` across runs, per subset and timestep.
+    """
+    keys = [key for key in ('subset', 'timestep') if key in metrics.columns]
+    summary = metrics.groupby(keys)[columns].quantile(np.array(q) / 100).unstack()
+    summary.columns = [f'{column}_p{p * 100:g}' for (column, p) in summary.columns]
+    return summary
+
+
+@click.command()
+@click.argument('extrapolation_path')
+@click.option('-o', '--output', 'output_path', default=None,
+              help="Output file, defaults to the '-lp.csv.gz' next to the extrapolation")
+@click.option('-u', '--uni-supply', 'uni_supply', default=None, type=float,
+              help="UNI supply, for extrapolations without UNI_supply")
+@click.option('-c', '--chunksize', 'chunksize', default=500_000, help="Rows per chunk")
+def main(extrapolation_path, output_path, uni_supply, chunksize) -> None:
+    """
+    Write the LP metrics of an extrapolation file.
+    """
+    extrapolation_path = Path(extrapolation_path)
+    if output_path is None:
+        output_path = extrapolation_path.with_name(
+            extrapolation_path.name.replace('-extrapolation.csv.gz', '-lp.csv.gz'))
+    rows = write_lp_metrics(extrapolation_path, output_path, uni_supply, chunksize)
+    print(f"Wrote {rows} rows to {output_path}")
+
+
+if __name__ == '__main__':
+    main()
@@ -5,6 +5,8 @@ from cadCAD_tools.types import InitialValue
 from cadCAD_tools.preparation import prepare_state
 from policy_aux import *
 from suf_aux import *
+from shared_data import resolve_events
+from classification import is_classified
 import numpy as np
 
 ## Initial State
@@ -33,14 +35,35 @@ parameters = {
     'uniswap_events': Param(None, BacktestingData),
     'backtest_mode': Param(True, bool),
     'extrapolated_signals': Param(None, np.array),
-    'agent_type': ParamSweep([None], str)
+    'agent_type': ParamSweep([None], str),
+    # Use the compiled agent kernels rather than the pure-Python logic
+    'agent_kernel': Param(False, bool),
+    # Lossy approximation: skip the trade when the signal is within the fee
+    # band of the pool ratio. The agents may still trade within the band, so
+    # this changes the results and does not reproduce the exact model
+    'approximate_fee_band_skip': Param(False, bool),
+    # AMM math: 'float' for the float64 path, 'exact' for integer math in wei
+    'amm_math': Param('float', str)
 }
 
 ## Model Logic
 
+NOOP_ACTION = {
+    'I_t': None,
+    'O_t': None,
+    'I_t1': None,
+    'O_t1': None,
+    'delta_I': 0,
+    'delta_O': 0,
+    'action_key': None
+}
+
+
 def create_action(params, substep, _3, s):
     t = s['timestep']
     signal = params['extrapolated_signals'][t]['ratio']
+    if params['approximate_fee_band_skip'] and within_fee_band(signal, s, params):
+        return NOOP_ACTION
     I_t, O_t, I_t1, O_t1, delta_I, delta_O, action_key = agent_action(signal, s, params)
     action = {
         'I_t': I_t,
@@ -88,7 +111,7 @@ def p_actionDecoder(params, substep, _3, s):
         uni_delta (numeric)
         UNI_supply (numeric)
     """
-    uniswap_events = params['uniswap_events']
+    uniswap_events = resolve_events(params['uniswap_events'])
 
     
     prev_timestep = s['timestep']
@@ -116,13 +139,17 @@ def p_actionDecoder(params, substep, _3, s):
 
     #Event variables
     if params["backtest_mode"]:
-        event = uniswap_events.iloc[t]['event']
+        event = uniswap_events['event'][t]
         action['action_id'] = event
     else:
         #signal = params['extrapolated_signals'][t]['ratio']
         #I_t, O_t, I_t1, O_t1, delta_I, delta_O, action_key = agent_action(signal, s)
         I_t, O_t, I_t1, O_t1, delta_I, delta_O, action_key = s['Action']['I_t'], s['Action']['O_t'], s['Action']['I_t1'], s['Action']['O_t1'], s['Action']['delta_I'], s['Action']['delta_O'], s['Action']['action_key']
-        if action_key == "eth_sold":
+        if action_key is None:
+            # No-arbitrage band: nothing to decode
+            action['action_id'] = 'noop'
+            return action
+        elif action_key == "eth_sold":
             event = 'tokenPurchase'
         else:
             event = 'ethPurchase'
@@ -132,15 +159,24 @@ def p_actionDecoder(params, substep, _3, s):
     # Swap Event
     if event in ['tokenPurchase', 'ethPurchase']:
         # action_key is either `eth_sold` or `token_sold`
-        if params["backtest_mode"]:
-            I_t, O_t, I_t1, O_t1, delta_I, delta_O, action_key = get_parameters(uniswap_events, event, s, t)
+        # Backtests on classified events read the trader class and the
+        # target price from the precomputed columns
+        classified = params["backtest_mode"] and is_classified(uniswap_events, params['retail_precision'])
+        if classified:
+            I_t, O_t, P, delta_I, delta_O, action_key = get_classified_parameters(uniswap_events, event, s, t)
+            trader_class = uniswap_events['trader_class'][t]
+        else:
+            if params["backtest_mode"]:
+                I_t, O_t, I_t1, O_t1, delta_I, delta_O, action_key = get_parameters(uniswap_events, event, s, t)
+            P = I_t1 / O_t1
+            trader_class = None
 
         # Classify actions based on trading heuristics
         # N/A case
         if params['retail_precision'] == -1:
             action[action_key] = delta_I
         # Convenience trader case
-        elif classifier(delta_I, delta_O, params['retail_precision']) == "Conv":
+        elif (trader_class or classifier(delta_I, delta_O, params['retail_precision'])) == "Conv":
             calculated_delta_O = int(get_output_amount(delta_I, I_t, O_t, params))
             if calculated_delta_O >= delta_O * (1-params['retail_tolerance']):
                 action[action_key] = delta_I
@@ -149,12 +185,13 @@ def p_actionDecoder(params, substep, _3, s):
             #action['price_ratio'] =  delta_O / calculated_delta_O
         # Arbitrary trader case
         else:            
-            P = I_t1 / O_t1
             actual_P = I_t / O_t
             if(actual_P > P):
-                if params["backtest_mode"]:
+                if classified:
+                    I_t, O_t, P, delta_I, delta_O, action_key = get_classified_parameters(uniswap_events, reverse_event(event), s, t)
+                elif params["backtest_mode"]:
                     I_t, O_t, I_t1, O_t1, delta_I, delta_O, action_key = get_parameters(uniswap_events, reverse_event(event), s, t)
-                P = I_t1 / O_t1
+                    P = I_t1 / O_t1
                 actual_P = I_t / O_t
                 delta_I = get_delta_I(P, I_t, O_t, params)
                 delta_O = get_output_amount(delta_I, I_t, O_t, params)
@@ -233,6 +270,16 @@ def s_mechanismHub_UNI(_params, substep, sH, s, _input):
 def post_processing(raw):
     return raw[['RAI_balance', 'ETH_balance']]
 
+def fee_band_skip_counts(raw):
+    """
+    Number of extrapolation steps skipped by the approximate fee band skip.
+    """
+    if 'fee_band_skip' in raw.attrs:
+        return raw.attrs['fee_band_skip']
+    actions = [action for action in raw['Action'] if isinstance(action, dict)]
+    skipped = sum(1 for action in actions if action['action_key'] is None)
+    return {'skipped': skipped, 'steps': len(actions)}
+
 ## Model Structure
 PSUBs = [
     {
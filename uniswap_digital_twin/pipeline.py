@@ -0,0 +1,223 @@
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from dataclasses import dataclass, field
+from pathlib import Path
+from time import perf_counter
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+from cache import digest, file_digest
+
+# Small stage DAG scheduler. Stages declare the stages whose results they
+# take as arguments and the files they write; every stage whose inputs
+# are done is started right away, so that independent stages overlap.
+# Each output file gets a '.digest' sidecar with the digest of the stage
+# inputs and parameters it was written from, to skip it when resuming.
+
+DIGEST_SUFFIX = '.digest'
+
+
+@dataclass
+class Stage():
+    """
+    Step of a pipeline.
+
+    `func` is called with the results of the `inputs` stages, in order. A
+    stage with `outputs` is skipped when all of them exist and were written
+    from the same digest (see `stage_digest`), in which case its result is
+    the one of `load` (or None). `params` holds the configuration the
+    stage depends on besides its inputs. Stages with `main_thread` run on
+    the calling thread, eg. for plotting.
+    """
+    name: str
+    func: Callable[..., object]
+    inputs: Tuple[str, ...] = ()
+    outputs: Tuple[Path, ...] = ()
+    load: Optional[Callable[[], object]] = None
+    main_thread: bool = False
+    params: object = None
+
+
+@dataclass
+class StageTiming():
+    start: float
+    end: float
+    skipped: bool = False
+
+    @property
+    def duration(self) -> float:
+        return self.end - self.start
+
+
+@dataclass
+class PipelineRun():
+    stages: Dict[str, Stage]
+    results: Dict[str, object] = field(default_factory=dict)
+    timings: Dict[str, StageTiming] = field(default_factory=dict)
+
+    @property
+    def wall_time(self) -> float:
+        if not self.timings:
+            return 0.0
+        return (max(t.end for t in self.timings.values())
+                - min(t.start for t in self.timings.values()))
+
+    def critical_path(self) -> Tuple[List[str], float]:
+        """
+        Chain of stages with the longest total duration, which bounds the
+        wall time of the pipeline however many workers are used.
+        """
+        longest: Dict[str, Tuple[float, List[str]]] = {}
+        for name in topological_order(self.stages.values()):
+            (length, path) = max((longest[i] for i in self.stages[name].inputs),
+                                 default=(0.0, []))
+            longest[name] = (length + self.timings[name].duration, path + [name])
+        (length, path) = max(longest.values(), default=(0.0, []))
+        return (path, length)
+
+    def report(self) -> str:
+        (path, length) = self.critical_path()
+        busy = sum(t.duration for t in self.timings.values())
+        origin = min((t.start for t in self.timings.values()), default=0.0)
+        lines = [f"{'stage':<24}{'start':>8}{'time':>8}"]
+        for (name, timing) in sorted(self.timings.items(), key=lambda item: item[1].start):
+            status = ' (up to date)' if timing.skipped else ''
+            marker = '*' if name in path else ' '
+            lines.append(f"{marker}{name:<23}{timing.start - origin:>7.2f}s{timing.duration:>7.2f}s{status}")
+        lines.append(f"Wall time {self.wall_time:.2f}s, stage time {busy:.2f}s, "
+                     f"critical path (*) {length:.2f}s")
+        return '\n'.join(lines)
+
+
+def topological_order(stages: Sequence[Stage]) -> List[str]:
+    """
+    Stage names with every stage after its inputs. Raises ValueError on
+    unknown inputs or cycles.
+    """
+    by_name = {stage.name: stage for stage in stages}
+    order: List[str] = []
+    state: Dict[str, str] = {}
+
+    def visit(name, parent):
+        if name not in by_name:
+            raise ValueError(f"Unknown input '{name}' of stage '{parent}'")
+        if state.get(name) == 'done':
+            return
+        if state.get(name) == 'visiting':
+            raise ValueError(f"Cycle through stage '{name}'")
+        state[name] = 'visiting'
+        for input_name in by_name[name].inputs:
+            visit(input_name, name)
+        state[name] = 'done'
+        order.append(name)
+
+    for name in by_name:
+        visit(name, None)
+    return order
+
+
+def _upstream_outputs(name: str, stages: Dict[str, Stage]) -> List[Path]:
+    # Outputs of the nearest file-writing stages upstream of `name`
+    paths = []
+    for input_name in stages[name].inputs:
+        if stages[input_name].outputs:
+            paths += list(stages[input_name].outputs)
+        else:
+            paths += _upstream_outputs(input_name, stages)
+    return paths
+
+
+def digest_path(path: Path) -> Path:
+    return Path(path).with_name(Path(path).name + DIGEST_SUFFIX)
+
+
+def stage_digest(name: str, stages: Dict[str, Stage]) -> str:
+    """
+    Digest of the parameters of `name` and of all the stages upstream of
+    it, and of the contents of the files written by the nearest
+    file-writing stages upstream.
+    """
+    def chain(stage_name):
+        stage = stages[stage_name]
+        return digest(stage_name, stage.params, [chain(i) for i in stage.inputs])
+
+    upstream = [file_digest(path) for path in _upstream_outputs(name, stages)]
+    return digest(chain(name), upstream)
+
+
+def is_up_to_date(name: str, stages: Dict[str, Stage]) -> bool:
+    outputs = [Path(path) for path in stages[name].outputs]
+    if not outputs or not all(path.exists() for path in outputs):
+        return False
+    if not stages[name].inputs:
+        # Source data, such as a retrieval, is never recomputed
+        return True
+    upstream = [Path(path) for path in _upstream_outputs(name, stages)]
+    if not all(path.exists() for path in upstream):
+        return False
+    key = stage_digest(name, stages)
+    return all(digest_path(path).exists() and digest_path(path).read_text() == key
+               for path in outputs)
+
+
+def run_pipeline(stages: Sequence[Stage],
+                 max_workers: int = 4,
+                 log: Callable[[str], None] = print) -> PipelineRun:
+    """
+    Run `stages` as soon as their inputs are done, with up to
+    `max_workers` of them at a time.
+
+    Returns
+    -------
+    PipelineRun
+        The stage results and timings. The first exception raised by a
+        stage is re-raised once the running stages are done.
+
+    """
+    by_name = {stage.name: stage for stage in stages}
+    topological_order(stages)
+    run = PipelineRun(by_name)
+    pending = dict(by_name)
+    running = {}
+
+    def execute(stage):
+        start = perf_counter()
+        if is_up_to_date(stage.name, by_name):
+            result = stage.load() if stage.load is not None else None
+            return (result, StageTiming(start, perf_counter(), skipped=True))
+        args = [run.results[name] for name in stage.inputs]
+        for path in stage.outputs:
+            digest_path(path).unlink(missing_ok=True)
+        result = stage.func(*args)
+        if stage.outputs and all(Path(path).exists() for path in _upstream_outputs(stage.name, by_name)):
+            key = stage_digest(stage.name, by_name)
+            for path in stage.outputs:
+                if Path(path).exists():
+                    digest_path(path).write_text(key)
+        return (result, StageTiming(start, perf_counter()))
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while pending or running:
+            # Stages on the calling thread go last, after the others are started
+            ready = sorted((stage for stage in pending.values()
+                            if all(name in run.results for name in stage.inputs)),
+                           key=lambda stage: stage.main_thread)
+            for stage in ready:
+                del pending[stage.name]
+                log(f"[{stage.name}]")
+                if stage.main_thread:
+                    (run.results[stage.name], run.timings[stage.name]) = execute(stage)
+                else:
+                    running[executor.submit(execute, stage)] = stage.name
+            if any(stage.main_thread for stage in ready):
+                # Inline stages may have made others ready
+                continue
+            if not running:
+                break
+            (done, _) = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                try:
+                    (run.results[name], run.timings[name]) = future.result()
+                except BaseException:
+                    for other in running:
+                        other.cancel()
+                    raise
+    return run
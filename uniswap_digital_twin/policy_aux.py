@@ -1,4 +1,6 @@
 from math import sqrt
+from kernels import agent_action_kernel
+from amm_math import exact_output_amount, exact_input_amount, exact_delta_I
 
 
 def get_parameters(uniswap_events, event, s, t):
@@ -21,7 +23,36 @@ def get_parameters(uniswap_events, event, s, t):
     
     return I_t, O_t, I_t1, O_t1, delta_I, delta_O, action_key
 
+def get_classified_parameters(uniswap_events, event, s, t):
+    """
+    `get_parameters` from the columns of `classification.classify_events`,
+    with the target price in place of the balances after the event.
+    `event` may be the reverse of the historical one.
+    """
+    if(event == "tokenPurchase"):
+        I_t = s['ETH_balance']
+        O_t = s['RAI_balance']
+        action_key = 'eth_sold'
+    else:
+        I_t = s['RAI_balance']
+        O_t = s['ETH_balance']
+        action_key = 'tokens_sold'
+
+    if event == uniswap_events['event'][t]:
+        P = uniswap_events['target_price'][t]
+        delta_I = uniswap_events['delta_I'][t]
+        delta_O = uniswap_events['delta_O'][t]
+    else:
+        P = uniswap_events['reverse_target_price'][t]
+        delta_I = uniswap_events['delta_O'][t]
+        delta_O = uniswap_events['delta_I'][t]
+
+    return I_t, O_t, P, delta_I, delta_O, action_key
+
 def agent_action(signal, s, params):
+    if params.get('agent_kernel', False):
+        return agent_action_kernel(signal, s, params)
+
     #Find current ratio
     current_ratio = s['RAI_balance'] / s['ETH_balance']
     eth_res = s['ETH_balance']
@@ -119,6 +150,18 @@ def agent_action(signal, s, params):
         assert False
     return I_t, O_t, I_t1, O_t1, delta_I, delta_O, action_key
 
+def within_fee_band(signal, s, params):
+    """
+    Whether the signal lies within the (1 ± fee) corridor around the pool
+    ratio, where a fee-aware arbitrageur would not trade. It is not the
+    zero-trade condition of `agent_action`: the agents of this model may
+    still trade within the band, so skipping these steps is a lossy
+    approximation.
+    """
+    ratio = s['RAI_balance'] / s['ETH_balance']
+    fee = params['fee_percentage']
+    return ratio * (1 - fee) <= signal <= ratio * (1 + fee)
+
 def reverse_event(event):
     if(event == "tokenPurchase"):
         new_event = 'ethPurchase'
@@ -126,7 +169,12 @@ def reverse_event(event):
         new_event = 'tokenPurchase'
     return new_event
 
+def exact_math(_params):
+    return _params.get('amm_math', 'float') == 'exact'
+
 def get_output_amount(delta_I, I_t, O_t, _params):
+    if exact_math(_params):
+        return exact_output_amount(delta_I, I_t, O_t, _params['fee_percentage'])
     fee_numerator = 1-_params['fee_percentage']
     fee_denominator = 1
     delta_I_with_fee = delta_I * fee_numerator
@@ -135,6 +183,8 @@ def get_output_amount(delta_I, I_t, O_t, _params):
     return int(numerator // denominator)                      
 
 def get_input_amount(delta_O, I_t, O_t, _params):
+    if exact_math(_params):
+        return exact_input_amount(delta_O, I_t, O_t, _params['fee_percentage'])
     fee_numerator = 1-_params['fee_percentage']
     fee_denominator = 1
     numerator = I_t * delta_O * fee_denominator
@@ -148,6 +198,8 @@ def classifier(delta_I, delta_O, retail_precision):
       return "Arb"
 
 def get_delta_I(P, I_t, O_t, _params):
+    if exact_math(_params):
+        return exact_delta_I(P, I_t, O_t, _params['fee_percentage'])
     a = 1-_params['fee_percentage']
     b = 1
 
@@ -0,0 +1,314 @@
+from dataclasses import dataclass, fields
+from typing import Tuple
+import numpy as np
+import pandas as pd
+from batched import model_params, within_fee_band
+from kernels import HAS_NUMBA, njit
+
+# Population extrapolation: many heterogeneous agents trade on the pool
+# every timestep. Agents are held as arrays, one entry per agent, and
+# their orders are computed together against the reserves at the start
+# of the step. Orders are then executed in a random ordering, so that
+# late arbitrageurs find the price already moved by earlier ones.
+
+ARBITRAGEUR = 0
+NOISE_TRADER = 1
+LIQUIDITY_PROVIDER = 2
+KIND_NAMES = ('arbitrageur', 'noise_trader', 'liquidity_provider')
+# Label of the single subset of the results
+AGENT_TYPES = ('population',)
+
+
+@dataclass
+class PopulationConfig():
+    """
+    Distributions the agents are drawn from. Sizes are lognormal, given by
+    their median and the standard deviation of their logarithm.
+    """
+    n_arbitrageurs: int = 20
+    n_noise_traders: int = 50
+    n_liquidity_providers: int = 10
+    # Fraction of the trade to the signal price taken by an arbitrageur
+    arb_fraction_median: float = 0.3
+    arb_fraction_sigma: float = 0.5
+    # Largest ETH-equivalent trade of an arbitrageur
+    arb_cap_median: float = 50.0
+    arb_cap_sigma: float = 1.0
+    # Timesteps an arbitrageur lags the signal by, uniform on [0, max]
+    arb_max_latency: int = 3
+    arb_activity: float = 0.5
+    # ETH-equivalent trade of a noise trader
+    noise_size_median: float = 0.5
+    noise_size_sigma: float = 1.5
+    noise_activity: float = 0.1
+    # Fraction of the pool minted, or of its own shares burnt, by an LP
+    lp_fraction_median: float = 0.005
+    lp_fraction_sigma: float = 1.0
+    lp_activity: float = 0.02
+    lp_mint_probability: float = 0.5
+    # Share of the initial UNI supply held by the simulated LPs
+    lp_initial_share: float = 0.5
+
+    @property
+    def n_agents(self) -> int:
+        return self.n_arbitrageurs + self.n_noise_traders + self.n_liquidity_providers
+
+    @classmethod
+    def from_dict(cls, values: dict) -> 'PopulationConfig':
+        names = {f.name for f in fields(cls)}
+        unknown = set(values) - names
+        if unknown:
+            raise ValueError(f"Unknown population parameters {sorted(unknown)}")
+        return cls(**values)
+
+
+@dataclass
+class Population():
+    """
+    Agents as arrays with one entry per agent. `size` is the fraction of
+    the arbitrage trade for arbitrageurs, the ETH-equivalent trade for
+    noise traders and the pool fraction for LPs.
+    """
+    kind: np.ndarray
+    size: np.ndarray
+    # Largest ETH-equivalent trade, infinite for non-arbitrageurs
+    cap: np.ndarray
+    latency: np.ndarray
+    # Probability of placing an order on each timestep
+    activity: np.ndarray
+    # UNI held by each LP at the start, zero for the other agents
+    shares: np.ndarray
+
+    def __len__(self) -> int:
+        return len(self.kind)
+
+    def counts(self) -> dict:
+        return {name: int((self.kind == code).sum()) for (code, name) in enumerate(KIND_NAMES)}
+
+
+def sample_population(config: PopulationConfig,
+                      initial_uni: float,
+                      rng: np.random.Generator) -> Population:
+    """
+    Draw the agents of `config`, with the LP shares of the initial UNI
+    supply split on a flat Dirichlet.
+    """
+    counts = (config.n_arbitrageurs, config.n_noise_traders, config.n_liquidity_providers)
+    kind = np.repeat(np.arange(3, dtype=np.int8), counts)
+    N = len(kind)
+    (arb, noise, lp) = (kind == ARBITRAGEUR, kind == NOISE_TRADER, kind == LIQUIDITY_PROVIDER)
+
+    def lognormal(median, sigma, n):
+        return median * np.exp(rng.normal(0, sigma, n))
+
+    size = np.empty(N)
+    size[arb] = np.minimum(lognormal(config.arb_fraction_median, config.arb_fraction_sigma, arb.sum()), 1)
+    size[noise] = lognormal(config.noise_size_median, config.noise_size_sigma, noise.sum())
+    size[lp] = np.minimum(lognormal(config.lp_fraction_median, config.lp_fraction_sigma, lp.sum()), 1)
+
+    cap = np.full(N, np.inf)
+    cap[arb] = lognormal(config.arb_cap_median, config.arb_cap_sigma, arb.sum())
+    latency = np.zeros(N, dtype=np.int64)
+    latency[arb] = rng.integers(0, config.arb_max_latency + 1, arb.sum())
+    activity = np.select([arb, noise, lp],
+                         [config.arb_activity, config.noise_activity, config.lp_activity])
+    shares = np.zeros(N)
+    if lp.any():
+        shares[lp] = rng.dirichlet(np.ones(lp.sum())) * initial_uni * config.lp_initial_share
+    return Population(kind, size, cap, latency, activity, shares)
+
+
+def arbitrage_input(P: np.ndarray, I_t: np.ndarray, O_t: np.ndarray, fee: float) -> np.ndarray:
+    """
+    Input bringing the output/input price of the pool to `P`, without the
+    truncation of `batched.delta_I_to_price`.
+    """
+    a = 1 - fee
+    return (-(I_t + I_t * a) + np.sqrt((I_t - I_t * a) ** 2 + 4 * P * O_t * I_t * a)) / (2 * a)
+
+
+def place_orders(population: Population,
+                 rai: np.ndarray,
+                 eth: np.ndarray,
+                 signals: np.ndarray,
+                 t: int,
+                 fee: float,
+                 config: PopulationConfig,
+                 rng: np.random.Generator) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Orders of every agent on every run against the reserves at the start
+    of timestep `t`, as (runs, agents) arrays.
+
+    Returns
+    -------
+    Tuple[np.ndarray, np.ndarray, np.ndarray]
+        Amount sold (or pool fraction for LPs, negative when burning),
+        whether ETH is sold (or liquidity minted) and the signal targeted
+        by arbitrageurs
+
+    """
+    (R, N) = (len(rai), len(population))
+    (rai_t, eth_t) = (rai[:, None], eth[:, None])
+    ratio = rai_t / eth_t
+    kind = population.kind
+    active = rng.random((R, N)) < population.activity
+
+    # Arbitrageurs, on the signal seen `latency` timesteps late
+    target = signals[:, np.maximum(t - population.latency, 0)]
+    eth_sold = target < ratio
+    I_t = np.where(eth_sold, eth_t, rai_t)
+    O_t = np.where(eth_sold, rai_t, eth_t)
+    P = np.where(eth_sold, 1 / target, target)
+    with np.errstate(invalid='ignore'):
+        arb_amount = np.nan_to_num(np.maximum(arbitrage_input(P, I_t, O_t, fee), 0)) * population.size
+    arb_amount = np.minimum(arb_amount, np.where(eth_sold, 1, ratio) * population.cap)
+    arb_amount[within_fee_band(target, rai_t, eth_t, fee)] = 0
+
+    # Noise traders, on a fair coin
+    noise_eth_sold = rng.random((R, N)) < 0.5
+    noise_amount = population.size * np.where(noise_eth_sold, 1, ratio)
+
+    # LPs, minting a fraction of the pool or burning one of their shares
+    mint = rng.random((R, N)) < config.lp_mint_probability
+    lp_amount = np.where(mint, population.size, -population.size)
+
+    amount = np.select([kind == ARBITRAGEUR, kind == NOISE_TRADER],
+                       [arb_amount, noise_amount], lp_amount)
+    amount[~active] = 0
+    sold = np.select([kind == ARBITRAGEUR, kind == NOISE_TRADER],
+                     [eth_sold, noise_eth_sold], mint)
+    return (amount, sold, target)
+
+
+@njit(cache=True)
+def execute_orders(rai, eth, uni, shares, kind, amount, sold, target, ordering, fee, executed):
+    """
+    Execute the orders of each run in its sampled `ordering`, updating the
+    reserves and LP shares in place. Arbitrage orders are limit orders:
+    they are capped to the trade reaching their target, and dropped once
+    the pool is within the fee band of it. Executed orders per agent kind
+    are added to `executed`, with the dropped arbitrage orders last.
+    """
+    a = 1 - fee
+    for r in range(ordering.shape[0]):
+        for i in ordering[r]:
+            x = amount[r, i]
+            if x == 0:
+                continue
+            k = kind[i]
+            if k == LIQUIDITY_PROVIDER:
+                if sold[r, i]:
+                    minted = x * uni[r]
+                    rai[r] += x * rai[r]
+                    eth[r] += x * eth[r]
+                else:
+                    minted = -x * shares[r, i]
+                    if minted == 0 or uni[r] + minted <= 0:
+                        continue
+                    rai[r] += minted / uni[r] * rai[r]
+                    eth[r] += minted / uni[r] * eth[r]
+                uni[r] += minted
+                shares[r, i] += minted
+                executed[k] += 1
+                continue
+            if sold[r, i]:
+                (I_t, O_t) = (eth[r], rai[r])
+            else:
+                (I_t, O_t) = (rai[r], eth[r])
+            if k == ARBITRAGEUR:
+                ratio = rai[r] / eth[r]
+                s = target[r, i]
+                if sold[r, i]:
+                    outside = s < ratio * (1 - fee)
+                    P = 1 / s
+                else:
+                    outside = s > ratio * (1 + fee)
+                    P = s
+                if not outside:
+                    executed[3] += 1
+                    continue
+                optimal = (-(I_t + I_t * a) + np.sqrt((I_t - I_t * a) ** 2 + 4 * P * O_t * I_t * a)) / (2 * a)
+                x = min(x, optimal)
+            delta_O = x * a * O_t / (I_t + x * a)
+            if sold[r, i]:
+                eth[r] += x
+                rai[r] -= delta_O
+            else:
+                rai[r] += x
+                eth[r] -= delta_O
+            executed[k] += 1
+
+
+def simulate_population(initial_rai: float,
+                        initial_eth: float,
+                        initial_uni: float,
+                        signals: np.ndarray,
+                        timesteps: int,
+                        config: PopulationConfig = None,
+                        params: dict = None,
+                        seed: int = 0) -> pd.DataFrame:
+    """
+    Extrapolate the pool under a population of agents, one run per signal
+    sample. The same population is used on every run, with its orders,
+    activity and ordering drawn independently per run.
+
+    Parameters
+    ----------
+    signals : np.ndarray
+        RAI/ETH signal of each run, with shape (runs, timesteps)
+    config : PopulationConfig, optional
+        Agent distributions, `PopulationConfig()` by default
+    params : dict, optional
+        Scalar model parameters, of which the pool fee is used
+
+    Returns
+    -------
+    DataFrame
+        Results on the same long format as `extrapolate_data`, on a single
+        subset labelled by `AGENT_TYPES` on `attrs['agent_types']`. The
+        population and the executed orders per agent kind are stored on
+        `attrs['population']`.
+
+    """
+    if config is None:
+        config = PopulationConfig()
+    if params is None:
+        params = model_params()
+    fee = params['fee_percentage']
+    rng = np.random.default_rng(seed)
+    signals = np.atleast_2d(signals)[:, :timesteps]
+    R = len(signals)
+    population = sample_population(config, initial_uni, rng)
+    N = len(population)
+
+    rai = np.empty((timesteps + 1, R))
+    eth = np.empty((timesteps + 1, R))
+    uni = np.empty((timesteps + 1, R))
+    (rai[0], eth[0], uni[0]) = (initial_rai, initial_eth, initial_uni)
+    shares = np.tile(population.shares, (R, 1))
+    executed = np.zeros(4, dtype=np.int64)
+    base_ordering = np.tile(np.arange(N), (R, 1))
+    for t in range(timesteps):
+        (amount, sold, target) = place_orders(population, rai[t], eth[t], signals, t, fee, config, rng)
+        ordering = rng.permuted(base_ordering, axis=1)
+        (rai_t, eth_t, uni_t) = (rai[t].copy(), eth[t].copy(), uni[t].copy())
+        execute_orders(rai_t, eth_t, uni_t, shares, population.kind, amount, sold, target,
+                       ordering, fee, executed)
+        (rai[t + 1], eth[t + 1], uni[t + 1]) = (rai_t, eth_t, uni_t)
+
+    T = timesteps + 1
+    df = pd.DataFrame({'RAI_balance': rai.T.ravel(),
+                       'ETH_balance': eth.T.ravel(),
+                       'UNI_supply': uni.T.ravel(),
+                       'Ratio': None,
+                       'Action': None,
+                       'simulation': 0,
+                       'subset': 0,
+                       'run': np.repeat(np.arange(R) + 1, T),
+                       'timestep': np.tile(np.arange(T), R)})
+    df.attrs['agent_types'] = list(AGENT_TYPES)
+    df.attrs['population'] = {'agents': population.counts(),
+                              'executed': dict(zip(KIND_NAMES, executed[:3].tolist())),
+                              'dropped_arbitrage': int(executed[3]),
+                              'compiled': HAS_NUMBA}
+    return df
@@ -0,0 +1,99 @@
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Tuple
+import pandas as pd
+from Types import BacktestingData
+from shared_data import SharedEvents, SharedEventsHandle, attach
+
+Window = Tuple[pd.Timestamp, pd.Timestamp]
+
+# Event history on each worker process, set once by `_init_worker`
+_events: BacktestingData = None
+
+
+def rolling_windows(events: BacktestingData,
+                    window: str = '14D',
+                    step: str = '1D') -> List[Window]:
+    """
+    Overlapping windows of length `window` whose end moves backwards by
+    `step` from the last event, as long as they fit on the history.
+    """
+    timestamps = pd.to_datetime(events['timestamp'])
+    (first, last) = (timestamps.min(), timestamps.max())
+    window, step = pd.Timedelta(window), pd.Timedelta(step)
+    windows = []
+    end = last
+    while end - window >= first:
+        windows.append((end - window, end))
+        end -= step
+    return windows[::-1]
+
+
+def window_events(events: BacktestingData, window: Window) -> BacktestingData:
+    """
+    Events inside the window, re-indexed so that the first one holds the
+    initial state of the backtest.
+    """
+    timestamps = pd.to_datetime(events['timestamp'])
+    mask = (timestamps >= window[0]) & (timestamps <= window[1])
+    return events.loc[mask].reset_index(drop=True)
+
+
+def _init_worker(handle: SharedEventsHandle) -> None:
+    global _events
+    _events = attach(handle)
+
+
+def _backtest_window(window: Window, bucket: str = None) -> dict:
+    from extrapolation_cycle import backtest_model, rmse
+
+    data = window_events(_events, window)
+    (sim_df, test_df, _) = backtest_model(data, bucket=bucket, report=False)
+    loss = rmse(test_df, sim_df)
+    return {'window_start': window[0],
+            'window_end': window[1],
+            'n_events': len(data),
+            **loss.to_dict()}
+
+
+def rolling_backtest(events: BacktestingData,
+                     window: str = '14D',
+                     step: str = '1D',
+                     bucket: str = None,
+                     max_workers: int = None) -> pd.DataFrame:
+    """
+    Rolling-origin evaluation of the backtest over many past windows.
+
+    The event history is published once into shared memory, and every
+    worker process attaches to it without copying before slicing its
+    windows. Each window is backtested from the balances on its own first
+    row.
+
+    Parameters
+    ----------
+    events : BacktestingData
+        Long local event history
+    window : str
+        Length of each window, as a pandas timedelta string
+    step : str
+        Offset between consecutive window ends
+    bucket : str, optional
+        Run the aggregated backtest with this bucket size
+    max_workers : int, optional
+        Number of worker processes
+
+    Returns
+    -------
+    DataFrame
+        RMSE of every state variable for each window, indexed by the
+        window end
+
+    """
+    windows = rolling_windows(events, window, step)
+    with SharedEvents(events) as shared, \
+            ProcessPoolExecutor(max_workers=max_workers,
+                                initializer=_init_worker,
+                                initargs=(shared.handle,)) as executor:
+        results = list(executor.map(_backtest_window,
+                                    windows,
+                                    [bucket] * len(windows)))
+    return pd.DataFrame(results).set_index('window_end')
@@ -0,0 +1,357 @@
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import List, Sequence, Tuple
+import os
+import click
+import numpy as np
+import pandas as pd
+from scipy.stats import qmc
+from Types import BacktestingData
+from batched import model_params, simulate_reserves
+from cache import ResultCache, code_version, digest
+from classification import classify_events
+from kernels import AGENT_CODES
+from shared_data import SharedEvents, SharedEventsHandle, attach
+
+# Global sensitivity analysis of the model parameters. Designs are drawn
+# on the unit hypercube (Saltelli for Sobol indices, trajectories for
+# Morris elementary effects), mapped to parameter values and evaluated in
+# parallel. Each evaluation is a direct backtest loop plus a batched
+# extrapolation, and is cached on its own, so that growing a design only
+# evaluates the new points.
+
+
+@dataclass(frozen=True)
+class Factor():
+    """
+    Model parameter varied by the analysis. `kind` is 'float', 'int'
+    (from `low` to `high` inclusive) or 'choice' (one of `choices`).
+    """
+    name: str
+    low: float = 0.0
+    high: float = 1.0
+    kind: str = 'float'
+    choices: tuple = ()
+
+    def value(self, u: float) -> object:
+        if self.kind == 'float':
+            return float(self.low + u * (self.high - self.low))
+        elif self.kind == 'int':
+            return int(min(np.floor(self.low + u * (self.high - self.low + 1)), self.high))
+        elif self.kind == 'choice':
+            return self.choices[min(int(u * len(self.choices)), len(self.choices) - 1)]
+        raise ValueError(f"Unknown factor kind '{self.kind}'")
+
+
+DEFAULT_FACTORS = (
+    Factor('fee_percentage', 0.001, 0.01),
+    Factor('fix_cost', 0.0, 10.0),
+    Factor('retail_precision', 0, 6, 'int'),
+    Factor('retail_tolerance', 0.0, 0.01),
+    Factor('agent_type', kind='choice', choices=('Arb1', 'Arb2')),
+)
+OUTPUTS = ('rmse_RAI', 'rmse_ETH', 'terminal_RAI', 'terminal_ETH')
+
+
+def saltelli_design(k: int, n: int, seed: int = 0) -> np.ndarray:
+    """
+    Saltelli design with `n` base points (rounded up to a power of two) on
+    `k` factors, as the rows of A, B and then of each AB_i, where AB_i is A
+    with its i-th column taken from B. The base points are a seeded
+    scrambled Sobol sequence, so that every point of the design for `n`
+    is also on the design for any larger `n`.
+    """
+    m = int(np.ceil(np.log2(n)))
+    base = qmc.Sobol(2 * k, scramble=True, seed=seed).random_base2(m)
+    (A, B) = (base[:, :k], base[:, k:])
+    AB = [np.where(np.arange(k) == i, B, A) for i in range(k)]
+    return np.concatenate([A, B] + AB)
+
+
+def sobol_indices(y: np.ndarray, k: int,
+                  resamples: int = 200, seed: int = 0) -> pd.DataFrame:
+    """
+    First-order (Saltelli 2010) and total (Jansen) indices from the outputs
+    of a `saltelli_design`, with 95% bootstrap half-widths.
+    """
+    n = len(y) // (k + 2)
+    (fA, fB) = (y[:n], y[n:2 * n])
+    fAB = y[2 * n:].reshape(k, n)
+
+    def indices(rows):
+        variance = np.var(np.concatenate([fA[rows], fB[rows]]))
+        if variance == 0:
+            return (np.zeros(k), np.zeros(k))
+        first = np.mean(fB[rows] * (fAB[:, rows] - fA[rows]), axis=1) / variance
+        total = 0.5 * np.mean((fA[rows] - fAB[:, rows]) ** 2, axis=1) / variance
+        return (first, total)
+
+    (S1, ST) = indices(np.arange(n))
+    rng = np.random.default_rng(seed)
+    boot = [indices(rng.integers(0, n, n)) for _ in range(resamples)]
+    z = 1.96
+    return pd.DataFrame({'S1': S1,
+                         'S1_conf': z * np.std([b[0] for b in boot], axis=0),
+                         'ST': ST,
+                         'ST_conf': z * np.std([b[1] for b in boot], axis=0)})
+
+
+def morris_design(k: int, trajectories: int, levels: int = 4,
+                  seed: int = 0) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Morris one-at-a-time trajectories on a `levels` grid. Each trajectory
+    comes from its own seeded generator, so that a design is a prefix of
+    any design with more trajectories.
+
+    Returns
+    -------
+    Tuple[np.ndarray, np.ndarray, np.ndarray]
+        Points as (trajectories * (k + 1), k), the factor moved on each
+        step as (trajectories, k), and the signed step as (trajectories, k)
+
+    """
+    delta = levels / (2 * (levels - 1))
+    grid = np.arange(levels) / (levels - 1)
+    points = np.empty((trajectories, k + 1, k))
+    order = np.empty((trajectories, k), dtype=int)
+    steps = np.empty((trajectories, k))
+    for j in range(trajectories):
+        rng = np.random.default_rng([seed, j])
+        x = rng.choice(grid, k)
+        points[j, 0] = x
+        order[j] = rng.permutation(k)
+        for (step, i) in enumerate(order[j]):
+            steps[j, step] = delta if x[i] + delta <= 1 else -delta
+            x = x.copy()
+            x[i] += steps[j, step]
+            points[j, step + 1] = x
+    return (points.reshape(-1, k), order, steps)
+
+
+def morris_indices(y: np.ndarray, order: np.ndarray, steps: np.ndarray) -> pd.DataFrame:
+    """
+    Mean, mean absolute value and standard deviation of the elementary
+    effects of each factor, from the outputs of a `morris_design`.
+    """
+    (r, k) = order.shape
+    y = y.reshape(r, k + 1)
+    effects = np.empty((r, k))
+    for j in range(r):
+        effects[j, order[j]] = np.diff(y[j]) / steps[j]
+    return pd.DataFrame({'mu': effects.mean(axis=0),
+                         'mu_star': np.abs(effects).mean(axis=0),
+                         'sigma': effects.std(axis=0, ddof=1) if r > 1 else np.zeros(k)})
+
+
+class EventArrays(dict):
+    """
+    Columns of an event history as plain arrays, for the scalar lookups
+    of `p_actionDecoder` without the pandas indexing overhead.
+    """
+
+    def __init__(self, events: BacktestingData) -> None:
+        super().__init__((name, np.asarray(events[name], dtype=object)
+                          if isinstance(events[name].dtype, pd.CategoricalDtype)
+                          else events[name].to_numpy())
+                         for name in events.columns)
+        self.attrs = dict(events.attrs)
+
+    @property
+    def columns(self):
+        return self.keys()
+
+
+def backtest_core(events: BacktestingData, params: dict) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Backtest as a direct loop over the model policy and state update
+    functions, without the cadCAD engine and on `EventArrays`. Matches the
+    reserves of `extrapolation_cycle.backtest_model`.
+    """
+    # HACK
+    import model as default_model
+
+    params = {**params, 'uniswap_events': EventArrays(events), 'backtest_mode': True}
+    rai = np.empty(len(events))
+    eth = np.empty(len(events))
+    s = {'RAI_balance': events['token_balance'][0],
+         'ETH_balance': events['eth_balance'][0],
+         'timestep': 0}
+    (rai[0], eth[0]) = (s['RAI_balance'], s['ETH_balance'])
+    for timestep in range(1, len(events)):
+        action = default_model.p_actionDecoder(params, 1, None, s)
+        (_, rai[timestep]) = default_model.s_mechanismHub_RAI(params, 1, None, s, action)
+        (_, eth[timestep]) = default_model.s_mechanismHub_ETH(params, 1, None, s, action)
+        s = {'RAI_balance': rai[timestep], 'ETH_balance': eth[timestep], 'timestep': timestep}
+    return (rai, eth)
+
+
+# Evaluation context on each worker process, set once by `_init_worker`
+_context: dict = {}
+
+
+def _init_worker(handle: SharedEventsHandle, signals: np.ndarray) -> None:
+    _context.update(events=attach(handle), signals=signals, classified={})
+
+
+def _evaluate(values: dict) -> dict:
+    events = _context['events']
+    signals = _context['signals']
+    params = {**model_params(), **values}
+
+    # Classifications are reused across points with the same precision
+    precision = params['retail_precision']
+    if precision not in _context['classified']:
+        _context['classified'][precision] = classify_events(events, precision)
+    (rai, eth) = backtest_core(_context['classified'][precision], params)
+
+    agents = np.full(len(signals), AGENT_CODES[params['agent_type']])
+    (rai_t, eth_t) = simulate_reserves(rai[-1], eth[-1], signals, agents,
+                                       signals.shape[1], params)
+    return {'rmse_RAI': float(np.sqrt(np.mean((events['token_balance'].values - rai) ** 2))),
+            'rmse_ETH': float(np.sqrt(np.mean((events['eth_balance'].values - eth) ** 2))),
+            'terminal_RAI': float(rai_t[-1].mean()),
+            'terminal_ETH': float(eth_t[-1].mean())}
+
+
+def evaluate_points(events: BacktestingData,
+                    signals: np.ndarray,
+                    points: List[dict],
+                    cache: ResultCache = None,
+                    max_workers: int = None) -> Tuple[pd.DataFrame, int]:
+    """
+    Outputs of the model on each parameter point, in parallel, looking
+    each point up on `cache` first.
+
+    Returns
+    -------
+    Tuple[DataFrame, int]
+        The outputs on the order of `points`, and the number of points
+        actually evaluated
+
+    """
+    context_key = digest('sensitivity', code_version(), events, signals)
+    keys = [digest(context_key, point) for point in points]
+    results = {}
+    if cache is not None:
+        for key in set(keys):
+            value = cache.get(key)
+            if value is not None:
+                results[key] = value
+    missing = {key: point for (key, point) in zip(keys, points) if key not in results}
+
+    if missing:
+        workers = max_workers or os.cpu_count()
+        chunksize = max(1, len(missing) // (4 * workers))
+        with SharedEvents(events) as shared, \
+                ProcessPoolExecutor(max_workers=workers,
+                                    initializer=_init_worker,
+                                    initargs=(shared.handle, signals)) as executor:
+            for (key, value) in zip(missing, executor.map(_evaluate, missing.values(),
+                                                          chunksize=chunksize)):
+                results[key] = value
+                if cache is not None:
+                    cache.put(key, value)
+    return (pd.DataFrame([results[key] for key in keys]), len(missing))
+
+
+def default_signals(events: BacktestingData, timesteps: int, samples: int) -> np.ndarray:
+    """
+    Ratio signals from the stochastic fit of the events, as on the
+    extrapolation cycle, with shape (samples, timesteps).
+    """
+    from extrapolation_cycle import stochastic_fit, extrapolate_signals
+    from batched import signal_matrix
+
+    fit = stochastic_fit(events)
+    signals = extrapolate_signals(fit.ratio, timesteps + 10, fit.initial_ratio, samples)
+    return signal_matrix(signals)[:, :timesteps]
+
+
+def sensitivity_analysis(events: BacktestingData,
+                         method: str = 'sobol',
+                         n: int = 64,
+                         factors: Sequence[Factor] = DEFAULT_FACTORS,
+                         signals: np.ndarray = None,
+                         timesteps: int = 7 * 24,
+                         signal_samples: int = 10,
+                         cache: ResultCache = None,
+                         max_workers: int = None,
+                         seed: int = 0) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Sensitivity of the backtest RMSE and of the extrapolated reserves to
+    the model parameters.
+
+    Parameters
+    ----------
+    events : BacktestingData
+        Event level data, as returned by `extrapolation_cycle.prepare`
+    method : str
+        'sobol' for first-order and total Sobol indices on a Saltelli
+        design with `n` base points, or 'morris' for elementary effects on
+        `n` trajectories
+    signals : np.ndarray, optional
+        Ratio signals shared by every point, as (samples, timesteps).
+        Defaults to `signal_samples` signals from the fit of `events`.
+    cache : ResultCache, optional
+        Store of the evaluations of previous analyses
+
+    Returns
+    -------
+    Tuple[DataFrame, DataFrame]
+        The indices, indexed by output and factor, and the evaluated
+        design with the parameter values and outputs of every point
+
+    """
+    if signals is None:
+        signals = default_signals(events, timesteps, signal_samples)
+    k = len(factors)
+    if method == 'sobol':
+        unit = saltelli_design(k, n, seed)
+    elif method == 'morris':
+        (unit, order, steps) = morris_design(k, n, seed=seed)
+    else:
+        raise ValueError(f"Unknown method '{method}', expected 'sobol' or 'morris'")
+
+    points = [{factor.name: factor.value(u) for (factor, u) in zip(factors, row)} for row in unit]
+    (outputs, evaluated) = evaluate_points(events, signals, points, cache, max_workers)
+    print(f"{len(points)} points, {evaluated} evaluated, {len(points) - evaluated} from cache")
+
+    indices = {}
+    for output in OUTPUTS:
+        y = outputs[output].values
+        if method == 'sobol':
+            table = sobol_indices(y, k, seed=seed)
+        else:
+            table = morris_indices(y, order, steps)
+        indices[output] = table.set_index(pd.Index([factor.name for factor in factors], name='factor'))
+    design = pd.concat([pd.DataFrame(points), outputs], axis=1)
+    return (pd.concat(indices, names=['output']), design)
+
+
+@click.command()
+@click.argument('events_path')
+@click.option('-m', '--method', 'method', type=click.Choice(['sobol', 'morris']), default='sobol')
+@click.option('-n', 'n', default=64, help="Base points (sobol) or trajectories (morris)")
+@click.option('-t', '--timesteps', 'timesteps', default=7 * 24, help="Extrapolation timesteps")
+@click.option('-s', '--signal-samples', 'signal_samples', default=10, help="Signals per point")
+@click.option('-w', '--max-workers', 'max_workers', default=None, type=int, help="Worker processes")
+@click.option('--cache-path', 'cache_path', default='data/runs/cache', help="Evaluation cache folder")
+def main(events_path, method, n, timesteps, signal_samples, max_workers, cache_path) -> None:
+    """
+    Sensitivity analysis on a retrieval file.
+    """
+    from loader import load_events
+
+    (events, _) = load_events(events_path)
+    (indices, _) = sensitivity_analysis(events, method, n,
+                                        timesteps=timesteps,
+                                        signal_samples=signal_samples,
+                                        cache=ResultCache(Path(cache_path), max_bytes=2 * 1024 ** 3),
+                                        max_workers=max_workers)
+    with pd.option_context('display.float_format', '{:.3f}'.format):
+        print(indices)
+
+
+if __name__ == '__main__':
+    main()
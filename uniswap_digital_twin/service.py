@@ -0,0 +1,289 @@
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from threading import Event, Lock, Thread
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+import json
+import numpy as np
+import pandas as pd
+from amm_math import exact_output_amount
+from catalog import RunCatalog
+from event_driven import hourly_states
+from impact import ImpactSurface
+
+# Local HTTP/JSON service answering forecast queries from the latest
+# finished extrapolation cycle. The extrapolated reserves are kept in
+# memory as per-timestep sorted samples, so that a query is a lookup and
+# an interpolation.
+
+# Order of the agent type sweep of `extrapolation_cycle.extrapolate_data`
+AGENT_TYPES = ('Arb1', 'Arb2')
+VARIABLES = ('RAI_balance', 'ETH_balance', 'ratio')
+
+
+@dataclass
+class ForecastSummary():
+    runtime: str
+    # RAI and ETH reserves at the end of the backtest
+    reserves: Tuple[float, float]
+    fee_percentage: float
+    horizon: int
+    # Sorted samples of each variable, as (timestep, run) arrays per agent type
+    samples: Dict[str, Dict[str, np.ndarray]]
+    # Price impact along the extrapolated paths, when computed by the cycle
+    surface: Optional[ImpactSurface] = None
+
+    @classmethod
+    def from_frames(cls,
+                    runtime: str,
+                    backtest: pd.DataFrame,
+                    extrapolation: pd.DataFrame,
+                    fee_percentage: float = 0.003,
+                    surface: ImpactSurface = None,
+                    agent_types: List[str] = None) -> 'ForecastSummary':
+        if agent_types is None:
+            agent_types = extrapolation.attrs.get('agent_types', AGENT_TYPES)
+        if 'time' in extrapolation.columns:
+            # Event-driven runs, whose timestep is their own event index
+            extrapolation = hourly_states(extrapolation)
+        extrapolation = extrapolation.assign(ratio=extrapolation['RAI_balance'] / extrapolation['ETH_balance'])
+        samples = {}
+        for (subset, runs) in extrapolation.groupby('subset'):
+            agent_type = agent_types[subset] if subset < len(agent_types) else str(subset)
+            samples[agent_type] = {
+                variable: np.sort(runs.pivot_table(index='timestep', columns='run', values=variable).values,
+                                  axis=1)
+                for variable in VARIABLES}
+        reserves = (float(backtest['RAI_balance'].iloc[-1]), float(backtest['ETH_balance'].iloc[-1]))
+        return cls(str(runtime), reserves, fee_percentage,
+                   int(extrapolation['timestep'].max()), samples, surface)
+
+    def quantiles(self,
+                  agent_type: str,
+                  horizon: int,
+                  q: List[float],
+                  variable: str = 'RAI_balance') -> Dict[str, float]:
+        """
+        Quantiles `q` (in percent) of `variable` after `horizon` timesteps.
+        """
+        if agent_type not in self.samples:
+            raise ValueError(f"Unknown agent type '{agent_type}', expected one of {list(self.samples)}")
+        if variable not in VARIABLES:
+            raise ValueError(f"Unknown variable '{variable}', expected one of {list(VARIABLES)}")
+        if not 0 <= horizon <= self.horizon:
+            raise ValueError(f"Horizon must be between 0 and {self.horizon}")
+        values = self.samples[agent_type][variable][horizon]
+        return {f'p{p:g}': float(v) for (p, v) in zip(q, np.percentile(values, q))}
+
+    def impact(self, sell: str, amount: float) -> Dict[str, float]:
+        """
+        Output and price impact of selling `amount` of `sell` ('ETH' or
+        'RAI') against the current reserves, fee included.
+        """
+        (rai, eth) = self.reserves
+        if sell == 'ETH':
+            (I_t, O_t) = (eth, rai)
+        elif sell == 'RAI':
+            (I_t, O_t) = (rai, eth)
+        else:
+            raise ValueError("Sold token must be 'ETH' or 'RAI'")
+        if not 0 < amount < np.inf:
+            raise ValueError("Amount must be positive and finite")
+        amount_out = exact_output_amount(amount, I_t, O_t, self.fee_percentage)
+        spot_price = O_t / I_t
+        execution_price = amount_out / amount
+        return {'amount_in': amount,
+                'amount_out': amount_out,
+                'spot_price': spot_price,
+                'execution_price': execution_price,
+                'price_impact': 1 - execution_price / spot_price}
+
+    def slippage(self, sell: str, amount: float, horizon: int, q: List[float]) -> Dict[str, float]:
+        """
+        Quantiles `q` (in percent) across the extrapolated paths of the
+        price impact of selling `amount` of `sell` after `horizon` timesteps.
+        """
+        if self.surface is None:
+            raise ValueError("No price impact surface on this cycle")
+        if sell not in ('ETH', 'RAI'):
+            raise ValueError("Sold token must be 'ETH' or 'RAI'")
+        if not 0 < amount < np.inf:
+            raise ValueError("Amount must be positive and finite")
+        values = self.surface.quantiles(sell, amount, horizon, q)
+        return {f'p{p:g}': float(v) for (p, v) in zip(q, values)}
+
+    def describe(self) -> dict:
+        return {'runtime': self.runtime,
+                'reserves': {'RAI': self.reserves[0], 'ETH': self.reserves[1]},
+                'horizon': self.horizon,
+                'agent_types': list(self.samples),
+                'runs': {agent: int(s['RAI_balance'].shape[1]) for (agent, s) in self.samples.items()}}
+
+
+def load_latest(data_path: Path) -> Optional[ForecastSummary]:
+    """
+    Summary of the most recent finished run on the catalog with both its
+    backtest and extrapolation on disk.
+    """
+    with RunCatalog(data_path) as catalog:
+        for run in catalog.find_runs(status='done'):
+            artifacts = catalog.artifacts(run['runtime'])
+            paths = (artifacts.get('backtesting'), artifacts.get('extrapolation'))
+            if all(path is not None and path.exists() for path in paths):
+                surface_path = artifacts.get('impact')
+                surface = None
+                if surface_path is not None and surface_path.exists():
+                    surface = ImpactSurface.load(surface_path)
+                params = json.loads(run['params'] or '{}')
+                return ForecastSummary.from_frames(run['runtime'],
+                                                   pd.read_csv(paths[0]),
+                                                   pd.read_csv(paths[1]),
+                                                   surface=surface,
+                                                   agent_types=params.get('agent_types'))
+    return None
+
+
+class ForecastService():
+    """
+    HTTP server over the latest `ForecastSummary`. The catalog is polled
+    every `refresh_interval` seconds, and the summary is swapped once a
+    newer cycle has finished.
+
+    Endpoints (GET, JSON):
+        /health
+        /summary
+        /quantiles?agent=Arb1&horizon=24&q=50,95&variable=RAI_balance
+        /impact?sell=ETH&amount=10
+        /slippage?sell=ETH&amount=10&horizon=24&q=5,50,95
+    """
+
+    def __init__(self, data_path: Path, host: str = '127.0.0.1', port: int = 0,
+                 refresh_interval: float = 30.0,
+                 summary: ForecastSummary = None) -> None:
+        self.data_path = Path(data_path)
+        self.refresh_interval = refresh_interval
+        self.summary = summary
+        self.requests = 0
+        self._lock = Lock()
+        self._stop = Event()
+        self._server = ThreadingHTTPServer((host, port), _Handler)
+        self._server.service = self
+        self._threads = []
+
+    @property
+    def url(self) -> str:
+        (host, port) = self._server.server_address[:2]
+        return f'http://{host}:{port}/'
+
+    def refresh(self) -> bool:
+        """
+        Load the latest finished cycle, returning whether it changed.
+        """
+        summary = load_latest(self.data_path)
+        if summary is None or (self.summary is not None and summary.runtime == self.summary.runtime):
+            return False
+        self.summary = summary
+        return True
+
+    def _poll(self) -> None:
+        while not self._stop.wait(self.refresh_interval):
+            try:
+                if self.refresh():
+                    print(f"Loaded forecast of {self.summary.runtime}")
+            except Exception as e:
+                print(f"Refresh failed: {e}")
+
+    def start(self) -> 'ForecastService':
+        threads = [Thread(target=self._server.serve_forever, daemon=True)]
+        if self.refresh_interval > 0:
+            threads.append(Thread(target=self._poll, daemon=True))
+        for thread in threads:
+            thread.start()
+        self._threads = threads
+        return self
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self) -> 'ForecastService':
+        return self.start()
+
+    def __exit__(self, *args) -> None:
+        self.stop()
+
+    def answer(self, path: str, query: Dict[str, List[str]]) -> Tuple[int, dict]:
+        if path == '/health':
+            return (200, {'status': 'ok', 'loaded': self.summary is not None})
+        summary = self.summary
+        if summary is None:
+            return (503, {'error': 'No finished extrapolation cycle yet'})
+
+        def arg(name, default=None):
+            values = query.get(name)
+            if values is None:
+                if default is None:
+                    raise ValueError(f"Missing parameter '{name}'")
+                return default
+            return values[0]
+
+        try:
+            if path == '/summary':
+                return (200, summary.describe())
+            elif path == '/quantiles':
+                q = [float(p) for p in arg('q', '5,50,95').split(',')]
+                agent = arg('agent', next(iter(summary.samples)))
+                result = summary.quantiles(agent, int(arg('horizon')), q,
+                                           arg('variable', 'RAI_balance'))
+                return (200, {'runtime': summary.runtime, **result})
+            elif path == '/impact':
+                result = summary.impact(arg('sell', 'ETH'), float(arg('amount')))
+                return (200, {'runtime': summary.runtime, **result})
+            elif path == '/slippage':
+                q = [float(p) for p in arg('q', '5,50,95').split(',')]
+                result = summary.slippage(arg('sell', 'ETH'), float(arg('amount')),
+                                          int(arg('horizon', '0')), q)
+                return (200, {'runtime': summary.runtime, **result})
+        except (ValueError, OverflowError) as e:
+            return (400, {'error': str(e)})
+        return (404, {'error': f"Unknown endpoint '{path}'"})
+
+
+class _Handler(BaseHTTPRequestHandler):
+    # Keep-alive connections, without the Nagle delay between the headers
+    # and the body
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def do_GET(self) -> None:
+        service = self.server.service
+        with service._lock:
+            service.requests += 1
+        url = urlsplit(self.path)
+        (status, response) = service.answer(url.path, parse_qs(url.query))
+        payload = json.dumps(response).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args) -> None:
+        pass
+
+
+def serve(data_path: Path, host: str = '127.0.0.1', port: int = 8050,
+          refresh_interval: float = 30.0) -> None:
+    service = ForecastService(data_path, host, port, refresh_interval)
+    if service.refresh():
+        print(f"Loaded forecast of {service.summary.runtime}")
+    else:
+        print("No finished extrapolation cycle yet, waiting for one")
+    service.start()
+    print(f"Serving forecasts at {service.url}")
+    try:
+        service._threads[0].join()
+    except KeyboardInterrupt:
+        service.stop()
@@ -0,0 +1,157 @@
+from dataclasses import dataclass
+from multiprocessing import shared_memory
+from typing import Dict, List, Optional, Tuple, Union
+import weakref
+import numpy as np
+import pandas as pd
+from Types import BacktestingData
+
+# Event histories published once into shared memory blocks, so that
+# worker processes attach to the same pages rather than receiving a
+# pickled copy of the DataFrame each.
+
+
+@dataclass(frozen=True)
+class SharedColumn():
+    name: str
+    block: str
+    dtype: str
+    # 'values', 'categorical' or 'masked'
+    kind: str
+    categories: Optional[tuple] = None
+    mask_block: Optional[str] = None
+
+
+@dataclass(frozen=True)
+class SharedEventsHandle():
+    """
+    Picklable description of a published event history.
+    """
+    columns: Tuple[SharedColumn, ...]
+    length: int
+    index: Optional[SharedColumn] = None
+    # Items of the DataFrame `attrs`
+    attrs: tuple = ()
+
+
+# Attached histories on the current process, with the blocks kept open
+# until `detach`
+_attached: Dict[SharedEventsHandle, Tuple[BacktestingData, list]] = {}
+
+
+def _publish_array(values: np.ndarray, blocks: List[shared_memory.SharedMemory]) -> str:
+    block = shared_memory.SharedMemory(create=True, size=max(values.nbytes, 1))
+    np.ndarray(values.shape, values.dtype, buffer=block.buf)[:] = values
+    blocks.append(block)
+    return block.name
+
+
+def _release(handle: 'SharedEventsHandle', blocks: List[shared_memory.SharedMemory]) -> None:
+    detach(handle)
+    for block in blocks:
+        block.close()
+        block.unlink()
+
+
+def _publish_column(name: str, col: pd.Series, blocks: List[shared_memory.SharedMemory]) -> SharedColumn:
+    if isinstance(col.dtype, pd.CategoricalDtype):
+        codes = col.cat.codes.values
+        return SharedColumn(name, _publish_array(codes, blocks), codes.dtype.str,
+                            'categorical', categories=tuple(col.cat.categories))
+    elif isinstance(col.array, pd.arrays.IntegerArray):
+        values = col.array.to_numpy(dtype=col.dtype.numpy_dtype, na_value=0)
+        return SharedColumn(name, _publish_array(values, blocks), values.dtype.str, 'masked',
+                            mask_block=_publish_array(col.isna().values, blocks))
+    elif col.dtype == object:
+        # Strings are published as categorical codes
+        return _publish_column(name, col.astype('category'), blocks)
+    else:
+        values = col.to_numpy()
+        return SharedColumn(name, _publish_array(values, blocks), values.dtype.str, 'values')
+
+
+class SharedEvents():
+    """
+    Owner of the shared memory blocks holding an event history. The blocks
+    are unlinked on `close`, at the end of a `with` block, or when the
+    object is garbage collected.
+    """
+
+    def __init__(self, events: BacktestingData) -> None:
+        blocks = []
+        columns = tuple(_publish_column(name, events[name], blocks) for name in events.columns)
+        if events.index.equals(pd.RangeIndex(len(events))):
+            index = None
+        else:
+            index = _publish_column(events.index.name, events.index.to_series(), blocks)
+        self.handle = SharedEventsHandle(columns, len(events), index, tuple(events.attrs.items()))
+        self.nbytes = sum(block.size for block in blocks)
+        # Not registered on `_attached`, which forked workers inherit: every
+        # process, this one included, attaches to the blocks
+        self._finalizer = weakref.finalize(self, _release, self.handle, blocks)
+
+    def close(self) -> None:
+        self._finalizer()
+
+    def __enter__(self) -> 'SharedEvents':
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+
+def attach(handle: SharedEventsHandle) -> BacktestingData:
+    """
+    Read-only DataFrame over the shared memory blocks of `handle`, built
+    without copying the column data.
+    """
+    if handle in _attached:
+        return _attached[handle][0]
+    blocks = []
+
+    def view(block_name: str, dtype: str) -> np.ndarray:
+        block = shared_memory.SharedMemory(name=block_name)
+        blocks.append(block)
+        values = np.ndarray((handle.length,), np.dtype(dtype), buffer=block.buf)
+        values.flags.writeable = False
+        return values
+
+    def column(col: SharedColumn):
+        values = view(col.block, col.dtype)
+        if col.kind == 'categorical':
+            return pd.Categorical.from_codes(values, categories=list(col.categories))
+        elif col.kind == 'masked':
+            return pd.arrays.IntegerArray(values, view(col.mask_block, '|b1'))
+        else:
+            return values
+
+    data = {col.name: column(col) for col in handle.columns}
+    index = None
+    if handle.index is not None:
+        index = pd.Index(column(handle.index), name=handle.index.name)
+    events = pd.DataFrame(data, index=index, copy=False)
+    events.attrs = dict(handle.attrs)
+    _attached[handle] = (events, blocks)
+    return events
+
+
+def detach(handle: SharedEventsHandle) -> None:
+    """
+    Drop the attached DataFrame of `handle` and close its blocks, unless
+    views of them are still referenced elsewhere.
+    """
+    (_, blocks) = _attached.pop(handle, (None, []))
+    for block in blocks:
+        try:
+            block.close()
+        except BufferError:
+            pass
+
+
+def resolve_events(events: Union[BacktestingData, SharedEventsHandle, None]) -> BacktestingData:
+    """
+    Event history from either a DataFrame or a shared memory handle.
+    """
+    if isinstance(events, SharedEventsHandle):
+        return attach(events)
+    return events
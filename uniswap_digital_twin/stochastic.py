@@ -3,13 +3,80 @@ import pandas as pd
 import numpy as np
 from dataclasses import dataclass
 from scipy.stats import gamma
-import pymc3 as pm
-from Types import USD_per_ETH
+from scipy.special import ndtri
+import warnings
+from Types import USD_per_ETH, BacktestingData
 
 @dataclass
 class FitParams():
     shape: float
     scale: float
+
+
+@dataclass
+class SignalFit():
+    """
+    Fitted parameters for the exogenous signals.
+    ratio: drift and volatility of the log(1 + RAI/ETH) increments
+    eth: gamma shape and scale for `generate_eth_samples`
+    initial_ratio: last observed log(1 + RAI/ETH)
+    """
+    ratio: FitParams
+    eth: FitParams
+    initial_ratio: float
+    bar_size: str
+
+
+def resample_ratio(events: BacktestingData, bar_size: str = '1h') -> pd.Series:
+    """
+    RAI/ETH pool ratio at the close of each bar. Bars without events
+    carry the previous close.
+    """
+    ratio = pd.Series((events['token_balance'] / events['eth_balance']).values,
+                      index=pd.to_datetime(events['timestamp']))
+    return ratio.resample(bar_size).last().ffill().dropna()
+
+
+def fit_log_ratio(log_ratio: np.ndarray) -> FitParams:
+    """
+    Closed-form MLE of the drift and volatility of a gaussian random walk.
+    """
+    deltas = np.diff(log_ratio)
+    return FitParams(float(deltas.mean()), float(deltas.std()))
+
+
+def fit_gamma(values: np.ndarray) -> FitParams:
+    """
+    Gamma shape and scale through Minka's closed-form approximation
+    of the MLE.
+    """
+    values = values[values > 0]
+    mean = values.mean()
+    s = np.log(mean) - np.log(values).mean()
+    if s <= 0:
+        # Degenerate (constant) series
+        return FitParams(np.inf, 0.0)
+    shape = (3 - s + np.sqrt((s - 3) ** 2 + 24 * s)) / (12 * s)
+    return FitParams(float(shape), float(mean / shape))
+
+
+def fit_log_ratio_bayesian(log_ratio: np.ndarray,
+                           draws: int = 1000,
+                           tune: int = 1000) -> tuple[FitParams, object]:
+    """
+    Posterior of the random walk drift and volatility. Returns the
+    posterior means along with the full trace.
+    """
+    import pymc3 as pm
+
+    deltas = np.diff(log_ratio)
+    with pm.Model():
+        mu = pm.Normal('mu', mu=0, sigma=1)
+        sigma = pm.HalfNormal('sigma', sigma=1)
+        pm.Normal('deltas', mu=mu, sigma=sigma, observed=deltas)
+        trace = pm.sample(draws, tune=tune, return_inferencedata=False)
+    params = FitParams(float(trace['mu'].mean()), float(trace['sigma'].mean()))
+    return (params, trace)
     
 def kalman_filter(observations: list[float],
                   initialValue: float,
@@ -99,4 +166,222 @@ def generate_ratio_samples(fit_params: FitParams,
         mu, std = fit_params.shape, fit_params.scale
         deltas = np.random.normal(mu, std, timesteps)
         ratios = np.exp(initial_value + deltas.cumsum()) - 1
-        yield ratios
\ No newline at end of file
+        yield ratios
+
+## Batched signal processes
+# Every process generates log(1 + ratio) paths with shape (samples, timesteps)
+# in a single vectorized call. `fit_params.shape` and `fit_params.scale` are
+# the drift and the volatility of the increments, as fitted by `fit_log_ratio`.
+
+SIGNAL_PROCESSES = {}
+
+# Sampling methods for the innovations of the signal processes. With
+# 'antithetic', sample i + (samples + 1) // 2 mirrors sample i, the middle
+# sample of an odd count having no mirror.
+SAMPLING_METHODS = ('pseudo', 'antithetic', 'sobol')
+
+
+def uniform_innovations(rng: np.random.Generator,
+                        samples: int,
+                        timesteps: int,
+                        sampling: str = 'pseudo') -> np.ndarray:
+    if sampling == 'pseudo':
+        return rng.random((samples, timesteps))
+    elif sampling == 'antithetic':
+        half = rng.random(((samples + 1) // 2, timesteps))
+        return np.concatenate([half, 1 - half])[:samples]
+    elif sampling == 'sobol':
+        from scipy.stats import qmc
+
+        sobol = qmc.Sobol(d=timesteps, scramble=True, seed=rng)
+        with warnings.catch_warnings():
+            # Balance properties are only guaranteed on powers of two
+            warnings.simplefilter('ignore', UserWarning)
+            return sobol.random(samples)
+    else:
+        raise ValueError(f"Unknown sampling method {sampling}")
+
+
+def normal_innovations(rng: np.random.Generator,
+                       samples: int,
+                       timesteps: int,
+                       sampling: str = 'pseudo') -> np.ndarray:
+    if sampling == 'pseudo':
+        return rng.standard_normal((samples, timesteps))
+    elif sampling == 'antithetic':
+        half = rng.standard_normal(((samples + 1) // 2, timesteps))
+        return np.concatenate([half, -half])[:samples]
+    else:
+        u = uniform_innovations(rng, samples, timesteps, sampling)
+        return ndtri(np.clip(u, 1e-16, 1 - 1e-16))
+
+
+def signal_process(name: str):
+    """
+    Register a signal process under `name`.
+    """
+    def register(process):
+        SIGNAL_PROCESSES[name] = process
+        return process
+    return register
+
+
+@signal_process('random_walk')
+def random_walk_process(fit_params: FitParams,
+                        timesteps: int,
+                        samples: int,
+                        initial_value: float,
+                        rng: np.random.Generator,
+                        sampling: str = 'pseudo') -> np.ndarray:
+    """
+    Per-sample seeded gaussian random walk, as `generate_ratio_samples`.
+    """
+    if sampling != 'pseudo':
+        raise ValueError("The random walk process only supports pseudo-random sampling")
+    ratios = np.array(list(generate_ratio_samples(fit_params, timesteps, samples, initial_value)))
+    return np.log1p(ratios)
+
+
+@signal_process('gbm')
+def gbm_process(fit_params: FitParams,
+                timesteps: int,
+                samples: int,
+                initial_value: float,
+                rng: np.random.Generator,
+                sampling: str = 'pseudo') -> np.ndarray:
+    """
+    Geometric brownian motion on 1 + ratio.
+    """
+    deltas = normal_innovations(rng, samples, timesteps, sampling)
+    deltas *= fit_params.scale
+    deltas += fit_params.shape
+    return initial_value + deltas.cumsum(axis=1)
+
+
+@signal_process('ou')
+def ou_process(fit_params: FitParams,
+               timesteps: int,
+               samples: int,
+               initial_value: float,
+               rng: np.random.Generator,
+               reversion: float = 0.05,
+               mean_level: float = None,
+               sampling: str = 'pseudo') -> np.ndarray:
+    """
+    Ornstein-Uhlenbeck mean reversion towards `mean_level`, which defaults
+    to the initial value. `reversion` is the fraction of the gap closed
+    on each timestep.
+    """
+    from scipy.signal import lfilter
+
+    if mean_level is None:
+        mean_level = initial_value
+    noise = normal_innovations(rng, samples, timesteps, sampling)
+    noise *= fit_params.scale
+    # AR(1) recursion x[t] = (1 - reversion) * x[t-1] + noise[t] on the gap
+    gap = lfilter([1.0], [1.0, reversion - 1], noise, axis=1,
+                  zi=np.full((samples, 1), (1 - reversion) * (initial_value - mean_level)))[0]
+    return mean_level + gap
+
+
+@signal_process('jump_diffusion')
+def jump_diffusion_process(fit_params: FitParams,
+                           timesteps: int,
+                           samples: int,
+                           initial_value: float,
+                           rng: np.random.Generator,
+                           jump_intensity: float = 0.01,
+                           jump_mean: float = 0.0,
+                           jump_std: float = 0.05,
+                           sampling: str = 'pseudo') -> np.ndarray:
+    """
+    Merton jump-diffusion: gaussian increments plus a Poisson number of
+    gaussian jumps per timestep. `sampling` applies to the diffusion.
+    """
+    deltas = normal_innovations(rng, samples, timesteps, sampling)
+    deltas *= fit_params.scale
+    deltas += fit_params.shape
+    jumps = rng.poisson(jump_intensity, (samples, timesteps))
+    deltas += jump_mean * jumps + jump_std * np.sqrt(jumps) * rng.standard_normal((samples, timesteps))
+    return initial_value + deltas.cumsum(axis=1)
+
+
+@signal_process('bootstrap')
+def bootstrap_process(fit_params: FitParams,
+                      timesteps: int,
+                      samples: int,
+                      initial_value: float,
+                      rng: np.random.Generator,
+                      returns: np.ndarray = None,
+                      sampling: str = 'pseudo') -> np.ndarray:
+    """
+    Resample the historical log(1 + ratio) increments with replacement,
+    through the inverse of their empirical distribution.
+    """
+    if returns is None:
+        raise ValueError("The bootstrap process requires the historical `returns`")
+    returns = np.sort(np.asarray(returns))
+    u = uniform_innovations(rng, samples, timesteps, sampling)
+    deltas = returns[np.minimum((u * len(returns)).astype(int), len(returns) - 1)]
+    return initial_value + deltas.cumsum(axis=1)
+
+
+@signal_process('regime_switching')
+def regime_switching_process(fit_params: FitParams,
+                             timesteps: int,
+                             samples: int,
+                             initial_value: float,
+                             rng: np.random.Generator,
+                             volatility_multiplier: float = 3.0,
+                             stay_probabilities: tuple = (0.98, 0.9),
+                             sampling: str = 'pseudo') -> np.ndarray:
+    """
+    Two-state Markov switching between a calm regime with the fitted
+    volatility and a turbulent one with `volatility_multiplier` times it.
+    `sampling` applies to the diffusion.
+
+    The regime paths are drawn over chunks of samples, so that only the
+    turbulent flags and the output are allocated in full.
+    """
+    (calm_stay, turbulent_stay) = stay_probabilities
+    turbulent = np.empty((samples, timesteps), dtype=bool)
+    chunk = max(1, 2 ** 22 // timesteps)
+    for start in range(0, samples, chunk):
+        stop = min(start + chunk, samples)
+        # Time-major, for contiguous steps
+        u = np.ascontiguousarray(rng.random((stop - start, timesteps)).T)
+        regime = np.zeros(stop - start, dtype=bool)
+        for t in range(timesteps):
+            regime ^= u[t] > np.where(regime, turbulent_stay, calm_stay)
+            turbulent[start:stop, t] = regime
+    deltas = normal_innovations(rng, samples, timesteps, sampling)
+    deltas *= fit_params.scale
+    np.multiply(deltas, volatility_multiplier, out=deltas, where=turbulent)
+    deltas += fit_params.shape
+    np.cumsum(deltas, axis=1, out=deltas)
+    deltas += initial_value
+    return deltas
+
+
+def generate_samples(process: str,
+                     fit_params: FitParams,
+                     timesteps: int,
+                     samples: int,
+                     initial_value: float,
+                     seed: int = 0,
+                     sampling: str = 'pseudo',
+                     **process_kwargs) -> np.ndarray:
+    """
+    Generate ratio samples with shape (samples, timesteps) from a
+    registered signal process, with innovations drawn according to
+    `sampling` (one of `SAMPLING_METHODS`).
+    """
+    rng = np.random.default_rng(seed)
+    log_ratio = SIGNAL_PROCESSES[process](fit_params,
+                                          timesteps,
+                                          samples,
+                                          initial_value,
+                                          rng,
+                                          sampling=sampling,
+                                          **process_kwargs)
+    return np.expm1(log_ratio, out=log_ratio)
@@ -0,0 +1,427 @@
+from datetime import datetime
+from hashlib import sha256
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from threading import Thread, Lock
+from typing import Dict, List, Optional
+import json
+import re
+import time
+import click
+import numpy as np
+import pandas as pd
+import requests
+from amm_math import to_wei
+
+# Offline stand-in for the Uniswap V2 subgraph, serving either recorded
+# responses or a synthetic RAI/ETH event stream, so that the retrieval
+# on `Data` can be run and benchmarked without the hosted service.
+
+PAIR = "0x8ae720a71622e824f576b4a8c03031066548a3b1"
+
+QUERY_PATTERN = re.compile(r'query\s*\{\s*(\w+)\s*\((.*)\)\s*\{(.*?)\}\s*\}\s*$', re.DOTALL)
+WHERE_PATTERN = re.compile(r'where:\s*\{(.*)\}', re.DOTALL)
+CLAUSE_PATTERN = re.compile(r'(\w+):\s*("[^"]*"|[^,}]+)')
+
+
+def parse_query(query: str) -> dict:
+    """
+    Parse the queries built by `Data.query_builder`.
+    """
+    match = QUERY_PATTERN.search(query.strip())
+    if match is None:
+        raise ValueError(f"Unsupported query: {query}")
+    (main, arguments, fields) = match.groups()
+    where = WHERE_PATTERN.search(arguments)
+    clauses = {}
+    if where is not None:
+        for (key, value) in CLAUSE_PATTERN.findall(where.group(1)):
+            value = value.strip()
+            clauses[key] = value.strip('"') if value.startswith('"') else int(value)
+        arguments = arguments[:where.start()]
+    first = re.search(r'first:\s*(\d+)', arguments)
+    return {'main': main,
+            'first': int(first.group(1)) if first else 100,
+            'where': clauses,
+            'fields': [field.strip() for field in fields.split(',') if field.strip()]}
+
+
+class GraphQLSource():
+
+    def handle(self, body: dict, page_size: int) -> dict:
+        try:
+            return self.respond(body['query'], page_size)
+        except (ValueError, KeyError) as e:
+            return {'errors': [{'message': str(e)}]}
+
+
+class FixtureSource(GraphQLSource):
+    """
+    Recorded subgraph responses, one JSON file per query. With an
+    `upstream` url, missing queries are forwarded to it and recorded.
+    """
+
+    def __init__(self, path: str, upstream: Optional[str] = None) -> None:
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.upstream = upstream
+
+    def fixture_path(self, query: str) -> Path:
+        return self.path / f'{sha256(query.encode()).hexdigest()}.json'
+
+    def respond(self, query: str, page_size: int) -> dict:
+        path = self.fixture_path(query)
+        if path.exists():
+            return json.loads(path.read_text())['response']
+        elif self.upstream is not None:
+            response = requests.post(self.upstream, json={'query': query}).json()
+            if 'errors' not in response:
+                path.write_text(json.dumps({'query': query, 'response': response}))
+            return response
+        else:
+            return {'errors': [{'message': f"No fixture for query {path.name}"}]}
+
+
+def _decimal(value: float) -> str:
+    # BigDecimal fields are served as strings
+    return repr(float(value))
+
+
+def synthetic_events(start_date: datetime,
+                     days: int = 14,
+                     events_per_day: int = 2000,
+                     seed: int = 0,
+                     initial_rai: float = 3.7e6,
+                     initial_eth: float = 1e4,
+                     initial_uni: float = 1.9e5,
+                     fee: float = 0.003) -> pd.DataFrame:
+    """
+    Synthetic RAI/ETH pool history. Swaps follow the constant product with
+    fee, and mints and burns are proportional to the pool. Each row holds
+    the event amounts and the pool state after it, while the initial state
+    and the time range are kept on `attrs`.
+    """
+    rng = np.random.default_rng(seed)
+    start_unix = int(pd.Timestamp(start_date).timestamp())
+    n = days * events_per_day
+    timestamps = np.sort(rng.integers(start_unix, start_unix + days * 86400, n))
+    kinds = rng.choice(['swaps', 'mints', 'burns'], n, p=[.9, .05, .05])
+    eth_sizes = rng.lognormal(0, 1.5, n)
+    pcts = rng.uniform(5e-4, 5e-3, n)
+    rai_sold = rng.random(n) < .5
+
+    (rai, eth, uni) = (initial_rai, initial_eth, initial_uni)
+    # amount0In, amount1In, amount0Out, amount1Out, liquidity and the state after
+    values = np.zeros((n, 8))
+    for i in range(n):
+        if kinds[i] == 'swaps':
+            if rai_sold[i]:
+                amount_in = eth_sizes[i] * rai / eth
+                amount_out = amount_in * (1 - fee) * eth / (rai + amount_in * (1 - fee))
+                (rai, eth) = (rai + amount_in, eth - amount_out)
+                values[i, :4] = (amount_in, 0.0, 0.0, amount_out)
+            else:
+                amount_in = eth_sizes[i]
+                amount_out = amount_in * (1 - fee) * rai / (eth + amount_in * (1 - fee))
+                (rai, eth) = (rai - amount_out, eth + amount_in)
+                values[i, :4] = (0.0, amount_in, amount_out, 0.0)
+        else:
+            sign = 1 if kinds[i] == 'mints' else -1
+            (amount0, amount1, liquidity) = (rai * pcts[i], eth * pcts[i], uni * pcts[i])
+            (rai, eth, uni) = (rai + sign * amount0, eth + sign * amount1, uni + sign * liquidity)
+            # Liquidity amounts are positive on both mints and burns
+            values[i, :2] = (amount0, amount1)
+            values[i, 4] = liquidity
+        values[i, 5:] = (rai, eth, uni)
+
+    events = pd.DataFrame(values, columns=['amount0In', 'amount1In', 'amount0Out', 'amount1Out',
+                                           'liquidity', 'reserve0', 'reserve1', 'supply'])
+    events.insert(0, 'kind', kinds)
+    events.insert(1, 'timestamp', timestamps)
+    events.attrs = {'initial': (initial_rai, initial_eth, initial_uni),
+                    'start_unix': start_unix,
+                    'end_unix': start_unix + days * 86400}
+    return events
+
+
+def synthetic_entities(events: pd.DataFrame) -> Dict[str, pd.DataFrame]:
+    """
+    Subgraph entities queried by `Data.create_data` for a synthetic
+    history, with hourly reserves which pass the consistency check of
+    `Data.add_starting_state`.
+    """
+    ids = np.array([f"0x{i:064x}-0" for i in range(len(events))])
+    common = pd.DataFrame({'id': ids,
+                           'timestamp': events['timestamp'].astype(str),
+                           'logIndex': np.arange(len(events)).astype(str)})
+    entities = {}
+    swaps = events['kind'] == 'swaps'
+    entities['swaps'] = common[swaps].assign(**{col: events.loc[swaps, col].map(_decimal)
+                                                for col in ['amount0In', 'amount1In', 'amount0Out', 'amount1Out']})
+    for kind in ('mints', 'burns'):
+        rows = events['kind'] == kind
+        entities[kind] = common[rows].assign(amount0=events.loc[rows, 'amount0In'].map(_decimal),
+                                             amount1=events.loc[rows, 'amount1In'].map(_decimal),
+                                             liquidity=events.loc[rows, 'liquidity'].map(_decimal))
+
+    # Reserves at the end of every hour, from the one before the start
+    (start_unix, end_unix) = (events.attrs['start_unix'], events.attrs['end_unix'])
+    timestamps = events['timestamp'].values
+    state = events[['reserve0', 'reserve1', 'supply']].values
+    hours = np.arange(start_unix - 3600, end_unix, 3600)
+    last_event = np.searchsorted(timestamps, hours + 3600) - 1
+    hour_reserves = np.where(last_event[:, None] >= 0,
+                             state[np.maximum(last_event, 0)],
+                             events.attrs['initial'])
+    entities['pairHourDatas'] = pd.DataFrame({'id': [f"{PAIR}-{hour // 3600:08d}" for hour in hours],
+                                              'reserve0': list(map(_decimal, hour_reserves[:, 0])),
+                                              'reserve1': list(map(_decimal, hour_reserves[:, 1])),
+                                              'hourStartUnix': hours})
+
+    # Total supply after each liquidity event
+    liquidity = events['kind'] != 'swaps'
+    entities['liquidityPositionSnapshots'] = pd.DataFrame({'id': ids[liquidity.values],
+                                                           'liquidityTokenTotalSupply': events.loc[liquidity, 'supply'].map(_decimal).values,
+                                                           'timestamp': timestamps[liquidity.values]})
+    return entities
+
+
+class SyntheticSource(GraphQLSource):
+    """
+    Serve the entities from `synthetic_entities`, ordered by descending
+    id and filtered on the id and time clauses used by `Data`.
+    """
+    TIME_FIELDS = {'pairHourDatas': 'hourStartUnix'}
+
+    def __init__(self, entities: Dict[str, pd.DataFrame]) -> None:
+        self.entities = {}
+        for (main, df) in entities.items():
+            df = df.sort_values('id').reset_index(drop=True)
+            times = df[self.TIME_FIELDS.get(main, 'timestamp')].astype(int).values
+            self.entities[main] = (df, df['id'].values.astype(str), times)
+
+    def respond(self, query: str, page_size: int) -> dict:
+        parsed = parse_query(query)
+        (df, ids, times) = self.entities[parsed['main']]
+        time_field = self.TIME_FIELDS.get(parsed['main'], 'timestamp')
+        where = parsed['where']
+
+        # Ids increase with time, so that every filter is a contiguous range
+        (lo, hi) = (0, len(df))
+        if f'{time_field}_gte' in where:
+            lo = max(lo, np.searchsorted(times, where[f'{time_field}_gte'], 'left'))
+        if f'{time_field}_lte' in where:
+            hi = min(hi, np.searchsorted(times, where[f'{time_field}_lte'], 'right'))
+        if 'id_lt' in where:
+            hi = min(hi, np.searchsorted(ids, where['id_lt'], 'left'))
+        first = min(parsed['first'], page_size)
+        page = df.iloc[max(lo, hi - first):max(lo, hi)].iloc[::-1]
+        return {'data': {parsed['main']: page[parsed['fields']].to_dict('records')}}
+
+
+class JsonRpcSource():
+    """
+    JSON-RPC node serving the pair logs of a synthetic history, with a
+    block every `block_time` seconds. `eth_getLogs` requests with more
+    than `page_size` results are rejected, as public and archive nodes do.
+    """
+
+    def __init__(self, events: pd.DataFrame, block_time: int = 12) -> None:
+        from chain_data import (MINT_TOPIC, BURN_TOPIC, SWAP_TOPIC, SYNC_TOPIC,
+                                TRANSFER_TOPIC, ZERO_TOPIC)
+        self.block_time = block_time
+        self.genesis = events.attrs['start_unix'] - 1000 * block_time
+        self.head = (events.attrs['end_unix'] - self.genesis) // block_time + 100
+        self.initial = events.attrs['initial']
+        self.event_blocks = (events['timestamp'].values - self.genesis) // block_time
+        self.state = events[['reserve0', 'reserve1', 'supply']].values
+
+        user = "0x" + "0" * 24 + "7a250d5630b4cf539739df2c5dacb4c659f2488d"
+        pair = "0x" + "0" * 24 + PAIR[2:]
+        logs = []
+        log_index = 0
+        for (i, event) in enumerate(events.itertuples()):
+            block = int(self.event_blocks[i])
+            if i == 0 or block != self.event_blocks[i - 1]:
+                log_index = 0
+            sync = (SYNC_TOPIC, [], [event.reserve0, event.reserve1])
+            if event.kind == 'swaps':
+                entries = [sync, (SWAP_TOPIC, [user, user],
+                                  [event.amount0In, event.amount1In, event.amount0Out, event.amount1Out])]
+            elif event.kind == 'mints':
+                entries = [(TRANSFER_TOPIC, [ZERO_TOPIC, user], [event.liquidity]), sync,
+                           (MINT_TOPIC, [user], [event.amount0In, event.amount1In])]
+            else:
+                entries = [(TRANSFER_TOPIC, [pair, ZERO_TOPIC], [event.liquidity]), sync,
+                           (BURN_TOPIC, [user, user], [event.amount0In, event.amount1In])]
+            for (topic, indexed, words) in entries:
+                logs.append({'address': PAIR,
+                             'topics': [topic] + indexed,
+                             'data': '0x' + ''.join(f'{to_wei(word):064x}' for word in words),
+                             'blockNumber': hex(block),
+                             'transactionHash': f"0x{i:064x}",
+                             'logIndex': hex(log_index),
+                             'removed': False})
+                log_index += 1
+        self.logs = logs
+        self.log_blocks = np.array([int(log['blockNumber'], 16) for log in logs])
+
+    def handle(self, body, page_size: int):
+        if isinstance(body, list):
+            return [self.handle(request, page_size) for request in body]
+        response = {'jsonrpc': '2.0', 'id': body.get('id')}
+        try:
+            method = getattr(self, body['method'])
+        except AttributeError:
+            return {**response, 'error': {'code': -32601, 'message': "Method not found"}}
+        try:
+            return {**response, 'result': method(*body['params'], page_size=page_size)}
+        except ValueError as e:
+            return {**response, 'error': {'code': -32005, 'message': str(e)}}
+
+    def _block_number(self, tag: str) -> int:
+        return self.head if tag == 'latest' else int(tag, 16)
+
+    def eth_blockNumber(self, page_size: int) -> str:
+        return hex(self.head)
+
+    def eth_getBlockByNumber(self, tag: str, full: bool, page_size: int) -> dict:
+        number = self._block_number(tag)
+        return {'number': hex(number),
+                'hash': f"0x{number:064x}",
+                'timestamp': hex(self.genesis + number * self.block_time)}
+
+    def eth_getLogs(self, log_filter: dict, page_size: int) -> List[dict]:
+        lo = np.searchsorted(self.log_blocks, self._block_number(log_filter['fromBlock']), 'left')
+        hi = np.searchsorted(self.log_blocks, self._block_number(log_filter['toBlock']), 'right')
+        if hi - lo > page_size:
+            raise ValueError(f"query returned more than {page_size} results")
+        topics = log_filter.get('topics') or [None]
+        return [log for log in self.logs[lo:hi] if topics[0] is None or log['topics'][0] in topics[0]]
+
+    def eth_call(self, call: dict, tag: str, page_size: int) -> str:
+        from chain_data import TOTAL_SUPPLY_SELECTOR
+        if call['data'] != TOTAL_SUPPLY_SELECTOR:
+            raise ValueError("execution reverted")
+        last_event = np.searchsorted(self.event_blocks, self._block_number(tag), 'right') - 1
+        supply = self.state[last_event, 2] if last_event >= 0 else self.initial[2]
+        return f'0x{to_wei(supply):064x}'
+
+
+class StubServer():
+    """
+    Local HTTP server answering the requests from a source, with a fixed
+    `latency` added on each request and at most `page_size` entities on
+    each page (or logs on each `eth_getLogs` result).
+    """
+
+    def __init__(self, source, host: str = '127.0.0.1', port: int = 0,
+                 latency: float = 0.0, page_size: int = 1000) -> None:
+        self.source = source
+        self.latency = latency
+        self.page_size = page_size
+        self.requests = 0
+        self._lock = Lock()
+        self._server = ThreadingHTTPServer((host, port), _Handler)
+        self._server.stub = self
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        (host, port) = self._server.server_address[:2]
+        return f'http://{host}:{port}/'
+
+    def start(self) -> 'StubServer':
+        self._thread = Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self) -> 'StubServer':
+        return self.start()
+
+    def __exit__(self, *args) -> None:
+        self.stop()
+
+
+class _Handler(BaseHTTPRequestHandler):
+
+    def do_POST(self) -> None:
+        stub = self.server.stub
+        with stub._lock:
+            stub.requests += 1
+        time.sleep(stub.latency)
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        response = stub.source.handle(body, stub.page_size)
+        payload = json.dumps(response).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args) -> None:
+        pass
+
+
+@click.group()
+def cli() -> None:
+    """
+    Offline subgraph stub server. Point `Data` to it through the
+    UNISWAP_SUBGRAPH_URL environment variable.
+    """
+    pass
+
+
+@cli.command()
+@click.option('--start-date', 'start_date', default='2021-07-01', help="First day of the stream")
+@click.option('--days', 'days', default=14, help="Number of days of the stream")
+@click.option('--events-per-day', 'events_per_day', default=2000, help="Events per day")
+@click.option('--latency', 'latency', default=0.0, help="Seconds added to each request")
+@click.option('--page-size', 'page_size', default=1000, help="Maximum entities per page")
+@click.option('--port', 'port', default=8000, help="Port to listen on")
+def synthetic(start_date, days, events_per_day, latency, page_size, port) -> None:
+    events = synthetic_events(datetime.fromisoformat(start_date), days, events_per_day)
+    serve(SyntheticSource(synthetic_entities(events)), port, latency, page_size)
+
+
+@cli.command()
+@click.option('--start-date', 'start_date', default='2021-07-01', help="First day of the stream")
+@click.option('--days', 'days', default=14, help="Number of days of the stream")
+@click.option('--events-per-day', 'events_per_day', default=2000, help="Events per day")
+@click.option('--latency', 'latency', default=0.0, help="Seconds added to each request")
+@click.option('--max-logs', 'max_logs', default=10000, help="Maximum logs per eth_getLogs")
+@click.option('--port', 'port', default=8545, help="Port to listen on")
+def rpc(start_date, days, events_per_day, latency, max_logs, port) -> None:
+    """
+    JSON-RPC node stub. Point `chain_data` to it through the ETH_RPC_URL
+    environment variable.
+    """
+    events = synthetic_events(datetime.fromisoformat(start_date), days, events_per_day)
+    serve(JsonRpcSource(events), port, latency, max_logs)
+
+
+@cli.command()
+@click.argument('fixtures')
+@click.option('--record', 'record', is_flag=True, help="Record missing queries from the hosted subgraph")
+@click.option('--latency', 'latency', default=0.0, help="Seconds added to each request")
+@click.option('--port', 'port', default=8000, help="Port to listen on")
+def replay(fixtures, record, latency, port) -> None:
+    from Data import hosted_graph_url
+    serve(FixtureSource(fixtures, hosted_graph_url if record else None), port, latency)
+
+
+def serve(source, port: int, latency: float, page_size: int = 1000) -> None:
+    server = StubServer(source, port=port, latency=latency, page_size=page_size)
+    print(f"Serving on {server.url}")
+    try:
+        server._server.serve_forever()
+    except KeyboardInterrupt:
+        server._server.server_close()
+
+
+if __name__ == '__main__':
+    cli()
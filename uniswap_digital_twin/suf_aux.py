@@ -1,4 +1,4 @@
-from policy_aux import get_output_amount
+from policy_aux import get_output_amount, exact_math
 
 
 # RAI functions
@@ -14,7 +14,9 @@ def removeLiquidity_RAI(_params, substep, sH, s, _input):
 
 
 def ethToToken_RAI(_params, substep, sH, s, _input):
-    delta_I = int(_input['eth_sold']) #amount of ETH being sold by the user
+    delta_I = _input['eth_sold'] #amount of ETH being sold by the user
+    if not exact_math(_params):
+        delta_I = int(delta_I)
     I_t = s['ETH_balance']
     O_t = s['RAI_balance']
     if delta_I == 0: